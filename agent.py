@@ -1,16 +1,22 @@
 # agent.py
 
 # Standard library imports
-import json
 import os
-from typing import Optional, Tuple
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
 
 # Third-party imports
 from dotenv import load_dotenv
 
 # Local application/library specific imports
+import context_renderer
 import database as db
-from llm_client import LlmClient
+import model_router
+import prompts
+import retrieval_policy
+import tracing
+from llm_client import ERROR_RESPONSE, LlmClient, response_cache_key
+from summarizer import HISTORY_TAIL_MESSAGES, ConversationSummarizer
 
 # --- INITIALIZATION ---
 
@@ -25,27 +31,41 @@ if not groq_api_key:
 # Instantiate the LLM client once to be reused.
 llm = LlmClient(api_key=groq_api_key)
 
-# --- HELPER FUNCTION ---
-def truncate_context_chunks(chunks: list[dict], max_length: int = 750) -> list[dict]:
-    """Truncates the 'content' of each dictionary in a list to a maximum length.
+# Background worker that keeps a rolling summary of older messages per session.
+# It has its own client, so its failures never open the circuit breaker of live turns.
+summarizer = ConversationSummarizer(LlmClient(api_key=groq_api_key))
 
-    This function is used to shorten long text chunks, typically to ensure the total
-    context sent to a language model fits within its context window or token limit.
+# How long a session turn waits for its messages to reach the graph before returning.
+SESSION_FLUSH_TIMEOUT_S = float(os.getenv("SESSION_FLUSH_TIMEOUT_S", "5"))
 
-    Args:
-        chunks (list[dict]): A list of dictionaries, where each dictionary represents
-            a document chunk and is expected to have a 'content' key.
-        max_length (int, optional): The maximum number of characters to keep for
-            the 'content' of each chunk. Defaults to 750.
+# Records are rendered into the prompt as compact tables unless CONTEXT_FORMAT=json.
+renderer = context_renderer.get_renderer()
 
-    Returns:
-        list[dict]: The list of chunks with their 'content' fields truncated
-        where necessary. Note that the list is modified in-place.
-    """
-    for chunk in chunks:
-        if 'content' in chunk and len(chunk['content']) > max_length:
-            chunk['content'] = chunk['content'][:max_length] + "..."
-    return chunks
+# Log the static size of every prompt once, to compare prompt versions.
+print(f"INFO: Prompt registry:\n{prompts.describe()}")
+
+# Number of newest tickets listed for ticket history questions; older ones are only counted.
+RECENT_TICKETS_IN_CONTEXT = int(os.getenv("RECENT_TICKETS_IN_CONTEXT", "5"))
+# A new issue this close (cosine distance) to a resolved ticket is a known problem:
+# the raw query is searched as is, without the LLM query refinement call.
+SIMILAR_TICKET_SKIP_REFINEMENT_DISTANCE = float(os.getenv("SIMILAR_TICKET_SKIP_REFINEMENT_DISTANCE", "0.25"))
+
+
+def _finish_turn(user_id: str, session_id: str, user_query: str, final_response: str) -> None:
+    """Saves the turn to the conversation memory and schedules the summary update."""
+    # Queued to the durable memory outbox; the graph write happens in the background.
+    with tracing.span("memory_write"):
+        db.save_message(user_id, session_id, user_query, "user")
+        db.save_message(user_id, session_id, final_response, "agent")
+    # Fold messages that just left the recent-history window into the summary, off the critical path.
+    summarizer.schedule(session_id)
+
+
+def _answer_from_template(user_id: str, session_id: str, user_query: str, final_response: str) -> None:
+    """Records a turn answered locally by `model_router` without calling an LLM."""
+    tracing.set_turn_attributes(model_tier=model_router.TIER_TEMPLATE)
+    model_router.routing_stats.record(model_router.TIER_TEMPLATE, 0.0)
+    _finish_turn(user_id, session_id, user_query, final_response)
 
 
 # --- MAIN AGENT FUNCTION ---
@@ -53,7 +73,8 @@ def get_agent_response(
     user_id: str,
     session_id: str,
     user_query: str,
-    active_ticket_id: Optional[str] = None
+    active_ticket_id: Optional[str] = None,
+    on_token: Optional[Callable[[str], None]] = None
 ) -> Tuple[str, Optional[str]]:
     """Orchestrates the AI agent's response generation for a user query.
 
@@ -87,6 +108,11 @@ def get_agent_response(
         active_ticket_id (Optional[str], optional): The ID of a ticket that is
             the current focus of the conversation. This maintains context across
             multiple turns. Defaults to None.
+        on_token (Optional[Callable[[str], None]], optional): If given, the
+            synthesized response is streamed to it chunk by chunk while the
+            model generates it (see `LlmClient.stream_response`). Answers that
+            need no synthesis call (templates, ticket creation) are not passed
+            to it. Defaults to None.
 
     Returns:
         Tuple[str, Optional[str]]: A tuple containing:
@@ -96,80 +122,165 @@ def get_agent_response(
           by the calling application to maintain state. It can be a newly
           identified, newly created, or previously active ticket ID.
     """
-    
-    # --- 1. ANALYZE USER INTENT ---
-    intent_system_prompt = """
-    You are an expert intent classification system. Your task is to analyze a user's query
-    and output a JSON object with two keys: "intent" and "ticket_id".
-    The "intent" can be one of:
-    - "ticket_inquiry": The user is asking about a SPECIFIC ticket and provides a ticket ID.
-    - "ticket_history_inquiry": The user is asking about their tickets in general (e.g., "what's my ticket status?", "my last ticket", "list all my tickets").
-    - "ticket_creation_request": The user is explicitly asking to create a ticket (e.g., "can you create a ticket?", "yes, please create one").
-    - "new_issue": The user is describing a new problem for the first time.
-    - "general_question": The user is asking a general informational question.
-    - "greeting": A simple greeting.
-
-    The "ticket_id" should be the extracted ticket ID if the intent is "ticket_inquiry", otherwise it must be null.
-    You must always respond with ONLY the JSON object and nothing else.
+    with tracing.turn(user_id=user_id, session_id=session_id):
+        return _get_agent_response(user_id, session_id, user_query, active_ticket_id, on_token)
+
+
+class SessionBusy(Exception):
+    """Raised when another worker is already running a turn of the session."""
+
+
+def respond_in_session(
+    session_id: str,
+    user_query: str,
+    on_token: Optional[Callable[[str], None]] = None
+) -> Optional[Dict[str, Any]]:
+    """Runs one turn of a registered conversation, keeping its state server-side.
+
+    Unlike `get_agent_response`, the caller only passes the session ID: the
+    owning user and the active ticket are read from `conversation_sessions`
+    and the new active ticket is written back after the turn. Any app process
+    or API worker can therefore serve any turn of any conversation:
+
+    - A turn lease on the session row (`db.begin_session_turn`) lets only one
+      turn of a conversation run at a time, across all processes.
+    - Before the lease is released, the session's messages in the memory
+      outbox are flushed (not the backlog of other sessions), so the next
+      turn sees this one in its history on whichever worker it runs.
+
+    Args:
+        session_id (str): A session created with `database.create_session`.
+        user_query (str): The raw text input from the user.
+        on_token (Optional[Callable[[str], None]], optional): Receives the
+            synthesized response as it streams. See `get_agent_response`.
+
+    Returns:
+        Optional[Dict[str, Any]]: 'session_id', 'response' and
+        'active_ticket_id', or None if the session does not exist.
+
+    Raises:
+        SessionBusy: If a turn of the session is already running.
     """
-    intent_user_prompt = f"Analyze the following user's query: \"{user_query}\""
-    
-    intent_data = llm.generate_intent(
-        system_prompt=intent_system_prompt,
-        user_prompt=intent_user_prompt
-    )
+    session = db.begin_session_turn(session_id)
+    if session is None:
+        return None
+    if session["turn_token"] is None:
+        raise SessionBusy("A turn of this session is already running.")
+    try:
+        response, active_ticket_id = get_agent_response(
+            session["user_id"], session_id, user_query, session["active_ticket_id"], on_token
+        )
+        if not db.flush_message_outbox(session_id, SESSION_FLUSH_TIMEOUT_S):
+            print(f"Warning: Messages of session {session_id} are not in the graph yet; "
+                  "a turn served by another worker may miss them.")
+    except Exception:
+        db.end_session_turn(session_id, session["turn_token"])
+        raise
+    db.update_session(session_id, active_ticket_id, turn_token=session["turn_token"])
+    return {"session_id": session_id, "response": response, "active_ticket_id": active_ticket_id}
+
+
+def _get_agent_response(
+    user_id: str,
+    session_id: str,
+    user_query: str,
+    active_ticket_id: Optional[str],
+    on_token: Optional[Callable[[str], None]] = None
+) -> Tuple[str, Optional[str]]:
+    """Runs the agent pipeline for one turn. See `get_agent_response`."""
+
+    # --- 1. ANALYZE USER INTENT ---
+    with tracing.span("intent_llm"):
+        intent_system_prompt, intent_user_prompt = prompts.INTENT.render(user_query=user_query)
+        intent_data = llm.generate_intent(
+            system_prompt=intent_system_prompt,
+            user_prompt=intent_user_prompt,
+            # Used if the intent model fails or its circuit breaker is open.
+            fallback=model_router.classify_intent_locally(user_query)
+        )
+
+    intent = intent_data.get("intent", "general_question")
+    tracing.set_turn_attributes(intent=intent)
+
+    # Greetings need no context at all, so they are answered from a template.
+    if intent == "greeting":
+        final_response = model_router.GREETING_RESPONSE
+        _answer_from_template(user_id, session_id, user_query, final_response)
+        return final_response, active_ticket_id
 
     # --- 2. GATHER AND PROCESS CONTEXT FROM TOOLS ---
     
     context = ""
     search_query = user_query
+    # Precomputed embedding of `search_query` (e.g. a ticket's stored vector), if any.
+    search_embedding = None
+    similar_tickets = []
     active_ticket_id_for_turn = active_ticket_id
-    history = db.get_conversation_history(session_id)
+    history = db.get_conversation_history(session_id, n=HISTORY_TAIL_MESSAGES)
+    conversation_summary = db.get_session_summary(session_id)["summary"]
     search_query_proactively_set = False
+    # Set once the context holds anything specific to this user or session;
+    # such answers are never served to anyone else from the fallback cache.
+    user_context = bool(history or conversation_summary)
 
     if active_ticket_id_for_turn:
-        ticket_details = db.get_ticket_details(active_ticket_id_for_turn)
+        ticket_details = db.get_ticket_details(active_ticket_id_for_turn, include_embedding=True)
         if ticket_details:
-            context += f"CURRENT ACTIVE TICKET CONTEXT: {json.dumps(ticket_details)}\n"
+            search_embedding = ticket_details.pop("embedding")
+            context += f"CURRENT ACTIVE TICKET CONTEXT: {renderer.ticket(ticket_details)}\n"
+            user_context = True
             search_query = ticket_details.get('description', user_query)
             search_query_proactively_set = True
             print(f"INFO: Search query proactively set from active ticket {active_ticket_id_for_turn}: '{search_query}'")
 
-    intent = intent_data.get("intent", "general_question")
-
     if intent == "ticket_inquiry":
         ticket_id = intent_data.get("ticket_id")
         if ticket_id:
             active_ticket_id_for_turn = ticket_id
-            ticket_details = db.get_ticket_details(ticket_id)
+            ticket_details = db.get_ticket_details(ticket_id, include_embedding=True)
             if ticket_details and ticket_details.get('user_id') == user_id:
-                context += f"Ticket Information: {json.dumps(ticket_details)}\n"
+                ticket_embedding = ticket_details.pop("embedding")
+                # A pure status lookup is answered from the ticket fields, skipping retrieval and the LLM.
+                if model_router.is_status_lookup(user_query):
+                    final_response = model_router.render_ticket_status(ticket_details)
+                    _answer_from_template(user_id, session_id, user_query, final_response)
+                    return final_response, active_ticket_id_for_turn
+                context += f"Ticket Information: {renderer.ticket(ticket_details)}\n"
+                user_context = True
                 search_query = ticket_details['description']
+                search_embedding = ticket_embedding
                 search_query_proactively_set = True
             elif not ticket_details:
-                context += f"Ticket Information: No ticket found with ID {ticket_id}.\n"
+                final_response = model_router.render_ticket_not_found(ticket_id)
+                _answer_from_template(user_id, session_id, user_query, final_response)
+                # As before the template, the requested ticket becomes the active one.
+                return final_response, active_ticket_id_for_turn
 
     elif intent == "ticket_history_inquiry":
-        user_tickets = db.get_tickets_by_user(user_id)
-        if user_tickets:
-            latest_ticket = user_tickets[0]
-            context += f"The user's complete ticket history is: {json.dumps(user_tickets)}\n"
+        user_context = True
+        ticket_summary = db.get_ticket_summary(user_id, recent=RECENT_TICKETS_IN_CONTEXT)
+        if ticket_summary and ticket_summary["recent"]:
+            latest_ticket = ticket_summary["recent"][0]
+            context += f"The user's ticket history summary is: {renderer.ticket_summary(ticket_summary)}\n"
             active_ticket_id_for_turn = latest_ticket['ticket_id']
             search_query = latest_ticket['description']
+            search_embedding = None
             search_query_proactively_set = True
-            print(f"INFO: Added full ticket history. Set active ticket to {active_ticket_id_for_turn} for next turn.")
+            print(f"INFO: Added ticket history summary ({ticket_summary['total']} tickets). Set active ticket to {active_ticket_id_for_turn} for next turn.")
         else:
             context += "User's Ticket History: This user has no tickets on record.\n"
 
     elif intent == "conversation_history_inquiry":
         # The history is already fetched at the beginning of the function.
         # We just need to add it to the context for the final LLM.
+        # (The summary of older messages is added below with the shared context.)
         if history:
-            context += f"The user's recent conversation history is: {json.dumps(history)}\n"
-        else:
+            context += f"The user's recent conversation history is: {renderer.history(history)}\n"
+        elif not conversation_summary:
             context += "There is no conversation history for this session yet.\n"
         # We don't need to do a RAG search for this, so we can clear the search query.
         search_query = ""
+        search_embedding = None
     
     elif intent == "ticket_creation_request":
         # Initialize final_response for this block
@@ -202,58 +313,87 @@ def get_agent_response(
             final_response = "I'm sorry, I couldn't find a previous problem description to create a ticket from. Please describe your issue first."
             
         # --- IMPORTANT: We have handled the action, so update memory and return early ---
-        db.add_message_to_graph(user_id, session_id, user_query, "user")
-        db.add_message_to_graph(user_id, session_id, final_response, "agent")
+        _finish_turn(user_id, session_id, user_query, final_response)
         return final_response, active_ticket_id_for_turn
 
     elif intent in ["new_issue", "general_question"] and not search_query_proactively_set:
-        query_refinement_system_prompt = "You are an expert at extracting concise technical search queries from user descriptions of problems. Respond with only the refined search query, no other text."
-        query_refinement_user_prompt = f"Extract the core problem or keywords from the user's query: \"{user_query}\""
-        refined_search_query = llm.generate_response(system_prompt=query_refinement_system_prompt, user_prompt=query_refinement_user_prompt).strip()
-        if refined_search_query and refined_search_query.lower() != user_query.lower():
+        # A new issue that matches a resolved ticket is searched as is, skipping the refinement call.
+        if intent == "new_issue":
+            with tracing.span("embedding"):
+                search_embedding = db.embed_query(user_query)
+            similar_tickets = db.find_similar_tickets(search_embedding)
+            if similar_tickets and similar_tickets[0]["distance"] <= SIMILAR_TICKET_SKIP_REFINEMENT_DISTANCE:
+                search_query_proactively_set = True
+                print(f"INFO: New issue matches resolved ticket {similar_tickets[0]['ticket_id']}; skipping query refinement.")
+    if intent in ["new_issue", "general_question"] and not search_query_proactively_set:
+        with tracing.span("refinement_llm"):
+            query_refinement_system_prompt, query_refinement_user_prompt = prompts.REFINEMENT.render(user_query=user_query)
+            # Keyword extraction is a simple task, so it always runs on the small model.
+            refined_search_query = llm.generate_response(
+                system_prompt=query_refinement_system_prompt,
+                user_prompt=query_refinement_user_prompt,
+                tier=model_router.TIER_SMALL,
+                # The refinement prompt holds nothing but the query.
+                cache_key=response_cache_key(model_router.TIER_SMALL, "refinement", user_query)
+            ).strip()
+        # A failed refinement returns the error message, which is no search query.
+        if refined_search_query and refined_search_query != ERROR_RESPONSE and refined_search_query.lower() != user_query.lower():
             search_query = refined_search_query
+            search_embedding = None
             print(f"INFO: Search query refined for '{intent}': '{search_query}'")
 
+    knowledge_chunks = []
     if intent not in ["greeting"]:
+        if conversation_summary:
+            context += f"Summary of the earlier conversation: {conversation_summary}\n"
         if history:
-            context += f"Current Conversation History: {json.dumps(history)}\n"
+            context += f"Current Conversation History: {renderer.history(history)}\n"
         
-        knowledge_chunks = db.query_vector_db(search_query, k=3)
+        # Known resolutions of similar issues (the ticket's stored embedding is reused).
+        if search_embedding is not None and not similar_tickets:
+            similar_tickets = db.find_similar_tickets(search_embedding, exclude_ticket_id=active_ticket_id_for_turn)
+        if similar_tickets:
+            context += f"Similar Resolved Tickets: {renderer.similar_tickets(similar_tickets)}\n"
+
+        # k, the distance cutoff and the size budget depend on the intent.
+        policy = retrieval_policy.for_intent(intent)
+        if policy.k:
+            # Only search the documentation of the PostgreSQL version the customer runs.
+            knowledge_chunks = db.query_vector_db(
+                search_query, k=policy.fetch_k, pg_version=db.resolve_doc_version(user_id),
+                query_embedding=search_embedding, include_embeddings=policy.diversify
+            )
         if knowledge_chunks:
-            processed_chunks = truncate_context_chunks(knowledge_chunks)
-            context += f"Relevant Knowledge Base Articles: {json.dumps(processed_chunks)}\n"
+            with tracing.span("context_build"):
+                knowledge_chunks = policy.select(knowledge_chunks)
+                context += f"Relevant Knowledge Base Articles: {renderer.articles(knowledge_chunks)}\n"
     
     MAX_TOKENS_SAFETY_MARGIN = 10000
     if len(context) > MAX_TOKENS_SAFETY_MARGIN:
         context = context[:MAX_TOKENS_SAFETY_MARGIN]
+    tracing.set_turn_attributes(context_chars=len(context))
 
     # --- 3. SYNTHESIZE THE FINAL RESPONSE ---
 
-    rag_system_prompt = """
-    You are a helpful and personable expert PostgreSQL support agent. Your goal is to assist users by providing direct answers and solutions in a conversational way.
-
-    Your primary task is to answer the user's query based *only* on the information provided in the Context.
-
-    Here are your rules in order of priority:
-    1.  **List All Tickets:** If the user asks for their tickets and the Context contains "The user's complete ticket history", you MUST list all the tickets provided. Start your response with a friendly phrase like "Here is a list of your tickets:" and format them clearly using a bulleted list.
-    2.  **Summarize Conversation:** If the user asks about their past questions (e.g., "what did I ask?") and the Context contains "The user's recent conversation history", you MUST summarize the 'user' messages from that history.
-    3.  **Summarize Single Tickets:** If the Context contains "Ticket Information" or "CURRENT ACTIVE TICKET CONTEXT", summarize the ticket's status and description for the user.
-    4.  **Answer from Knowledge Base (Provide Solutions, Not Just Links):** If the Context contains "Relevant Knowledge Base Articles", your main goal is to act as an expert who has read them.
-        - You MUST synthesize a direct answer by summarizing the key information and steps from the article 'content'.
-        - Explain the potential solutions to the user in your own words.
-        - **DO NOT just provide a list of links.** Your primary response must be the explanation.
-        - You MAY include the URL at the end of your explanation as a reference for the user to learn more, but the answer itself comes first.
-    5.  **Handle New Issues (Offer to Create a Ticket):** If the user describes a new issue and the provided articles do not seem to solve their specific problem, you MUST acknowledge this and then offer to create a ticket for them. For example: "I found some articles about server setup and authentication, but they might not solve your specific installation issue. Would you like me to create a ticket for this?"
-    6.  **Fallback:** If, after following all the rules above, you genuinely cannot find any relevant information in the context to answer the query, you should say: "I'm sorry, I couldn't find specific information on that topic in my knowledge base."
-    7.  **Style:** Never mention the words "Context" or "Knowledge Base" in your response. Be friendly and helpful.
-    """
-    rag_user_prompt = f"""Context:\n---\n{context}\n---\nUser's Query: {user_query}\n\nBased ONLY on the context provided, generate a helpful and concise response according to your rules."""
-    
-    final_response = llm.generate_response(system_prompt=rag_system_prompt, user_prompt=rag_user_prompt)
+    # Knowledge base synthesis goes to the large model; short context-only answers to the small one.
+    tier = model_router.choose_tier(context, bool(knowledge_chunks))
+    tracing.set_turn_attributes(model_tier=tier)
+    # Answers built only from the knowledge base can be served again if the provider is down.
+    cache_key = None
+    if not user_context:
+        cache_key = response_cache_key(tier, intent, user_query, [chunk["url"] for chunk in knowledge_chunks])
+    synthesis_start = time.perf_counter()
+    with tracing.span("synthesis_llm", tier=tier, streamed=on_token is not None):
+        # Static rules first, then the variable context, with the query last (see prompts.py).
+        rag_system_prompt, rag_user_prompt = prompts.SYNTHESIS.render(context=context, user_query=user_query)
+        if on_token:
+            final_response = llm.stream_response(system_prompt=rag_system_prompt, user_prompt=rag_user_prompt, on_token=on_token, tier=tier, cache_key=cache_key)
+        else:
+            final_response = llm.generate_response(system_prompt=rag_system_prompt, user_prompt=rag_user_prompt, tier=tier, cache_key=cache_key)
+    model_router.routing_stats.record(tier, (time.perf_counter() - synthesis_start) * 1000)
 
     # --- 4. UPDATE MEMORY ---
-    db.add_message_to_graph(user_id, session_id, user_query, "user")
-    db.add_message_to_graph(user_id, session_id, final_response, "agent")
+    _finish_turn(user_id, session_id, user_query, final_response)
     
     # --- 5. RETURN RESULTS ---
     return final_response, active_ticket_id_for_turn
\ No newline at end of file
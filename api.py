@@ -0,0 +1,356 @@
+# api.py
+
+"""
+Headless HTTP (ASGI) entry point for the support agent.
+
+Conversations are server-side resources: a client creates a session for a
+user and then posts messages to it. The owning user and the active ticket are
+stored in the `conversation_sessions` table, not in the client, so any number
+of workers can run behind a load balancer and serve any turn.
+
+The agent pipeline is synchronous (psycopg2, Groq SDK), so turns run on a
+dedicated thread pool while the event loop only holds idle connections and
+open streams. Admission control bounds the work per process: at most
+`API_MAX_INFLIGHT_TURNS` turns run at once, at most `API_MAX_QUEUED_TURNS`
+wait (each for up to `API_QUEUE_TIMEOUT_S`), and anything beyond that is
+rejected immediately with 503 and `Retry-After` instead of piling up. A
+session can only run one turn at a time (409 otherwise), which keeps its
+active ticket consistent. Within a process this is checked on admission;
+across workers by the session's turn lease (`db.begin_session_turn`), and
+each turn's messages reach the graph before its response is returned, so
+the next turn can run on any worker without session-sticky routing.
+
+Endpoints:
+    POST /sessions                      {"user_id": 1}      -> {"session_id": ...}
+    GET  /sessions?user_id=1&limit=20                       -> recent sessions of a user
+    GET  /sessions/{session_id}                             -> session state
+    GET  /sessions/{session_id}/messages?n=20               -> recent history
+    POST /sessions/{session_id}/messages {"message": "..."} -> {"response": ..., "active_ticket_id": ...}
+    POST /sessions/{session_id}/messages/stream {"message": "..."}
+        -> text/event-stream: `token` events ({"text": ...}) whose texts add
+           up to the response, then one `done` event (the JSON of the
+           non-streaming endpoint) or an `error` event.
+    GET  /stats                                             -> admission and DB pool counters
+    GET  /healthz                                           -> 200 while the process is alive
+    GET  /readyz                                            -> 200 once warmed up and the DB answers, else 503
+
+On startup the embedding model, the DB pool and the Groq connection are
+warmed up in the background (see `startup.py`); point the load balancer's
+readiness check at `/readyz` so no turn pays for a cold start.
+
+Usage:
+    uvicorn api:app --host 0.0.0.0 --port 8000 --workers 4
+
+Every worker process locks its own memory outbox file (a slot of
+`MEMORY_OUTBOX_PATH`, see `memory_outbox.py`), so workers never replay or
+delete each other's queued messages.
+"""
+
+# Standard library imports
+import asyncio
+import contextlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict, Optional
+
+# Third-party imports
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+# Local application/library specific imports
+import agent
+import database as db
+import startup
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+MAX_MESSAGE_CHARS = 4000
+# Turns running at once per process. Turns mostly wait on the LLM, so this can
+# exceed the DB pool size (DB_POOL_MAXCONN); connections are only held per query.
+API_MAX_INFLIGHT_TURNS = int(os.getenv("API_MAX_INFLIGHT_TURNS", "32"))
+API_MAX_QUEUED_TURNS = int(os.getenv("API_MAX_QUEUED_TURNS", "64"))
+API_QUEUE_TIMEOUT_S = float(os.getenv("API_QUEUE_TIMEOUT_S", "10"))
+
+
+class Overloaded(Exception):
+    """Raised when a turn is not admitted; carries the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class TurnAdmission:
+    """Bounds the agent turns running and waiting in this process.
+
+    All methods except `release_threadsafe` must be called on the event loop.
+    """
+
+    def __init__(self, max_inflight: int, max_queued: int, queue_timeout_s: float):
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.queue_timeout_s = queue_timeout_s
+        self._slots = asyncio.Semaphore(max_inflight)
+        self._sessions = set()
+        self.inflight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    async def acquire(self, session_id: str) -> None:
+        """Waits for a turn slot for `session_id`.
+
+        Raises:
+            Overloaded: 409 if the session already has a turn running, 503 if
+                the wait queue is full or the wait timed out.
+        """
+        if session_id in self._sessions:
+            raise Overloaded(409, "A turn of this session is already running.")
+        if self._slots.locked() and self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise Overloaded(503, "The server is busy. Please retry shortly.")
+        self._sessions.add(session_id)
+        self.waiting += 1
+        admitted = False
+        try:
+            await asyncio.wait_for(self._slots.acquire(), self.queue_timeout_s)
+            admitted = True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(503, "The server is busy. Please retry shortly.")
+        finally:
+            self.waiting -= 1
+            if not admitted:
+                self._sessions.discard(session_id)
+        self.inflight += 1
+        self.admitted += 1
+
+    def release(self, session_id: str) -> None:
+        self.inflight -= 1
+        self._sessions.discard(session_id)
+        self._slots.release()
+
+    def release_threadsafe(self, loop: asyncio.AbstractEventLoop, session_id: str) -> None:
+        """Releases the slot from a worker thread once its turn has finished."""
+        loop.call_soon_threadsafe(self.release, session_id)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "max_inflight": self.max_inflight,
+            "max_queued": self.max_queued,
+            "inflight": self.inflight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+admission = TurnAdmission(API_MAX_INFLIGHT_TURNS, API_MAX_QUEUED_TURNS, API_QUEUE_TIMEOUT_S)
+# One thread per admitted turn, so admitted turns never queue behind each other.
+turn_executor = ThreadPoolExecutor(max_workers=API_MAX_INFLIGHT_TURNS, thread_name_prefix="agent-turn")
+
+
+def _error(status_code: int, message: str) -> JSONResponse:
+    headers = {"Retry-After": "1"} if status_code == 503 else None
+    return JSONResponse({"error": message}, status_code=status_code, headers=headers)
+
+
+async def _validated_message(request: Request) -> Any:
+    """Returns the posted message, or a JSONResponse describing why it is invalid."""
+    body = await _json_body(request)
+    message = body.get("message")
+    if not isinstance(message, str) or not message.strip():
+        return _error(400, "'message' (non-empty string) is required.")
+    if len(message) > MAX_MESSAGE_CHARS:
+        return _error(413, f"'message' is longer than {MAX_MESSAGE_CHARS} characters.")
+    return message
+
+
+def _start_turn(session_id: str, message: str, on_token=None) -> "asyncio.Future[Optional[Dict[str, Any]]]":
+    """Runs an admitted turn on the turn executor and releases its slot when it ends.
+
+    The slot is released by the worker thread itself, so a client that
+    disconnects mid-turn keeps the slot until the turn (and its memory write)
+    has actually finished.
+    """
+    loop = asyncio.get_running_loop()
+
+    def run() -> Optional[Dict[str, Any]]:
+        try:
+            return agent.respond_in_session(session_id, message, on_token=on_token)
+        finally:
+            admission.release_threadsafe(loop, session_id)
+
+    return loop.run_in_executor(turn_executor, run)
+
+
+def _sse(event: str, data: Dict[str, Any]) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _json_body(request: Request) -> dict:
+    try:
+        body = await request.json()
+    except ValueError:
+        return {}
+    return body if isinstance(body, dict) else {}
+
+
+async def create_session(request: Request) -> JSONResponse:
+    body = await _json_body(request)
+    user_id = body.get("user_id")
+    if not isinstance(user_id, int):
+        return _error(400, "'user_id' (integer) is required.")
+    session_id = await run_in_threadpool(db.create_session, user_id)
+    if session_id is None:
+        return _error(503, "Could not create the session.")
+    return JSONResponse({"session_id": session_id, "user_id": user_id}, status_code=201)
+
+
+async def list_sessions(request: Request) -> JSONResponse:
+    try:
+        user_id = int(request.query_params["user_id"])
+    except (KeyError, ValueError):
+        return _error(400, "'user_id' (integer) query parameter is required.")
+    try:
+        limit = min(int(request.query_params.get("limit", "20")), 100)
+    except ValueError:
+        return _error(400, "'limit' must be an integer.")
+    sessions = await run_in_threadpool(db.list_sessions, user_id, limit)
+    return JSONResponse({"sessions": sessions})
+
+
+async def get_session(request: Request) -> JSONResponse:
+    session = await run_in_threadpool(db.get_session, request.path_params["session_id"])
+    if session is None:
+        return _error(404, "Unknown session.")
+    return JSONResponse(session)
+
+
+async def get_messages(request: Request) -> JSONResponse:
+    session_id = request.path_params["session_id"]
+    try:
+        n = min(int(request.query_params.get("n", "20")), 100)
+    except ValueError:
+        return _error(400, "'n' must be an integer.")
+    if await run_in_threadpool(db.get_session, session_id) is None:
+        return _error(404, "Unknown session.")
+    history = await run_in_threadpool(db.get_conversation_history, session_id, n)
+    return JSONResponse({"session_id": session_id, "messages": history})
+
+
+async def post_message(request: Request) -> JSONResponse:
+    message = await _validated_message(request)
+    if isinstance(message, JSONResponse):
+        return message
+    session_id = request.path_params["session_id"]
+    try:
+        await admission.acquire(session_id)
+    except Overloaded as e:
+        return _error(e.status_code, str(e))
+    try:
+        result = await _start_turn(session_id, message)
+    except agent.SessionBusy as e:
+        return _error(409, str(e))
+    if result is None:
+        return _error(404, "Unknown session.")
+    return JSONResponse(result)
+
+
+async def stream_message(request: Request):
+    message = await _validated_message(request)
+    if isinstance(message, JSONResponse):
+        return message
+    session_id = request.path_params["session_id"]
+    # Checked up front so an unknown session is a 404 rather than an error event.
+    if await run_in_threadpool(db.get_session, session_id) is None:
+        return _error(404, "Unknown session.")
+    try:
+        await admission.acquire(session_id)
+    except Overloaded as e:
+        return _error(e.status_code, str(e))
+
+    loop = asyncio.get_running_loop()
+    tokens: "asyncio.Queue[str]" = asyncio.Queue()
+    turn = _start_turn(
+        session_id, message, on_token=lambda text: loop.call_soon_threadsafe(tokens.put_nowait, text)
+    )
+
+    async def events() -> AsyncIterator[str]:
+        streamed = False
+        while True:
+            next_token = asyncio.ensure_future(tokens.get())
+            await asyncio.wait({next_token, turn}, return_when=asyncio.FIRST_COMPLETED)
+            if not next_token.done():
+                next_token.cancel()
+                break
+            streamed = True
+            yield _sse("token", {"text": next_token.result()})
+        # Tokens queued by the worker are scheduled before the turn's result.
+        while not tokens.empty():
+            streamed = True
+            yield _sse("token", {"text": tokens.get_nowait()})
+        try:
+            result = turn.result()
+        except agent.SessionBusy as e:
+            yield _sse("error", {"error": str(e)})
+            return
+        except Exception as e:
+            print(f"An error occurred during a streamed turn: {e}")
+            yield _sse("error", {"error": "The turn failed. Please try again."})
+            return
+        if result is None:
+            yield _sse("error", {"error": "Unknown session."})
+            return
+        if not streamed:
+            # Template and ticket answers are not synthesized, so they arrive in one piece.
+            yield _sse("token", {"text": result["response"]})
+        yield _sse("done", result)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def get_stats(request: Request) -> JSONResponse:
+    return JSONResponse({"admission": admission.stats(), "db_pool": db.get_pool_stats()})
+
+
+async def healthz(request: Request) -> JSONResponse:
+    return JSONResponse({"status": "ok"})
+
+
+async def readyz(request: Request) -> JSONResponse:
+    snapshot = startup.state.snapshot()
+    database_ok = await run_in_threadpool(db.check_database) if snapshot["ready"] else False
+    ready = snapshot["ready"] and database_ok
+    return JSONResponse({"ready": ready, "database": database_ok, "startup": snapshot}, status_code=200 if ready else 503)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app: Starlette) -> AsyncIterator[None]:
+    # Warm up in the background: /healthz answers at once, /readyz once warm.
+    startup.start_in_background()
+    yield
+
+
+app = Starlette(lifespan=lifespan, routes=[
+    Route("/sessions", create_session, methods=["POST"]),
+    Route("/sessions", list_sessions, methods=["GET"]),
+    Route("/sessions/{session_id}", get_session, methods=["GET"]),
+    Route("/sessions/{session_id}/messages", get_messages, methods=["GET"]),
+    Route("/sessions/{session_id}/messages", post_message, methods=["POST"]),
+    Route("/sessions/{session_id}/messages/stream", stream_message, methods=["POST"]),
+    Route("/stats", get_stats, methods=["GET"]),
+    Route("/healthz", healthz, methods=["GET"]),
+    Route("/readyz", readyz, methods=["GET"]),
+])
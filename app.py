@@ -1,48 +1,90 @@
 # app.py
 
 import streamlit as st
-from agent import get_agent_response
+from chat_client import make_chat_client
 
 st.title("PostgreSQL AI Support Agent")
 
+
+@st.cache_resource
+def get_chat_client():
+    # A thin client of api.py when AGENT_API_URL is set, else the agent in-process.
+    return make_chat_client()
+
+
+client = get_chat_client()
+
 # --- Session State Initialization ---
 # Initialize all session state variables at the top to avoid errors.
+# Only UI state lives here; the conversation's state (owner, active ticket)
+# is stored server-side in the conversation_sessions table.
 
 if 'current_user' not in st.session_state:
     st.session_state.current_user = None
 
-# Initialize the "working memory" for the active ticket.
-if 'active_ticket_id' not in st.session_state:
-    st.session_state.active_ticket_id = None
+if 'session_id' not in st.session_state:
+    st.session_state.session_id = None
 
 if "messages" not in st.session_state:
     st.session_state.messages = []
 
+
+def start_conversation(user_id: int, session_id: str = None) -> None:
+    """Switches the UI to a new (or an existing) conversation of `user_id`."""
+    st.session_state.current_user = user_id
+    st.session_state.messages = []
+    if session_id is None:
+        # Every new conversation gets its own session ID (a UUID), so browsers
+        # never share a conversation.
+        st.session_state.session_id = client.create_session(user_id)
+    elif client.get_session(session_id):
+        st.session_state.session_id = session_id
+        # Show the tail of the resumed conversation.
+        st.session_state.messages = [
+            {"role": "user" if m["author"] == "user" else "assistant", "content": m["text"]}
+            for m in client.get_messages(session_id, n=20)
+        ]
+    else:
+        st.session_state.session_id = None
+
+
+def stream_reply(session_id: str, prompt: str):
+    """Yields the agent's answer as it streams in (for `st.write_stream`)."""
+    for event, data in client.stream_message(session_id, prompt):
+        if event == "token":
+            yield data["text"]
+        elif event == "error":
+            yield data["error"]
+
+
 # --- User Switching Logic ---
 col1, col2 = st.columns(2)
 with col1:
     if st.button("Switch to User 1 (Has History)"):
-        st.session_state.current_user = 1
-        # A unique session ID
-        st.session_state.session_id = "session_user_1"
-        # Reset chat history 
-        st.session_state.messages = [] 
-        # Reset the active ticket when switching users to prevent context leaks.
-        st.session_state.active_ticket_id = None
+        # User 1 continues the seeded demo conversation (see utils.py).
+        start_conversation(1, "session_user_1")
         st.rerun()
 
 with col2:
     if st.button("Switch to User 2 (New User)"):
-        st.session_state.current_user = 2
-        st.session_state.session_id = "session_user_2"
-        # Reset chat history
-        st.session_state.messages = [] 
-        # Reset the active ticket here as well.
-        st.session_state.active_ticket_id = None
+        start_conversation(2)
         st.rerun()
 
-# --- Main Chat Interface ---
+# --- Conversation Picker ---
 if st.session_state.current_user:
+    with st.sidebar:
+        if st.button("New conversation"):
+            start_conversation(st.session_state.current_user)
+            st.rerun()
+        st.subheader("Recent conversations")
+        for session in client.list_sessions(st.session_state.current_user, limit=10):
+            label = f"{session['updated_at'][:16].replace('T', ' ')} ({session['session_id'][:8]})"
+            if st.button(label, key=f"session-{session['session_id']}"):
+                start_conversation(st.session_state.current_user, session["session_id"])
+                st.rerun()
+
+# --- Main Chat Interface ---
+if st.session_state.current_user and st.session_state.session_id:
     st.header(f"Conversation with User {st.session_state.current_user}")
 
     # Display chat messages from history
@@ -57,22 +99,14 @@ if st.session_state.current_user:
         with st.chat_message("user"):
             st.markdown(prompt)
 
-        # Get agent response
+        # Get agent response, rendered while it is generated.
+        # The active ticket ("working memory") is read and updated server-side.
         with st.chat_message("assistant"):
-            with st.spinner("Thinking..."):
-                response, new_active_ticket_id = get_agent_response(
-                    st.session_state.current_user,
-                    st.session_state.session_id,
-                    prompt,
-                    st.session_state.active_ticket_id # Pass the current state IN
-                )
-                
-                # This is how the agent maintains its "working memory" for the next turn.
-                st.session_state.active_ticket_id = new_active_ticket_id
-                
-                st.markdown(response)
-        
+            response = st.write_stream(stream_reply(st.session_state.session_id, prompt))
+
         # Add agent response to session state
         st.session_state.messages.append({"role": "assistant", "content": response})
+elif st.session_state.current_user:
+    st.error("Could not start a conversation. Please check the database connection.")
 else:
-    st.info("Please select a user to begin the chat.")
\ No newline at end of file
+    st.info("Please select a user to begin the chat.")
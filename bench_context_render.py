@@ -0,0 +1,181 @@
+# bench_context_render.py
+
+"""
+Compares the prompt size of the JSON and compact context renderers.
+
+Builds the context of three kinds of turns for every seeded sample ticket
+(`mock_data/sample_tickets.csv`) with articles from the knowledge base CSV,
+truncated by the same retrieval policies the agent uses:
+
+- "ticket_inquiry": the ticket with its log, the conversation so far, similar
+  resolved tickets and one article.
+- "ticket_history": the ticket summary of the ticket's owner and one article.
+- "new_issue": the conversation, similar resolved tickets and five articles.
+
+Each context is rendered by both renderers of `context_renderer.py`, and the
+report shows the mean characters and tokens per turn and the tokens saved.
+Tokens are counted with `tiktoken` (cl100k_base) when it is installed, as a
+proxy for the Llama tokenizer, and estimated as characters / 4 otherwise.
+No database or API key is needed.
+
+Usage:
+    python3 bench_context_render.py
+    python3 bench_context_render.py --kb data/postgresql_docs_kb.csv --json
+"""
+
+# Standard library imports
+import argparse
+import csv
+import json
+import sys
+from collections import Counter
+from typing import Any, Callable, Dict, List
+
+# Local application/library specific imports
+import context_renderer
+import retrieval_policy
+from ingest_data import KB_SOURCE_CSV_PATH, TICKETS_CSV_PATH, log_events
+from prompts import estimate_tokens
+
+RESOLVED_STATUSES = ("Resolved", "Closed")
+
+
+def token_counter() -> (Callable[[str], int], str):
+    """Returns a token counting function and its name."""
+    try:
+        import tiktoken
+    except ImportError:
+        return estimate_tokens, "chars/4 estimate"
+    encoding = tiktoken.get_encoding("cl100k_base")
+    return lambda text: len(encoding.encode(text)), "tiktoken cl100k_base"
+
+
+def load_tickets(path: str) -> List[Dict[str, Any]]:
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    tickets = []
+    for row in rows:
+        events = [{"at": at or "", "entry": entry} for at, entry in log_events(row["log"])]
+        tickets.append({
+            "ticket_id": row["ticket_id"],
+            "user_id": int(row["user_id"]),
+            "status": row.get("status") or "Open",
+            "description": row["description"],
+            "events": events,
+        })
+    return tickets
+
+
+def load_articles(path: str) -> List[Dict[str, Any]]:
+    csv.field_size_limit(sys.maxsize)
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        return [{"title": row["title"], "url": row["url"], "content": row["content"]} for row in csv.DictReader(f)]
+
+
+def pick_articles(articles: List[Dict[str, Any]], offset: int, intent: str) -> List[Dict[str, Any]]:
+    """Takes consecutive articles as search results and truncates them with the intent's policy."""
+    policy = retrieval_policy.for_intent(intent)
+    candidates = [
+        dict(articles[(offset + i) % len(articles)], distance=0.3 + 0.02 * i)
+        for i in range(policy.k)
+    ]
+    return policy.select(candidates)
+
+
+def build_contexts(tickets: List[Dict[str, Any]], articles: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Returns the records of every benchmark turn (rendered later by each renderer)."""
+    resolved = [t for t in tickets if t["status"] in RESOLVED_STATUSES]
+    turns = []
+    for index, ticket in enumerate(tickets):
+        history = [
+            {"author": "user", "text": ticket["description"]},
+            {"author": "agent", "text": articles[index % len(articles)]["content"][:400]},
+            {"author": "user", "text": "I tried that, but it still happens.\nWhat else can I check?"},
+        ]
+        similar = [
+            {
+                "ticket_id": t["ticket_id"],
+                "description": t["description"],
+                "resolution": t["events"][-1]["entry"] if t["events"] else None,
+                "distance": 0.12 + 0.05 * i,
+            }
+            for i, t in enumerate(r for r in resolved if r["ticket_id"] != ticket["ticket_id"])
+        ][:2]
+        own = [t for t in tickets if t["user_id"] == ticket["user_id"]]
+        summary = {
+            "total": len(own),
+            "by_status": dict(Counter(t["status"] for t in own).most_common()),
+            "recent": [{"ticket_id": t["ticket_id"], "status": t["status"], "description": t["description"]} for t in own[:5]],
+        }
+        details = {key: ticket[key] for key in ("ticket_id", "user_id", "status", "description", "events")}
+
+        turns.append({"kind": "ticket_inquiry", "parts": [
+            ("Ticket Information", "ticket", details),
+            ("Current Conversation History", "history", history),
+            ("Similar Resolved Tickets", "similar_tickets", similar),
+            ("Relevant Knowledge Base Articles", "articles", pick_articles(articles, index, "ticket_inquiry")),
+        ]})
+        turns.append({"kind": "ticket_history", "parts": [
+            ("The user's ticket history summary is", "ticket_summary", summary),
+            ("Relevant Knowledge Base Articles", "articles", pick_articles(articles, index, "ticket_history_inquiry")),
+        ]})
+        turns.append({"kind": "new_issue", "parts": [
+            ("Current Conversation History", "history", history),
+            ("Similar Resolved Tickets", "similar_tickets", similar),
+            ("Relevant Knowledge Base Articles", "articles", pick_articles(articles, index, "new_issue")),
+        ]})
+    return turns
+
+
+def render(turn: Dict[str, Any], renderer) -> str:
+    """Renders a turn's records the way `agent.py` assembles its context."""
+    return "".join(f"{label}: {getattr(renderer, method)(records)}\n" for label, method, records in turn["parts"])
+
+
+def run(turns: List[Dict[str, Any]], count_tokens: Callable[[str], int]) -> Dict[str, Any]:
+    """Measures every turn with both renderers and aggregates per kind of turn."""
+    report: Dict[str, Any] = {}
+    for kind in ["all"] + sorted({t["kind"] for t in turns}):
+        selected = [t for t in turns if kind == "all" or t["kind"] == kind]
+        row = {"turns": len(selected)}
+        for name in ("json", "compact"):
+            renderer = context_renderer.get_renderer(name)
+            texts = [render(t, renderer) for t in selected]
+            row[name] = {
+                "chars": sum(len(text) for text in texts) / len(texts),
+                "tokens": sum(count_tokens(text) for text in texts) / len(texts),
+            }
+        row["tokens_saved"] = row["json"]["tokens"] - row["compact"]["tokens"]
+        row["saved_share"] = row["tokens_saved"] / row["json"]["tokens"] if row["json"]["tokens"] else 0.0
+        report[kind] = row
+    return report
+
+
+def print_report(report: Dict[str, Any], counter_name: str) -> None:
+    print(f"Mean context size per turn ({counter_name}):")
+    print(f"{'turn':<16} {'n':>4} {'json chars':>11} {'compact':>9} {'json tok':>9} {'compact':>9} {'saved':>7}")
+    for kind, row in report.items():
+        print(
+            f"{kind:<16} {row['turns']:>4} {row['json']['chars']:>11.0f} {row['compact']['chars']:>9.0f} "
+            f"{row['json']['tokens']:>9.0f} {row['compact']['tokens']:>9.0f} {row['saved_share']:>7.0%}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare JSON and compact context rendering.")
+    parser.add_argument("--tickets", default=TICKETS_CSV_PATH, help="Sample tickets CSV.")
+    parser.add_argument("--kb", default=KB_SOURCE_CSV_PATH, help="Knowledge base CSV.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    count_tokens, counter_name = token_counter()
+    turns = build_contexts(load_tickets(args.tickets), load_articles(args.kb))
+    report = run(turns, count_tokens)
+    if args.json:
+        print(json.dumps({"token_counter": counter_name, "results": report}, indent=2))
+    else:
+        print_report(report, counter_name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# bench_cypher.py
+
+"""
+Microbenchmark: f-string Cypher vs. prepared, parameterized Cypher statements.
+
+Measures the per-call latency of the two graph memory operations the agent
+runs on every turn, on a single connection:
+
+- history read: the last-N messages of a session.
+- message write: MERGE user/session + CREATE message (rolled back, so the
+  benchmark leaves no data behind).
+
+The "legacy" variant builds a fresh SQL string per call, the way
+`database.py` did before statements were prepared; the "prepared" variant
+uses `database._execute_cypher`. Run it against a database that has been set
+up with `ingest_data.py` (and ideally seeded with `utils.py`).
+
+Usage:
+    python3 bench_cypher.py --iterations 500
+"""
+
+# Standard library imports
+import argparse
+import json
+import time
+from typing import Callable, List
+
+# Local application/library specific imports
+import database as db
+from memory_outbox import new_message_id
+from tracing import percentile
+
+SESSION_ID = "session_user_1"
+
+
+def legacy_history(conn, cursor, n: int) -> None:
+    cursor.execute(f"""
+    SELECT * FROM cypher('{db.GRAPH_NAME}', $$
+        MATCH (s:Session {{id: '{SESSION_ID}'}})-[:CONTAINS]->(m:Message)
+        RETURN m.author, m.text, m.timestamp
+        ORDER BY m.timestamp DESC
+        LIMIT {n}
+    $$) AS (author agtype, text agtype, ts agtype);
+    """)
+    cursor.fetchall()
+
+
+def prepared_history(conn, cursor, n: int) -> None:
+    name, cypher, columns = db._history_statement(n)
+    db._execute_cypher(conn, cursor, name, {"session_id": SESSION_ID}, (cypher, columns))
+    cursor.fetchall()
+
+
+def legacy_write(conn, cursor, n: int) -> None:
+    cursor.execute(f"""
+    SELECT * FROM cypher('{db.GRAPH_NAME}', $$
+        MERGE (u:User {{id: 1}})
+        MERGE (s:Session {{id: '{SESSION_ID}'}})
+        MERGE (u)-[:HAS_SESSION]->(s)
+        CREATE (m:Message {{text: {json.dumps("benchmark message")}, author: "user", timestamp: timestamp()}})
+        CREATE (s)-[:CONTAINS]->(m)
+    $$) AS (v agtype);
+    """)
+    conn.rollback()
+
+
+def prepared_write(conn, cursor, n: int) -> None:
+    params = {
+        "user_id": 1, "session_id": SESSION_ID, "text": "benchmark message", "author": "user",
+        "timestamp": int(time.time() * 1000), "message_id": new_message_id(),
+    }
+    db._execute_cypher(conn, cursor, "cypher_add_message", params)
+    conn.rollback()
+
+
+def measure(conn, func: Callable, iterations: int, n: int) -> List[float]:
+    """Runs `func` `iterations` times (after a short warm-up) and returns the latencies in ms."""
+    timings = []
+    with conn.cursor() as cursor:
+        for i in range(iterations + 10):
+            start = time.perf_counter()
+            func(conn, cursor, n)
+            if i >= 10:
+                timings.append((time.perf_counter() - start) * 1000)
+    conn.rollback()
+    return timings
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare f-string and prepared Cypher statements.")
+    parser.add_argument("--iterations", type=int, default=300)
+    parser.add_argument("--history", type=int, default=5, help="Messages fetched by the history query.")
+    args = parser.parse_args()
+
+    conn = db.get_db_connection()
+    if not conn:
+        print("Could not get a database connection. Check your .env settings.")
+        return
+
+    try:
+        print(f"{'operation':<16}{'variant':<10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+        for operation, legacy, prepared in (
+            ("history read", legacy_history, prepared_history),
+            ("message write", legacy_write, prepared_write),
+        ):
+            means = {}
+            for variant, func in (("legacy", legacy), ("prepared", prepared)):
+                timings = measure(conn, func, args.iterations, args.history)
+                means[variant] = sum(timings) / len(timings)
+                print(f"{operation:<16}{variant:<10}{means[variant]:>10.3f}{percentile(timings, 50):>10.3f}{percentile(timings, 95):>10.3f}")
+            saved = means["legacy"] - means["prepared"]
+            print(f"{operation:<16}{'saved':<10}{saved:>10.3f} ms per call ({saved / means['legacy']:.0%})\n")
+    finally:
+        db.conn_pool.putconn(conn)
+        db.conn_pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+# bench_resilience.py
+
+"""
+Measures LLM call latency while the provider is degraded.
+
+Starts `fake_groq_server.py` with injected 503 errors and stalled requests,
+then sends intent and response calls through `LlmClient` from several threads.
+The report shows the latency percentiles, how many calls degraded (local
+intent fallback, cached answer or error message) and the final state of the
+circuit breaker. Without deadlines, a single stalled request would hold a
+turn for the full stall time; with them, p99 stays close to the deadline.
+
+Usage:
+    python3 bench_resilience.py --calls 200 --error-rate 0.1 --stall-rate 0.05
+    python3 bench_resilience.py --stall-ms 60000 --workers 16 --json
+"""
+
+# Standard library imports
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+# Local application/library specific imports
+import fake_groq_server
+import tracing
+from tracing import percentile
+
+INTENT_SYSTEM_PROMPT = "Classify the user's intent. Respond with JSON containing 'intent' and 'ticket_id'."
+RESPONSE_SYSTEM_PROMPT = "You are a PostgreSQL support assistant. Answer briefly."
+QUERIES = [
+    "What is the status of TICKET-3B?",
+    "My replication is lagging behind the primary, what should I check?",
+    "How do I tune autovacuum for a write-heavy table?",
+    "Show me all my tickets",
+]
+
+
+class DiscardExporter:
+    """Keeps tracing active (spans carry the `degraded` attribute) without writing traces."""
+
+    def export(self, turn) -> None:
+        pass
+
+
+def run_call(llm, index: int) -> Dict[str, Any]:
+    """Sends one intent or response call and records its latency and degradation."""
+    query = QUERIES[index % len(QUERIES)]
+    kind = "intent" if index % 2 == 0 else "response"
+    start = time.perf_counter()
+    with tracing.turn(), tracing.span(f"bench_{kind}") as span:
+        if kind == "intent":
+            llm.generate_intent(INTENT_SYSTEM_PROMPT, f'User query: "{query}"', fallback={"intent": "fallback", "ticket_id": None})
+        else:
+            # Context-free questions, so their answers may be served from the fallback cache.
+            from llm_client import response_cache_key
+            cache_key = response_cache_key("small", "general_question", query)
+            llm.generate_response(RESPONSE_SYSTEM_PROMPT, query, tier="small", cache_key=cache_key)
+        degraded = span["attributes"].get("degraded")
+    return {"kind": kind, "latency_ms": (time.perf_counter() - start) * 1000, "degraded": degraded}
+
+
+def summarize(records: List[Dict[str, Any]], breaker_state: str) -> Dict[str, Any]:
+    report: Dict[str, Any] = {"calls": len(records), "breaker_state": breaker_state}
+    for kind in ("intent", "response"):
+        subset = [r for r in records if r["kind"] == kind]
+        latencies = [r["latency_ms"] for r in subset]
+        degraded: Dict[str, int] = {}
+        for r in subset:
+            if r["degraded"]:
+                degraded[r["degraded"]] = degraded.get(r["degraded"], 0) + 1
+        report[kind] = {
+            "calls": len(subset),
+            "latency_ms": {
+                "p50": percentile(latencies, 50),
+                "p95": percentile(latencies, 95),
+                "p99": percentile(latencies, 99),
+                "max": max(latencies, default=0.0),
+            },
+            "degraded": degraded,
+        }
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"Calls: {report['calls']}, circuit breaker finished {report['breaker_state']}")
+    for kind in ("intent", "response"):
+        section = report[kind]
+        latency = section["latency_ms"]
+        degraded = ", ".join(f"{reason} {count}" for reason, count in section["degraded"].items()) or "none"
+        print(
+            f"{kind:<9} p50={latency['p50']:.0f}ms  p95={latency['p95']:.0f}ms  "
+            f"p99={latency['p99']:.0f}ms  max={latency['max']:.0f}ms  degraded: {degraded}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark LLM call latency against a degraded fake provider.")
+    parser.add_argument("--calls", type=int, default=200, help="Total number of LLM calls.")
+    parser.add_argument("--workers", type=int, default=8, help="Concurrent callers.")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Fake server time to first token.")
+    parser.add_argument("--error-rate", type=float, default=0.1, help="Share of requests answered with HTTP 503.")
+    parser.add_argument("--stall-rate", type=float, default=0.05, help="Share of requests that stall.")
+    parser.add_argument("--stall-ms", type=float, default=20000.0, help="How long a stalled request hangs.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    config = fake_groq_server.FakeGroqConfig(
+        latency_ms=args.latency_ms,
+        error_rate=args.error_rate,
+        stall_rate=args.stall_rate,
+        stall_ms=args.stall_ms
+    )
+    server = fake_groq_server.start_server(port=0, config=config)
+    os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+    tracing.set_exporter(DiscardExporter())
+
+    # Imported late so the client picks up the environment configured above.
+    from llm_client import LlmClient
+
+    llm = LlmClient(api_key=os.getenv("GROQ_API_KEY") or "fake-key")
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        records = list(executor.map(lambda i: run_call(llm, i), range(args.calls)))
+    server.shutdown()
+
+    report = summarize(records, llm.breaker.state)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
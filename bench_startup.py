@@ -0,0 +1,165 @@
+# bench_startup.py
+
+"""
+Measures the first-turn latency of a cold process with and without warm-up.
+
+Each run starts a fresh Python process, so the embedding model, the DB pool
+and the LLM connection really are cold:
+
+- "cold": import the agent, then answer the first turn right away.
+- "warm": import the agent, run `startup.warm_up()`, then answer the first turn.
+
+For both modes the report shows the median import time, warm-up time, first
+turn latency and second turn latency (the steady state). The warm-up moves
+the one-time costs out of the first turn; the difference between the first
+and second turn is what a user would otherwise wait for.
+
+LLM calls go to a local `fake_groq_server.py` by default (no TLS handshake to
+measure); use `--no-fake-groq` to include the real Groq connection setup. The
+database is the one configured in `.env`, so run `ingest_data.py` first. The
+PostgreSQL buffer cache is only cold after a database restart; restart it
+between runs to measure `--pg-prewarm`.
+
+Usage:
+    python3 bench_startup.py --runs 3
+    python3 bench_startup.py --runs 5 --pg-prewarm --json
+"""
+
+# Standard library imports
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from typing import Any, Dict, List
+
+# Local application/library specific imports
+import fake_groq_server
+
+RESULT_PREFIX = "BENCH_STARTUP_RESULT "
+FIRST_QUERY = "How do I enable parallel query in PostgreSQL?"
+SECOND_QUERY = "Why is my autovacuum not keeping up with updates?"
+MODES = ("cold", "warm")
+
+
+def run_child(mode: str, user_id: int, pg_prewarm: bool) -> None:
+    """Runs inside the fresh process: imports, optionally warms up, and times two turns."""
+    start = time.perf_counter()
+    import agent
+    import startup
+    import_ms = (time.perf_counter() - start) * 1000
+
+    warm_up_ms = 0.0
+    steps: Dict[str, Any] = {}
+    if mode == "warm":
+        start = time.perf_counter()
+        steps = startup.warm_up(pg_prewarm=pg_prewarm)["steps"]
+        warm_up_ms = (time.perf_counter() - start) * 1000
+
+    session_id = f"bench-startup-{uuid.uuid4().hex[:8]}"
+    turn_ms = []
+    for query in (FIRST_QUERY, SECOND_QUERY):
+        start = time.perf_counter()
+        agent.get_agent_response(user_id, session_id, query)
+        turn_ms.append((time.perf_counter() - start) * 1000)
+
+    result = {
+        "mode": mode,
+        "import_ms": import_ms,
+        "warm_up_ms": warm_up_ms,
+        "first_turn_ms": turn_ms[0],
+        "second_turn_ms": turn_ms[1],
+        "steps": steps,
+    }
+    print(RESULT_PREFIX + json.dumps(result))
+
+
+def run_process(mode: str, args: argparse.Namespace, env: Dict[str, str]) -> Dict[str, Any]:
+    """Starts one fresh benchmark process and returns its result."""
+    command = [sys.executable, __file__, "--child", mode, "--user-id", str(args.user_id)]
+    if args.pg_prewarm:
+        command.append("--pg-prewarm")
+    completed = subprocess.run(command, env=env, capture_output=True, text=True)
+    for line in completed.stdout.splitlines():
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"The {mode} run failed:\n{completed.stdout}\n{completed.stderr}")
+
+
+def summarize(results: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Reports the median of every timing per mode."""
+    report = {}
+    for mode in MODES:
+        runs = [r for r in results if r["mode"] == mode]
+        if not runs:
+            continue
+        report[mode] = {
+            key: statistics.median(r[key] for r in runs)
+            for key in ("import_ms", "warm_up_ms", "first_turn_ms", "second_turn_ms")
+        }
+        report[mode]["runs"] = len(runs)
+        if mode == "warm":
+            step_names = {name for r in runs for name in r["steps"]}
+            report[mode]["steps_ms"] = {
+                name: statistics.median(r["steps"][name]["duration_ms"] for r in runs if name in r["steps"])
+                for name in sorted(step_names)
+            }
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{'mode':<6} {'import':>9} {'warm-up':>9} {'1st turn':>9} {'2nd turn':>9}   (median ms)")
+    for mode, row in report.items():
+        print(
+            f"{mode:<6} {row['import_ms']:>9.0f} {row['warm_up_ms']:>9.0f} "
+            f"{row['first_turn_ms']:>9.0f} {row['second_turn_ms']:>9.0f}"
+        )
+    if "warm" in report and report["warm"].get("steps_ms"):
+        steps = ", ".join(f"{name} {ms:.0f}ms" for name, ms in report["warm"]["steps_ms"].items())
+        print(f"Warm-up steps (in parallel): {steps}")
+    if "cold" in report and "warm" in report:
+        saved = report["cold"]["first_turn_ms"] - report["warm"]["first_turn_ms"]
+        print(f"First turn is {saved:.0f}ms faster after the warm-up.")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare cold and warmed-up first-turn latency in fresh processes.")
+    parser.add_argument("--runs", type=int, default=3, help="Fresh processes per mode.")
+    parser.add_argument("--user-id", type=int, default=2, help="User the benchmark turns are sent as.")
+    parser.add_argument("--pg-prewarm", action="store_true", help="Also run pg_prewarm during the warm-up.")
+    parser.add_argument("--no-fake-groq", dest="fake_groq", action="store_false", help="Use the real Groq API from .env.")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Fake server time to first token.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.user_id, args.pg_prewarm)
+        return
+
+    env = dict(os.environ)
+    # Cached query vectors would hide the embedding model load.
+    env["EMBEDDING_CACHE"] = "off"
+    server = None
+    if args.fake_groq:
+        server = fake_groq_server.start_server(port=0, config=fake_groq_server.FakeGroqConfig(args.latency_ms))
+        env["GROQ_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+        env.setdefault("GROQ_API_KEY", "fake-key")
+
+    # Alternate the modes so both see the same database and OS cache conditions.
+    results = [run_process(mode, args, env) for _ in range(args.runs) for mode in MODES]
+    if server:
+        server.shutdown()
+
+    report = summarize(results)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# bench_vector_storage.py
+
+"""
+Benchmark: float32 vs. halfvec vs. binary-quantized embedding storage.
+
+For each layout of `pg_docs` embeddings, the benchmark rebuilds its HNSW
+index inside a transaction and reports:
+
+- storage: bytes of the indexed column/expression and size of the index;
+- build time of the index;
+- query latency (p50/p95) and recall@k of `database.query_vector_db`'s SQL
+  for that mode, against exact float32 cosine search (sequential scan).
+
+Queries are the titles of randomly sampled documents, embedded with the same
+model as the agent. Every layout is rolled back afterwards, so the benchmark
+leaves the database unchanged. Run `migrations/001_quantized_embeddings.sql`
+first so the `embedding_half` column is populated.
+
+Usage:
+    python3 bench_vector_storage.py --queries 100 --k 5
+    python3 bench_vector_storage.py --ef-search 100 --rerank-factor 20
+"""
+
+# Standard library imports
+import argparse
+import random
+import time
+from typing import Dict, List
+
+# Local application/library specific imports
+import database as db
+from tracing import percentile
+
+# mode -> (index name, CREATE INDEX body, size expression)
+LAYOUTS = {
+    "full": (
+        "pg_docs_embedding_cosine_idx",
+        "USING hnsw (embedding vector_cosine_ops)",
+        "embedding",
+    ),
+    "half": (
+        "pg_docs_embedding_half_idx",
+        "USING hnsw (embedding_half halfvec_cosine_ops)",
+        "embedding_half",
+    ),
+    "binary": (
+        "pg_docs_embedding_bit_idx",
+        "USING hnsw ((binary_quantize(embedding_half)::bit(384)) bit_hamming_ops)",
+        "binary_quantize(embedding_half)::bit(384)",
+    ),
+}
+
+
+def exact_neighbours(cursor, embedding: str, k: int) -> List[str]:
+    """Returns the URLs of the true top-k documents by float32 cosine distance."""
+    cursor.execute("SET LOCAL enable_indexscan = off;")
+    cursor.execute("SELECT url FROM pg_docs ORDER BY embedding <=> %s LIMIT %s;", (embedding, k))
+    urls = [row[0] for row in cursor.fetchall()]
+    cursor.execute("SET LOCAL enable_indexscan = on;")
+    return urls
+
+
+def bench_layout(conn, mode: str, queries: List[str], truth: Dict[str, List[str]], k: int, ef_search: int) -> Dict[str, float]:
+    index_name, index_body, size_expr = LAYOUTS[mode]
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(f"DROP INDEX IF EXISTS {index_name};")
+            start = time.perf_counter()
+            cursor.execute(f"CREATE INDEX {index_name} ON pg_docs {index_body};")
+            build_s = time.perf_counter() - start
+            cursor.execute(
+                f"SELECT pg_relation_size(%s::regclass), COALESCE(SUM(pg_column_size({size_expr})), 0) FROM pg_docs;",
+                (index_name,)
+            )
+            index_bytes, column_bytes = cursor.fetchone()
+            cursor.execute(f"SET LOCAL hnsw.ef_search = {int(ef_search)};")
+
+            latencies, recalls = [], []
+            for embedding in queries:
+                sql, params = db._vector_search_sql(mode, embedding, k)
+                start = time.perf_counter()
+                cursor.execute(sql, params)
+                urls = [row[2] for row in cursor.fetchall()]
+                latencies.append((time.perf_counter() - start) * 1000)
+                recalls.append(len(set(urls) & set(truth[embedding])) / k)
+    finally:
+        conn.rollback()
+    return {
+        "column_mb": column_bytes / 1e6,
+        "index_mb": index_bytes / 1e6,
+        "build_s": build_s,
+        "p50_ms": percentile(latencies, 50),
+        "p95_ms": percentile(latencies, 95),
+        "recall": sum(recalls) / len(recalls) if recalls else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Compare float32, halfvec and binary-quantized vector storage.")
+    parser.add_argument("--queries", type=int, default=100, help="Number of sampled query titles.")
+    parser.add_argument("--k", type=int, default=5, help="Results per query (recall@k).")
+    parser.add_argument("--ef-search", type=int, default=40, help="hnsw.ef_search for every layout.")
+    parser.add_argument("--rerank-factor", type=int, default=db.VECTOR_RERANK_FACTOR, help="Binary candidates per result.")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    db.VECTOR_RERANK_FACTOR = args.rerank_factor
+
+    conn = db.get_db_connection()
+    if not conn:
+        print("Could not get a database connection. Check your .env settings.")
+        return
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT title FROM pg_docs WHERE title IS NOT NULL;")
+            titles = [row[0] for row in cursor.fetchall()]
+            random.Random(args.seed).shuffle(titles)
+            queries = [str(db.embed_query(title)) for title in titles[:args.queries]]
+            truth = {embedding: exact_neighbours(cursor, embedding, args.k) for embedding in queries}
+        conn.rollback()
+
+        print(f"{len(queries)} queries, recall@{args.k}, ef_search={args.ef_search}, rerank factor={args.rerank_factor}")
+        print(f"{'layout':<8}{'column MB':>11}{'index MB':>10}{'build s':>9}{'p50 ms':>9}{'p95 ms':>9}{'recall':>8}")
+        for mode in LAYOUTS:
+            try:
+                r = bench_layout(conn, mode, queries, truth, args.k, args.ef_search)
+            except Exception as e:
+                print(f"{mode:<8} failed: {e}")
+                continue
+            print(
+                f"{mode:<8}{r['column_mb']:>11.2f}{r['index_mb']:>10.2f}{r['build_s']:>9.2f}"
+                f"{r['p50_ms']:>9.2f}{r['p95_ms']:>9.2f}{r['recall']:>8.3f}"
+            )
+    finally:
+        db.conn_pool.putconn(conn)
+        db.conn_pool.closeall()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+# chat_client.py
+
+"""
+Conversation backends for the Streamlit UI.
+
+`app.py` only talks to a chat client, so the same UI runs either as a thin
+client of the HTTP API or, for local development, with the agent in-process:
+
+- `ApiChatClient` calls `api.py` (set `AGENT_API_URL`, e.g.
+  http://127.0.0.1:8000). Streamlit then does no database or LLM work
+  itself, and the answer streams in over server-sent events.
+- `LocalChatClient` calls `database` and `agent` directly (the default). The
+  agent turn runs on a helper thread so its answer streams the same way.
+
+Both expose the same methods; `stream_message` yields `(event, data)` pairs
+with the events of `POST /sessions/{id}/messages/stream` ("token", "done",
+"error").
+"""
+
+# Standard library imports
+import json
+import os
+import queue
+import threading
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+AGENT_API_URL = os.getenv("AGENT_API_URL")
+AGENT_API_TIMEOUT_S = float(os.getenv("AGENT_API_TIMEOUT_S", "60"))
+
+
+class ApiChatClient:
+    """A client of the HTTP API in `api.py`, using only the standard library."""
+
+    def __init__(self, base_url: str, timeout_s: float = AGENT_API_TIMEOUT_S):
+        self.base_url = base_url.rstrip("/")
+        self.timeout_s = timeout_s
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None):
+        data = json.dumps(body).encode("utf-8") if body is not None else None
+        request = urllib.request.Request(
+            f"{self.base_url}{path}", data=data, method=method,
+            headers={"Content-Type": "application/json"}
+        )
+        return urllib.request.urlopen(request, timeout=self.timeout_s)
+
+    def _json(self, method: str, path: str, body: Optional[Dict[str, Any]] = None) -> Optional[Any]:
+        try:
+            with self._request(method, path, body) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            if e.code != 404:
+                print(f"Warning: Agent API returned {e.code} for {method} {path}.")
+            return None
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Warning: Agent API request {method} {path} failed: {e}")
+            return None
+
+    def create_session(self, user_id: int) -> Optional[str]:
+        result = self._json("POST", "/sessions", {"user_id": user_id})
+        return result["session_id"] if result else None
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._json("GET", f"/sessions/{urllib.parse.quote(session_id)}")
+
+    def list_sessions(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        result = self._json("GET", f"/sessions?user_id={int(user_id)}&limit={int(limit)}")
+        return result["sessions"] if result else []
+
+    def get_messages(self, session_id: str, n: int = 20) -> List[Dict[str, Any]]:
+        result = self._json("GET", f"/sessions/{urllib.parse.quote(session_id)}/messages?n={int(n)}")
+        return result["messages"] if result else []
+
+    def stream_message(self, session_id: str, message: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        path = f"/sessions/{urllib.parse.quote(session_id)}/messages/stream"
+        try:
+            response = self._request("POST", path, {"message": message})
+        except urllib.error.HTTPError as e:
+            try:
+                error = json.loads(e.read()).get("error")
+            except ValueError:
+                error = None
+            yield "error", {"error": error or f"The agent API returned {e.code}."}
+            return
+        except (urllib.error.URLError, OSError) as e:
+            print(f"Warning: Agent API request POST {path} failed: {e}")
+            yield "error", {"error": "The agent is unreachable. Please try again."}
+            return
+
+        with response:
+            event, data = "message", []
+            for raw_line in response:
+                line = raw_line.decode("utf-8").rstrip("\r\n")
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:"):
+                    data.append(line[len("data:"):].strip())
+                elif not line and data:
+                    yield event, json.loads("\n".join(data))
+                    event, data = "message", []
+
+
+class LocalChatClient:
+    """Runs the agent in the calling process (no API server needed)."""
+
+    def __init__(self):
+        # Imported lazily: a thin client never loads the model or opens DB connections.
+        import agent
+        import database
+        self._agent = agent
+        self._db = database
+
+    def create_session(self, user_id: int) -> Optional[str]:
+        return self._db.create_session(user_id)
+
+    def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._db.get_session(session_id)
+
+    def list_sessions(self, user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+        return self._db.list_sessions(user_id, limit)
+
+    def get_messages(self, session_id: str, n: int = 20) -> List[Dict[str, Any]]:
+        return self._db.get_conversation_history(session_id, n)
+
+    def stream_message(self, session_id: str, message: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        events: "queue.Queue[Tuple[str, Dict[str, Any]]]" = queue.Queue()
+        streamed = threading.Event()
+
+        def on_token(text: str) -> None:
+            streamed.set()
+            events.put(("token", {"text": text}))
+
+        def run() -> None:
+            try:
+                result = self._agent.respond_in_session(session_id, message, on_token=on_token)
+            except self._agent.SessionBusy as e:
+                events.put(("error", {"error": str(e)}))
+                return
+            except Exception as e:
+                print(f"An error occurred during a streamed turn: {e}")
+                events.put(("error", {"error": "The turn failed. Please try again."}))
+                return
+            if result is None:
+                events.put(("error", {"error": "Unknown session."}))
+                return
+            if not streamed.is_set():
+                events.put(("token", {"text": result["response"]}))
+            events.put(("done", result))
+
+        threading.Thread(target=run, daemon=True, name="local-turn").start()
+        while True:
+            event, data = events.get()
+            yield event, data
+            if event != "token":
+                return
+
+
+def make_chat_client():
+    """Returns an `ApiChatClient` if `AGENT_API_URL` is set, else a `LocalChatClient`."""
+    if AGENT_API_URL:
+        return ApiChatClient(AGENT_API_URL)
+    return LocalChatClient()
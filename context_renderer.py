@@ -0,0 +1,123 @@
+# context_renderer.py
+
+"""
+Renders the records the agent puts into the synthesis prompt.
+
+The context used to be built from `json.dumps` of every record. Quotes,
+escaped newlines and keys repeated on every row (`"ticket_id"`,
+`"description"`, `"content"`, `"url"`, ...) cost tokens on every turn
+without telling the model anything. Two renderers share one interface:
+
+- `CompactRenderer` ("compact", the default): lists of records become
+  markdown tables with the keys once in the header, ticket fields become
+  `key: value` lines, and KB articles become titled text blocks. Text is
+  kept as is; only newlines inside table cells and `|` are replaced.
+- `JsonRenderer` ("json"): the previous `json.dumps` output, kept for
+  comparison (see `bench_context_render.py`).
+
+Field names the synthesis prompt refers to ('recent', 'by_status', 'total',
+'resolution', ...) appear in both formats. Select one with `CONTEXT_FORMAT`.
+"""
+
+# Standard library imports
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+CONTEXT_FORMAT = os.getenv("CONTEXT_FORMAT", "compact").lower()
+
+
+class JsonRenderer:
+    """Renders every record as JSON (the original prompt format)."""
+
+    name = "json"
+
+    def ticket(self, ticket: Dict[str, Any]) -> str:
+        return json.dumps(ticket)
+
+    def ticket_summary(self, summary: Dict[str, Any]) -> str:
+        return json.dumps(summary)
+
+    def history(self, messages: List[Dict[str, Any]]) -> str:
+        return json.dumps(messages)
+
+    def similar_tickets(self, tickets: List[Dict[str, Any]]) -> str:
+        return json.dumps(tickets)
+
+    def articles(self, chunks: List[Dict[str, Any]]) -> str:
+        return json.dumps(chunks)
+
+
+def _cell(value: Any) -> str:
+    """Formats a value for a markdown table cell (one line, no bare pipes)."""
+    if value is None:
+        return ""
+    if isinstance(value, float):
+        value = round(value, 3)
+    return " ".join(str(value).split()).replace("|", "\\|")
+
+
+def _table(rows: Sequence[Dict[str, Any]], columns: Sequence[str]) -> str:
+    """Renders records as a markdown table with the keys only in the header."""
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    lines += ["| " + " | ".join(_cell(row.get(column)) for column in columns) + " |" for row in rows]
+    return "\n".join(lines)
+
+
+def _columns(rows: Sequence[Dict[str, Any]], preferred: Sequence[str] = ()) -> List[str]:
+    """Returns the preferred columns present in the rows, then any others in first-seen order."""
+    seen = [key for key in preferred if any(key in row for row in rows)]
+    for row in rows:
+        seen += [key for key in row if key not in seen]
+    return seen
+
+
+class CompactRenderer:
+    """Renders records as markdown tables and `key: value` lines."""
+
+    name = "compact"
+
+    def ticket(self, ticket: Dict[str, Any]) -> str:
+        lines = [f"{key}: {_cell(value)}" for key, value in ticket.items() if key != "events"]
+        events = ticket.get("events") or []
+        if events:
+            lines.append("events (oldest first):")
+            lines += [f"- {str(event.get('at', ''))[:16].replace('T', ' ')}: {event.get('entry', '')}" for event in events]
+        return "\n" + "\n".join(lines)
+
+    def ticket_summary(self, summary: Dict[str, Any]) -> str:
+        by_status = ", ".join(f"{status} {count}" for status, count in (summary.get("by_status") or {}).items())
+        recent = summary.get("recent") or []
+        lines = [f"total: {summary.get('total', len(recent))}", f"by_status: {by_status or 'none'}"]
+        if recent:
+            lines += ["recent:", _table(recent, _columns(recent, ("ticket_id", "status", "description")))]
+        return "\n" + "\n".join(lines)
+
+    def history(self, messages: List[Dict[str, Any]]) -> str:
+        return "\n" + "\n".join(f"{m.get('author')}: {' '.join(str(m.get('text', '')).split())}" for m in messages)
+
+    def similar_tickets(self, tickets: List[Dict[str, Any]]) -> str:
+        return "\n" + _table(tickets, _columns(tickets, ("ticket_id", "distance", "description", "resolution")))
+
+    def articles(self, chunks: List[Dict[str, Any]]) -> str:
+        blocks = [f"### {chunk.get('title', '')}\n{chunk.get('url', '')}\n{chunk.get('content', '')}" for chunk in chunks]
+        return "\n" + "\n\n".join(blocks)
+
+
+RENDERERS = {renderer.name: renderer for renderer in (CompactRenderer(), JsonRenderer())}
+
+
+def get_renderer(name: Optional[str] = None):
+    """Returns the renderer called `name` (default: `CONTEXT_FORMAT`), falling back to compact."""
+    name = (name or CONTEXT_FORMAT).lower()
+    if name not in RENDERERS:
+        print(f"Warning: Unknown CONTEXT_FORMAT '{name}', using 'compact'.")
+        return RENDERERS["compact"]
+    return RENDERERS[name]
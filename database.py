@@ -3,16 +3,26 @@
 # Standard library imports
 import json
 import os
+import sqlite3
+import threading
+import time
 import uuid
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
 
 # Third-party imports
 from dotenv import load_dotenv
+import psycopg2
 from psycopg2 import pool
 from psycopg2.extensions import connection
+from psycopg2.extras import execute_values
 from sentence_transformers import SentenceTransformer
 
+# Local application/library specific imports
+import embedding_cache
+import memory_outbox
+import session_cache
+import tracing
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,25 +33,82 @@ DB_USER = os.getenv("DB_USER")
 DB_PASSWORD = os.getenv("DB_PASSWORD")
 DB_HOST = os.getenv("DB_HOST")
 DB_PORT = os.getenv("DB_PORT")
+DB_POOL_MINCONN = int(os.getenv("DB_POOL_MINCONN", "1"))
+DB_POOL_MAXCONN = int(os.getenv("DB_POOL_MAXCONN", "10"))
+# "outbox" queues conversation messages and writes them to the graph in the
+# background (see `memory_outbox.py`); "sync" writes them before returning.
+MEMORY_WRITE_MODE = os.getenv("MEMORY_WRITE_MODE", "outbox").lower()
+# How long a conversation's turn lease holds off other workers (see begin_session_turn);
+# it only matters if the worker running the turn dies before releasing it.
+SESSION_TURN_LEASE_S = float(os.getenv("SESSION_TURN_LEASE_S", "120"))
+# Which embedding column/index the knowledge base search uses:
+# "full" (float32 vector), "half" (halfvec) or "binary" (bit index + halfvec re-scoring).
+# "half" and "binary" need migrations/001_quantized_embeddings.sql.
+VECTOR_SEARCH_MODE = os.getenv("VECTOR_SEARCH_MODE", "full").lower()
+# Candidates fetched by the binary index per requested result before re-scoring.
+VECTOR_RERANK_FACTOR = int(os.getenv("VECTOR_RERANK_FACTOR", "10"))
+# pgvector >= 0.8 keeps scanning the HNSW graph until a version-filtered search
+# has found k rows ("strict_order" or "relaxed_order"); "off" for older pgvector.
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "strict_order").lower()
+# How long customer versions and the set of documented versions are cached.
+DOC_VERSION_CACHE_TTL_S = float(os.getenv("DOC_VERSION_CACHE_TTL_S", "300"))
+# Newest ticket log entries returned with a ticket's details.
+TICKET_EVENTS_IN_CONTEXT = int(os.getenv("TICKET_EVENTS_IN_CONTEXT", "5"))
+# Tickets in these statuses are searched for known resolutions of similar issues.
+# Must match the predicate of `tickets_resolved_embedding_idx` in schema.sql.
+RESOLVED_TICKET_STATUSES = ("Resolved", "Closed")
+SIMILAR_TICKETS_K = int(os.getenv("SIMILAR_TICKETS_K", "2"))
+# Past tickets further away than this cosine distance are not considered similar.
+SIMILAR_TICKET_MAX_DISTANCE = float(os.getenv("SIMILAR_TICKET_MAX_DISTANCE", "0.4"))
 
 # This is the graph name for Apache AGE
 GRAPH_NAME = 'customer_support_graph'
 
-# Load the embedding model once to be used by the RAG function
-# This is efficient as it doesn't reload the model on every call.
-embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+# Vertex and edge labels used by the conversation memory. They are created up
+# front so prepared statements never get planned against a missing label.
+GRAPH_VERTEX_LABELS = ("User", "Session", "Message")
+GRAPH_EDGE_LABELS = ("HAS_SESSION", "CONTAINS")
+
+# The embedding model is loaded once, on first use or by `startup.warm_up`
+# (in parallel with the other warm-up steps), and shared by every call.
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+_embedding_model: Optional[SentenceTransformer] = None
+_embedding_model_lock = threading.Lock()
+# Repeated queries reuse their vector instead of running the encoder again.
+query_embedding_cache = embedding_cache.EmbeddingCache(EMBEDDING_MODEL_NAME)
 
 # --- DATABASE CONNECTION POOLING ---
 # Initialize connection pool globally. It will be created on first successful connection attempt.
 conn_pool = None
+# Parallel warm-up steps may all reach the first connection checkout at once.
+_pool_init_lock = threading.Lock()
+
+# Counters describing how hard the pool is being pushed (see `get_pool_stats`).
+_pool_stats_lock = threading.Lock()
+_pool_stats = {"checkouts": 0, "exhausted": 0, "peak_in_use": 0}
+
+
+class AgeConnection(connection):
+    """A psycopg2 connection that remembers its per-session AGE setup.
+
+    Pooled connections live for the lifetime of the process, so the AGE
+    session setup (`LOAD 'age'`, `search_path`) and the server-side prepared
+    Cypher statements only need to be created once per connection.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.age_ready = False
+        self.prepared_statements: set = set()
 
 def initialize_connection_pool() -> None:
     """
     Initializes the global psycopg2 connection pool if it is not already set.
 
-    This function creates a `psycopg2.pool.SimpleConnectionPool` using global
+    This function creates a `psycopg2.pool.ThreadedConnectionPool` using global
     database configuration variables (DB_NAME, DB_USER, etc.) and assigns it
-    to the global `conn_pool` variable.
+    to the global `conn_pool` variable. The threaded pool is required because
+    concurrent sessions (Streamlit reruns, the load tester) share it.
 
     Raises:
         Exception: If the connection pool cannot be created (e.g., due to
@@ -49,23 +116,25 @@ def initialize_connection_pool() -> None:
             is re-raised after logging the error.
     """
     global conn_pool
-    if conn_pool is None:
-        try:
-            # Only initialize if not already set
-            conn_pool = pool.SimpleConnectionPool(
-                minconn=1,  # Minimum connections to keep open
-                maxconn=10, # Maximum connections in the pool
-                dbname=DB_NAME,
-                user=DB_USER,
-                password=DB_PASSWORD,
-                host=DB_HOST,
-                port=DB_PORT
-            )
-            print("Database connection pool initialized.")
-        except Exception as e:
-            print(f"Error initializing connection pool: {e}")
-            # Re-raise to indicate a critical setup failure
-            raise 
+    with _pool_init_lock:
+        if conn_pool is None:
+            try:
+                # Only initialize if not already set
+                conn_pool = pool.ThreadedConnectionPool(
+                    minconn=DB_POOL_MINCONN,  # Minimum connections to keep open
+                    maxconn=DB_POOL_MAXCONN,  # Maximum connections in the pool
+                    dbname=DB_NAME,
+                    user=DB_USER,
+                    password=DB_PASSWORD,
+                    host=DB_HOST,
+                    port=DB_PORT,
+                    connection_factory=AgeConnection
+                )
+                print("Database connection pool initialized.")
+            except Exception as e:
+                print(f"Error initializing connection pool: {e}")
+                # Re-raise to indicate a critical setup failure
+                raise 
 
 def get_db_connection() -> Optional[connection]:
     """
@@ -78,7 +147,10 @@ def get_db_connection() -> Optional[connection]:
     3.  Configures the connection for use with the Apache AGE extension by:
         - Loading the 'age' extension.
         - Setting the appropriate 'search_path'.
-        - Idempotently creating the specified graph if it does not already exist.
+        - Idempotently creating the specified graph (and its labels) if it
+          does not already exist.
+        The setup is committed and only runs the first time a pooled
+        connection is handed out.
 
     Returns:
         Optional[connection]: A configured `psycopg2` connection object on
@@ -98,20 +170,29 @@ def get_db_connection() -> Optional[connection]:
         # Initialize conn to None before the try block
         conn = None 
         try:
-            conn = conn_pool.getconn()
-
-            # --- IMPORTANT: Setup AGE for every new session (connection) ---
-            with conn.cursor() as cursor:
-                cursor.execute("LOAD 'age';")
-                cursor.execute("SET search_path = ag_catalog, '$user', public;")
-
-                # Check if the graph exists, if not create it (idempotent)
-                cursor.execute("SELECT nspname FROM pg_namespace WHERE nspname = %s;", (GRAPH_NAME,))
-                if cursor.fetchone() is None:
-                    cursor.execute("SELECT create_graph(%s);", (GRAPH_NAME,))
-                    # Commit graph creation
-                    conn.commit() 
-                    print(f"Graph '{GRAPH_NAME}' created.")
+            try:
+                conn = conn_pool.getconn()
+            except pool.PoolError:
+                with _pool_stats_lock:
+                    _pool_stats["exhausted"] += 1
+                raise
+            _record_checkout()
+
+            # --- IMPORTANT: Setup AGE once for every new session (connection) ---
+            if not conn.age_ready:
+                with conn.cursor() as cursor:
+                    cursor.execute("LOAD 'age';")
+                    cursor.execute("SET search_path = ag_catalog, '$user', public;")
+
+                    # Check if the graph exists, if not create it (idempotent)
+                    cursor.execute("SELECT nspname FROM pg_namespace WHERE nspname = %s;", (GRAPH_NAME,))
+                    if cursor.fetchone() is None:
+                        cursor.execute("SELECT create_graph(%s);", (GRAPH_NAME,))
+                        print(f"Graph '{GRAPH_NAME}' created.")
+                    _ensure_graph_labels(cursor)
+                # Commit so the session settings survive later rollbacks.
+                conn.commit()
+                conn.age_ready = True
 
             return conn
         except Exception as e:
@@ -123,48 +204,193 @@ def get_db_connection() -> Optional[connection]:
             return None
     return None
 
+def _ensure_graph_labels(cursor) -> None:
+    """Creates any missing vertex/edge labels of the conversation graph."""
+    cursor.execute(
+        """
+        SELECT l.name FROM ag_catalog.ag_label l
+        JOIN ag_catalog.ag_graph g ON g.graphid = l.graph
+        WHERE g.name = %s;
+        """,
+        (GRAPH_NAME,)
+    )
+    existing = {row[0] for row in cursor.fetchall()}
+    for label in GRAPH_VERTEX_LABELS:
+        if label not in existing:
+            cursor.execute("SELECT create_vlabel(%s, %s);", (GRAPH_NAME, label))
+    for label in GRAPH_EDGE_LABELS:
+        if label not in existing:
+            cursor.execute("SELECT create_elabel(%s, %s);", (GRAPH_NAME, label))
+
+
+def warm_connection_pool(connections: int = DB_POOL_MINCONN) -> int:
+    """Opens up to `connections` pooled connections ahead of the first turn.
+
+    Every connection runs its AGE session setup on checkout (and the first one
+    creates the graph on a fresh database), so turns find them ready.
+
+    Returns:
+        int: The number of connections that were checked out successfully.
+    """
+    conns = []
+    try:
+        # Held together so each checkout opens (and sets up) a distinct connection.
+        for _ in range(max(1, min(connections, DB_POOL_MAXCONN))):
+            conn = get_db_connection()
+            if conn is None:
+                break
+            conns.append(conn)
+    finally:
+        for conn in conns:
+            conn_pool.putconn(conn)
+    return len(conns)
+
+
+def prewarm_knowledge_base() -> Optional[int]:
+    """Loads `pg_docs` and its indexes (including the HNSW index) into shared buffers.
+
+    Uses the optional `pg_prewarm` extension (migrations/006_pg_prewarm.sql,
+    not part of schema.sql), so the first searches after a database restart
+    do not read the index from disk.
+
+    Returns:
+        Optional[int]: The number of blocks loaded, or None if the extension
+        is not installed or prewarming failed.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_prewarm';")
+            if cursor.fetchone() is None:
+                print("Warning: Could not prewarm the knowledge base: the pg_prewarm extension is missing. "
+                      "Run migrations/006_pg_prewarm.sql (needs PostgreSQL contrib) or unset STARTUP_PG_PREWARM.")
+                conn.rollback()
+                return None
+            cursor.execute(
+                """
+                SELECT coalesce(sum(pg_prewarm(c.oid)), 0)::bigint FROM pg_class c
+                WHERE c.oid = 'public.pg_docs'::regclass
+                   OR c.oid IN (SELECT indexrelid FROM pg_index WHERE indrelid = 'public.pg_docs'::regclass);
+                """
+            )
+            blocks = cursor.fetchone()[0]
+        conn.commit()
+        return int(blocks)
+    except Exception as e:
+        print(f"Warning: Could not prewarm the knowledge base: {e}")
+        conn.rollback()
+        return None
+    finally:
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+def check_database() -> bool:
+    """Returns True if a pooled connection answers a trivial query (for readiness probes)."""
+    conn = get_db_connection()
+    if not conn:
+        return False
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1;")
+            cursor.fetchone()
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"Warning: Database health check failed: {e}")
+        conn.rollback()
+        return False
+    finally:
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+def _open_listener_connection() -> connection:
+    """Opens a dedicated, non-pooled connection for the history cache's NOTIFY listener."""
+    return psycopg2.connect(
+        dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+        host=DB_HOST, port=DB_PORT
+    )
+
+
+def _record_checkout() -> None:
+    """Updates the pool counters after a connection has been checked out."""
+    with _pool_stats_lock:
+        _pool_stats["checkouts"] += 1
+        # psycopg2 pools keep checked-out connections in the private `_used` map.
+        in_use = len(conn_pool._used)
+        _pool_stats["peak_in_use"] = max(_pool_stats["peak_in_use"], in_use)
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Returns a snapshot of the connection pool's utilization.
+
+    Returns:
+        Dict[str, Any]: 'maxconn', the current 'in_use' and 'idle' connection
+        counts, plus the cumulative 'checkouts', 'exhausted' (checkouts that
+        failed because every connection was busy) and 'peak_in_use' counters.
+    """
+    with _pool_stats_lock:
+        stats = dict(_pool_stats)
+        stats["maxconn"] = DB_POOL_MAXCONN
+        stats["in_use"] = len(conn_pool._used) if conn_pool else 0
+        stats["idle"] = len(conn_pool._pool) if conn_pool else 0
+    return stats
+
+
+@tracing.traced("db.create_or_update_ticket")
 def create_or_update_ticket(ticket_id: str, user_id: int, description: str, log: str) -> bool:
     """Idempotently creates a new ticket in the database.
 
-    This function checks if a ticket with the given `ticket_id` already exists
-    in the 'tickets' table. If it does not exist, a new ticket record is
-    inserted with the provided details. If the ticket already exists, the
-    function takes no action and returns successfully.
+    The ticket and its first log entry are written by a single
+    `INSERT ... ON CONFLICT (ticket_id) DO NOTHING ... RETURNING` statement,
+    so concurrent callers cannot race between an existence check and the
+    insert. If the ticket already exists, nothing is written (in particular,
+    the log entry is not appended a second time) and the call still succeeds.
 
     This design ensures that the operation can be safely repeated without
     creating duplicate entries. Note: Despite the name, this function only
-    handles creation, not updates.
+    handles creation, not updates; use `add_ticket_event` to log progress.
 
     Args:
         ticket_id (str): The unique identifier for the ticket.
         user_id (int): The ID of the user associated with the ticket.
         description (str): A detailed description of the ticket's issue or content.
-        log (str): A log entry or initial comment for the ticket.
+        log (str): The initial log entry for the ticket.
 
     Returns:
         bool: True if the ticket was successfully created or if it already
               existed. False if a database connection could not be established
               or if an error occurred during the transaction.
     """
+    embedding = _ticket_embedding(description)
     conn = get_db_connection()
     if not conn:
         return False
 
     try:
         with conn.cursor() as cursor:
-            # Check for existence to ensure idempotency
-            cursor.execute("SELECT ticket_id FROM tickets WHERE ticket_id = %s;", (ticket_id,))
-            if cursor.fetchone():
-                print(f"Ticket {ticket_id} already exists. Skipping creation.")
-                return True
-
-            # Insert the new ticket record
             cursor.execute(
-                "INSERT INTO tickets (ticket_id, user_id, description, log) VALUES (%s, %s, %s, %s);",
-                (ticket_id, user_id, description, log)
+                """
+                WITH new_ticket AS (
+                    INSERT INTO tickets (ticket_id, user_id, description, embedding) VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (ticket_id) DO NOTHING
+                    RETURNING ticket_id
+                )
+                INSERT INTO ticket_events (ticket_id, entry)
+                SELECT ticket_id, %s FROM new_ticket
+                RETURNING ticket_id;
+                """,
+                (ticket_id, user_id, description, embedding, log)
             )
-            conn.commit()
+            created = cursor.fetchone() is not None
+        conn.commit()
+        if created:
             print(f"Successfully created ticket {ticket_id}.")
+        else:
+            print(f"Ticket {ticket_id} already exists. Skipping creation.")
         return True
     except Exception as e:
         print(f"An error occurred in create_or_update_ticket: {e}")
@@ -178,7 +404,13 @@ def create_or_update_ticket(ticket_id: str, user_id: int, description: str, log:
 
 # --- RAG: KNOWLEDGE BASE FUNCTIONS (pgvector) ---
 
-def query_vector_db(query_text: str, k: int = 3) -> list[dict]:
+def query_vector_db(
+    query_text: str,
+    k: int = 3,
+    pg_version: Optional[int] = None,
+    query_embedding: Optional[Any] = None,
+    include_embeddings: bool = False
+) -> list[dict]:
     """Finds the most relevant documents for a given text query.
 
     This function converts the input `query_text` into a numerical vector
@@ -186,21 +418,39 @@ def query_vector_db(query_text: str, k: int = 3) -> list[dict]:
     PostgreSQL database, presumably equipped with the pgvector extension,
     to find the `k` most semantically similar documents.
 
-    The similarity search is performed using the L2 distance operator (`<=>`)
-    on the stored embeddings in the `pg_docs` table.
+    The similarity search is performed using the cosine distance operator
+    (`<=>`) on the stored embeddings in the `pg_docs` table. The column and
+    index depend on `VECTOR_SEARCH_MODE` (see `_vector_search_sql`).
+
+    With `pg_version`, only documents of that PostgreSQL version are searched.
+    The filter is served by the version's partial HNSW index, and pgvector's
+    iterative index scan (`VECTOR_ITERATIVE_SCAN`) keeps the other modes from
+    returning fewer than `k` rows when the filter is selective.
 
     Args:
         query_text (str): The natural language query to search for.
         k (int, optional): The maximum number of relevant documents to return.
             Defaults to 3.
+        pg_version (Optional[int], optional): Restrict the search to this
+            PostgreSQL major version (see `resolve_doc_version`). Defaults to
+            None (all versions).
+        query_embedding (Optional[Any], optional): A precomputed embedding of
+            the query (a list of floats or pgvector text, e.g. a ticket's
+            stored embedding). When given, `query_text` is not embedded.
+        include_embeddings (bool, optional): Also return each document's
+            stored embedding (a list of floats), for the diversity
+            re-ranking in `retrieval_policy.py`. Defaults to False.
 
     Returns:
         list[dict]: A list of the top `k` matching documents, sorted by
-            relevance. Each dictionary contains 'content', 'title', and 'url'.
+            relevance. Each dictionary contains 'content', 'title', 'url'
+            and the cosine 'distance' to the query (see `retrieval_policy.py`).
             Returns an empty list if a database connection fails or an
             error occurs during the query.
     """
-    query_embedding = embedding_model.encode(query_text).tolist()
+    if query_embedding is None:
+        with tracing.span("embedding"):
+            query_embedding = embed_query(query_text)
     
     conn = get_db_connection()
     if not conn:
@@ -208,22 +458,22 @@ def query_vector_db(query_text: str, k: int = 3) -> list[dict]:
         
     results = []
     try:
-        with conn.cursor() as cursor:
-            # The '<=>' operator calculates the L2 distance, which is inversely
-            # related to cosine similarity for normalized vectors.
+        with tracing.span("vector_search", k=k, mode=VECTOR_SEARCH_MODE, pg_version=pg_version), conn.cursor() as cursor:
+            if pg_version is not None:
+                _enable_iterative_scan(conn, cursor)
+            # The '<=>' operator calculates the cosine distance.
             # We order by this distance to get the "closest" matches first.
-            cursor.execute(
-                """
-                SELECT content, title, url
-                FROM pg_docs
-                ORDER BY embedding <=> %s
-                LIMIT %s;
-                """,
-                (str(query_embedding), k)
-            )
+            sql, params = _vector_search_sql(VECTOR_SEARCH_MODE, str(query_embedding), k, pg_version, include_embeddings)
+            cursor.execute(sql, params)
             rows = cursor.fetchall()
             for row in rows:
-                results.append({"content": row[0], "title": row[1], "url": row[2]})
+                result = {"content": row[0], "title": row[1], "url": row[2], "distance": float(row[3])}
+                if include_embeddings:
+                    # pgvector's text form ("[0.1,0.2,...]") is a JSON array.
+                    result["embedding"] = json.loads(row[4])
+                results.append(result)
+            # Recorded so retrieval changes show up in traces and in eval_regression.py.
+            tracing.set_attributes(urls=[r["url"] for r in results], distances=[round(r["distance"], 4) for r in results])
     except Exception as e:
         print(f"An error occurred during vector query: {e}")
         # On error, results will be an empty list, which is the correct
@@ -235,15 +485,206 @@ def query_vector_db(query_text: str, k: int = 3) -> list[dict]:
             
     return results
 
+
+def _enable_iterative_scan(conn, cursor) -> None:
+    """Turns on pgvector's iterative HNSW scan for the current transaction, if supported."""
+    global VECTOR_ITERATIVE_SCAN
+    if VECTOR_ITERATIVE_SCAN == "off":
+        return
+    try:
+        cursor.execute(f"SET LOCAL hnsw.iterative_scan = {VECTOR_ITERATIVE_SCAN};")
+    except psycopg2.Error as e:
+        print(f"Warning: Iterative index scans are unavailable (pgvector < 0.8?), disabling them: {e}")
+        conn.rollback()
+        VECTOR_ITERATIVE_SCAN = "off"
+
+
+def _vector_search_sql(
+    mode: str,
+    embedding: str,
+    k: int,
+    pg_version: Optional[int] = None,
+    include_embeddings: bool = False
+) -> Tuple[str, tuple]:
+    """Builds the nearest-neighbour query for a storage mode.
+
+    - "full": HNSW over the float32 `embedding` column.
+    - "half": HNSW over the half-precision `embedding_half` column.
+    - "binary": HNSW over `binary_quantize(embedding_half)` by Hamming
+      distance, fetching `k * VECTOR_RERANK_FACTOR` candidates that are then
+      re-scored by exact cosine distance on `embedding_half`. The expression
+      must match the index in `migrations/001_quantized_embeddings.sql`.
+
+    `pg_version` adds a `pg_version = ...` filter. psycopg2 inlines it as a
+    literal, which lets the planner match the version's partial index.
+
+    Returns:
+        Tuple[str, tuple]: The SQL (selecting content, title, url, the cosine
+        distance and, with `include_embeddings`, the searched vector as text)
+        and its parameters.
+    """
+    where = "WHERE pg_version = %s" if pg_version is not None else ""
+    filter_params = (pg_version,) if pg_version is not None else ()
+    vector_column = "embedding" if mode == "full" else "embedding_half"
+    extra = f", {vector_column}::text" if include_embeddings else ""
+    if mode == "half":
+        return (
+            f"""
+            SELECT content, title, url, embedding_half <=> %s::halfvec(384) AS distance{extra}
+            FROM pg_docs
+            {where}
+            ORDER BY distance
+            LIMIT %s;
+            """,
+            (embedding, *filter_params, k),
+        )
+    if mode == "binary":
+        return (
+            f"""
+            SELECT content, title, url, embedding_half <=> %s::halfvec(384) AS distance{extra}
+            FROM (
+                SELECT content, title, url, embedding_half
+                FROM pg_docs
+                {where}
+                ORDER BY binary_quantize(embedding_half)::bit(384) <~> binary_quantize(%s::halfvec(384))
+                LIMIT %s
+            ) candidates
+            ORDER BY distance
+            LIMIT %s;
+            """,
+            (embedding, *filter_params, embedding, k * VECTOR_RERANK_FACTOR, k),
+        )
+    return (
+        f"""
+        SELECT content, title, url, embedding <=> %s AS distance{extra}
+        FROM pg_docs
+        {where}
+        ORDER BY distance
+        LIMIT %s;
+        """,
+        (embedding, *filter_params, k),
+    )
+
+
+# (expires_at, value) entries; see `resolve_doc_version`.
+_doc_version_cache: Dict[Any, Tuple[float, Any]] = {}
+_doc_version_cache_lock = threading.Lock()
+
+
+def _cached_version_lookup(key: Any, load) -> Any:
+    now = time.monotonic()
+    with _doc_version_cache_lock:
+        entry = _doc_version_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+    value = load()
+    if value is not None:  # Lookup errors are retried on the next call.
+        with _doc_version_cache_lock:
+            _doc_version_cache[key] = (now + DOC_VERSION_CACHE_TTL_S, value)
+    return value
+
+
+def _query_scalar_list(sql: str, params: tuple = ()) -> Optional[list]:
+    conn = get_db_connection()
+    if not conn:
+        return None
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [row[0] for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"An error occurred during a version lookup: {e}")
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.resolve_doc_version")
+def resolve_doc_version(user_id: int) -> Optional[int]:
+    """Returns the documentation version to search for a customer.
+
+    This is the customer's PostgreSQL major version from the `customers`
+    table, or the newest documented version below it when the knowledge base
+    has no documents for that exact version. Returns None (search all
+    versions) for unknown customers or when no older version is documented,
+    so a filter never leaves the agent without articles. Both lookups are
+    cached for `DOC_VERSION_CACHE_TTL_S` seconds.
+
+    Args:
+        user_id (int): The unique identifier of the user.
+
+    Returns:
+        Optional[int]: The version to pass to `query_vector_db`, or None.
+    """
+    customer_versions = _cached_version_lookup(
+        ("customer", user_id),
+        lambda: _query_scalar_list("SELECT pg_version FROM customers WHERE user_id = %s;", (user_id,))
+    )
+    if not customer_versions or customer_versions[0] is None:
+        return None
+    documented = _cached_version_lookup(
+        "documented",
+        lambda: _query_scalar_list("SELECT DISTINCT pg_version FROM pg_docs;")
+    ) or []
+    candidates = [v for v in documented if v <= customer_versions[0]]
+    return max(candidates) if candidates else None
+
+
+def get_embedding_model() -> SentenceTransformer:
+    """Returns the shared embedding model, loading it on first use."""
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                _embedding_model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+    return _embedding_model
+
+
+def embed_query(query_text: str) -> List[float]:
+    """Returns the embedding of a query, from the embedding cache when possible."""
+    if not embedding_cache.EMBEDDING_CACHE_ENABLED:
+        return get_embedding_model().encode(query_text).tolist()
+    try:
+        cached = query_embedding_cache.get(query_text)
+    except Exception as e:
+        print(f"Warning: Embedding cache lookup failed: {e}")
+        return get_embedding_model().encode(query_text).tolist()
+    if cached is not None:
+        tracing.set_attributes(cache_hit=True)
+        return cached.tolist()
+
+    vector = get_embedding_model().encode(query_text)
+    tracing.set_attributes(cache_hit=False)
+    try:
+        query_embedding_cache.put(query_text, vector)
+    except Exception as e:
+        print(f"Warning: Failed to store query embedding: {e}")
+    return vector.tolist()
+
+
+def _ticket_embedding(description: str) -> Optional[str]:
+    """Embeds a ticket description for the `tickets.embedding` column (None on failure)."""
+    if not description:
+        return None
+    try:
+        return str(embed_query(description))
+    except Exception as e:
+        print(f"Warning: Failed to embed ticket description: {e}")
+        return None
+
 # --- SoR: SYSTEM OF RECORD FUNCTIONS (Tickets) ---
 
+@tracing.traced("db.create_ticket")
 def create_ticket(user_id: int, description: str) -> Optional[str]:
     """Creates a new support ticket and stores it in the database.
 
-    This function generates a unique, human-readable ticket ID (e.g.,
-    'TICKET-A1B2C3D4') and creates an initial log entry with the current UTC
-    timestamp. It then inserts a new record into the 'tickets' table
-    with the provided user ID and description.
+    The ticket ID is generated by the database from a sequence (e.g.,
+    'TICKET-000042'), so it is unique without a retry loop. The ticket and its
+    initial "Ticket created." log entry are inserted by one statement, which
+    returns the new ID. The description is embedded once here, before a
+    connection is taken from the pool, and stored with the ticket.
 
     The entire operation is performed within a single database transaction,
     which is committed on success or rolled back on failure to ensure data
@@ -258,9 +699,7 @@ def create_ticket(user_id: int, description: str) -> Optional[str]:
         successful insertion. Returns `None` if a database connection
         fails or if any error occurs during the transaction.
     """
-    ticket_id = f"TICKET-{str(uuid.uuid4())[:8].upper()}"
-    log_entry = f"{datetime.utcnow().isoformat()}: Ticket created."
-    
+    embedding = _ticket_embedding(description)
     conn = get_db_connection()
     if not conn:
         return None
@@ -268,9 +707,18 @@ def create_ticket(user_id: int, description: str) -> Optional[str]:
     try:
         with conn.cursor() as cursor:
             cursor.execute(
-                "INSERT INTO tickets (ticket_id, user_id, description, log) VALUES (%s, %s, %s, %s);",
-                (ticket_id, user_id, description, log_entry)
+                """
+                WITH new_ticket AS (
+                    INSERT INTO tickets (user_id, description, embedding) VALUES (%s, %s, %s)
+                    RETURNING ticket_id
+                )
+                INSERT INTO ticket_events (ticket_id, entry)
+                SELECT ticket_id, 'Ticket created.' FROM new_ticket
+                RETURNING ticket_id;
+                """,
+                (user_id, description, embedding)
             )
+            ticket_id = cursor.fetchone()[0]
         conn.commit()
         return ticket_id
     except Exception as e:
@@ -283,21 +731,72 @@ def create_ticket(user_id: int, description: str) -> Optional[str]:
             conn_pool.putconn(conn)
 
 
-def get_ticket_details(ticket_id: str) -> Optional[Dict[str, Any]]:
+@tracing.traced("db.add_ticket_event")
+def add_ticket_event(ticket_id: str, entry: str) -> bool:
+    """Appends an entry to a ticket's log.
+
+    Log entries are rows of the append-only `ticket_events` table, so an
+    append is one small insert no matter how long the log already is.
+
+    Args:
+        ticket_id (str): The ticket to log against.
+        entry (str): The text of the entry; the time is set by the database.
+
+    Returns:
+        bool: True on success, False if the ticket does not exist, a database
+        connection could not be established or an error occurred.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO ticket_events (ticket_id, entry) VALUES (%s, %s);",
+                (ticket_id, entry)
+            )
+        conn.commit()
+        return True
+    except Exception as e:
+        print(f"An error occurred adding a ticket event: {e}")
+        conn.rollback()
+        return False
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.get_ticket_details")
+def get_ticket_details(
+    ticket_id: str,
+    events: int = TICKET_EVENTS_IN_CONTEXT,
+    include_embedding: bool = False
+) -> Optional[Dict[str, Any]]:
     """Retrieves all details for a given ticket ID from the database.
 
     This function queries the `tickets` table for a single record matching the
-    provided `ticket_id`. If a matching record is found, it is formatted into a
-    dictionary containing the ticket's essential fields.
+    provided `ticket_id`, together with its newest log entries from
+    `ticket_events` (a backward scan of the `(ticket_id, id)` index, so the
+    cost does not grow with the length of the log). Both come back in one
+    round trip.
 
     Args:
         ticket_id (str): The unique identifier of the ticket to retrieve.
+        events (int, optional): How many of the newest log entries to include.
+            Defaults to `TICKET_EVENTS_IN_CONTEXT`.
+        include_embedding (bool, optional): Also return the stored embedding
+            of the description as 'embedding' (pgvector text, or None if it
+            was never computed). Defaults to False.
 
     Returns:
         Optional[Dict[str, Any]]: A dictionary containing the ticket's
-        'ticket_id', 'user_id', 'status', 'description', and 'log' if the
-        ticket is found. Returns `None` if the ticket does not exist, if a
-        database connection fails, or if an error occurs during the query.
+        'ticket_id', 'user_id', 'status', 'description', and 'events' (the
+        newest log entries, oldest first, each with an ISO 'at' timestamp and
+        the 'entry' text) if the ticket is found. Returns `None` if the ticket
+        does not exist, if a database connection fails, or if an error occurs
+        during the query.
     """
     conn = get_db_connection()
     if not conn:
@@ -306,18 +805,35 @@ def get_ticket_details(ticket_id: str) -> Optional[Dict[str, Any]]:
     try:
         with conn.cursor() as cursor:
             cursor.execute(
-                "SELECT ticket_id, user_id, status, description, log FROM tickets WHERE ticket_id = %s;",
-                (ticket_id,)
+                f"""
+                SELECT t.ticket_id, t.user_id, t.status, t.description,
+                       COALESCE((
+                           SELECT json_agg(json_build_object('at', e.created_at, 'entry', e.entry) ORDER BY e.id)
+                           FROM (
+                               SELECT id, created_at, entry FROM ticket_events
+                               WHERE ticket_id = t.ticket_id
+                               ORDER BY id DESC
+                               LIMIT %s
+                           ) e
+                       ), '[]'::json),
+                       {"t.embedding::text" if include_embedding else "NULL"}
+                FROM tickets t
+                WHERE t.ticket_id = %s;
+                """,
+                (events, ticket_id)
             )
             ticket = cursor.fetchone()
             if ticket:
-                return {
+                details = {
                     "ticket_id": ticket[0],
                     "user_id": ticket[1],
                     "status": ticket[2],
                     "description": ticket[3],
-                    "log": ticket[4]
+                    "events": ticket[4]
                 }
+                if include_embedding:
+                    details["embedding"] = ticket[5]
+                return details
             # Return None if no ticket was found
             return None
     except Exception as e:
@@ -329,192 +845,1317 @@ def get_ticket_details(ticket_id: str) -> Optional[Dict[str, Any]]:
             conn_pool.putconn(conn)
 
 
-def get_tickets_by_user(user_id: int) -> Optional[List[Dict[str, Any]]]:
-    """Retrieves all tickets for a specific user, sorted by creation date.
+@tracing.traced("db.find_similar_tickets")
+def find_similar_tickets(
+    query_embedding: Any,
+    k: int = SIMILAR_TICKETS_K,
+    exclude_ticket_id: Optional[str] = None,
+    max_distance: float = SIMILAR_TICKET_MAX_DISTANCE
+) -> List[Dict[str, Any]]:
+    """Finds resolved tickets whose description is close to an embedding.
 
-    This function queries the `tickets` table for all records matching the
-    provided `user_id`. The results are ordered in descending order of their
-    creation time (`created_at` column), ensuring that the newest tickets
-    appear first in the returned list.
+    Only tickets in `RESOLVED_TICKET_STATUSES` are searched, through the
+    partial HNSW index `tickets_resolved_embedding_idx`, so the search cost
+    does not depend on the number of open tickets. Each match comes with its
+    newest log entry, which for a resolved ticket describes the resolution.
 
     Args:
-        user_id (int): The unique identifier of the user whose tickets are
-            to be fetched.
+        query_embedding (Any): The embedding to compare against (a list of
+            floats or pgvector text, e.g. a ticket's stored embedding).
+        k (int, optional): The maximum number of tickets to return.
+            Defaults to `SIMILAR_TICKETS_K`.
+        exclude_ticket_id (Optional[str], optional): A ticket to leave out,
+            typically the one the embedding belongs to. Defaults to None.
+        max_distance (float, optional): The largest cosine distance still
+            considered similar. Defaults to `SIMILAR_TICKET_MAX_DISTANCE`.
 
     Returns:
-        Optional[List[Dict[str, Any]]]: A list of dictionaries, where each
-        dictionary represents a single ticket and contains the 'ticket_id',
-        'status', and 'description'. If the user has no tickets, an empty
-        list is returned. Returns `None` if a database connection cannot
-        be established or if an error occurs during the query.
+        List[Dict[str, Any]]: The matches, closest first, each with
+        'ticket_id', 'description', 'resolution' and 'distance'. Returns an
+        empty list if a database connection fails or an error occurs.
     """
     conn = get_db_connection()
     if not conn:
-        return None
+        return []
 
-    tickets: List[Dict[str, Any]] = []
     try:
         with conn.cursor() as cursor:
-            # Query for tickets and order by the newest first
             cursor.execute(
-                "SELECT ticket_id, status, description FROM tickets WHERE user_id = %s ORDER BY created_at DESC;",
-                (user_id,)
+                """
+                SELECT t.ticket_id, t.description,
+                       (SELECT entry FROM ticket_events e WHERE e.ticket_id = t.ticket_id ORDER BY id DESC LIMIT 1),
+                       t.distance
+                FROM (
+                    SELECT ticket_id, description, embedding <=> %s::vector AS distance
+                    FROM tickets
+                    WHERE status IN %s
+                    ORDER BY embedding <=> %s::vector
+                    LIMIT %s
+                ) t
+                WHERE t.distance <= %s AND t.ticket_id IS DISTINCT FROM %s
+                ORDER BY t.distance;
+                """,
+                (str(query_embedding), RESOLVED_TICKET_STATUSES, str(query_embedding),
+                 k + 1, max_distance, exclude_ticket_id)
             )
-            rows = cursor.fetchall()
-            for row in rows:
-                tickets.append({"ticket_id": row[0], "status": row[1], "description": row[2]})
-        return tickets
+            return [
+                {"ticket_id": row[0], "description": row[1], "resolution": row[2], "distance": round(row[3], 4)}
+                for row in cursor.fetchall()
+            ][:k]
     except Exception as e:
-        print(f"An error occurred getting tickets by user: {e}")
-        return None
+        print(f"An error occurred finding similar tickets: {e}")
+        return []
     finally:
         # Always return the connection to the pool
         if conn and conn_pool:
             conn_pool.putconn(conn)
 
 
-# --- CAG: GRAPH MEMORY FUNCTIONS (Apache AGE) ---
-
-def add_message_to_graph(user_id: int, session_id: str, message_text: str, author: str) -> bool:
-    """Adds a message node to a conversation graph in Apache AGE.
-
-    This function models a conversation by creating and linking nodes in the
-    graph. It follows this structure: (User)-[:HAS_SESSION]->(Session)-[:CONTAINS]->(Message).
-    It uses `MERGE` to idempotently create the User and Session nodes, ensuring
-    they are not duplicated. A new `Message` node is then created for each call.
-
-    **Query Construction Method:**
-    This function manually constructs the Cypher query string. This is a deliberate
-    choice to work around the specific parsing requirements of the Apache AGE
-    `cypher()` function, which expects the entire query as a single string literal.
+def backfill_ticket_embeddings(batch_size: int = 100) -> int:
+    """Computes `tickets.embedding` for tickets that do not have one yet.
 
-    To prevent SQL or Cypher injection vulnerabilities, all external inputs
-    (`message_text`, `author`) are safely escaped into valid JSON string
-    literals using `json.dumps()` before being interpolated into the query.
-    The final command is then wrapped in PostgreSQL's dollar-quoting (`$$...$$`).
+    Needed once after `migrations/005_ticket_embeddings.sql`; new tickets are
+    embedded when they are created.
 
     Args:
-        user_id (int): The identifier for the user who owns the session.
-        session_id (str): The unique identifier for the conversation session.
-        message_text (str): The content of the message to be added.
-        author (str): The author of the message (e.g., 'user', 'assistant').
+        batch_size (int, optional): Tickets encoded and updated per transaction.
 
     Returns:
-        bool: True if the message was successfully added and the transaction
-              was committed. False if a database connection or query execution
-              error occurred.
+        int: The number of tickets updated.
     """
     conn = get_db_connection()
     if not conn:
-        return False
+        return 0
 
+    updated = 0
     try:
-        # 1. Safely escape user-provided strings into valid JSON string literals.
-        safe_message_text = json.dumps(message_text)
-        safe_author = json.dumps(author)
-
-        # 2. Construct the inner Cypher query using the escaped values.
-        cypher_query = f"""
-        MERGE (u:User {{id: {user_id}}})
-        MERGE (s:Session {{id: '{session_id}'}})
-        MERGE (u)-[:HAS_SESSION]->(s)
-        
-        CREATE (m:Message {{
-            text: {safe_message_text},
-            author: {safe_author},
-            timestamp: timestamp()
-        }})
-        CREATE (s)-[:CONTAINS]->(m)
-        """
-
-        # 3. Construct the final outer SQL command, wrapping the Cypher query
-        # in the required dollar-quoted ($$) syntax for AGE.
-        final_sql_command = f"""
-            SELECT * FROM cypher('{GRAPH_NAME}', $$
-                {cypher_query}
-            $$) AS (v agtype);
-        """
-
-        # 4. Execute the complete command. No parameters are needed here because
-        # the entire string has been built safely.
         with conn.cursor() as cursor:
-            cursor.execute(final_sql_command)
-        
-        conn.commit()
-        return True
+            while True:
+                cursor.execute(
+                    "SELECT ticket_id, description FROM tickets "
+                    "WHERE embedding IS NULL AND description IS NOT NULL ORDER BY id LIMIT %s;",
+                    (batch_size,)
+                )
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                vectors = get_embedding_model().encode([row[1] for row in rows])
+                execute_values(
+                    cursor,
+                    "UPDATE tickets t SET embedding = v.embedding::vector "
+                    "FROM (VALUES %s) AS v (ticket_id, embedding) WHERE t.ticket_id = v.ticket_id;",
+                    [(row[0], str(vector.tolist())) for row, vector in zip(rows, vectors)]
+                )
+                conn.commit()
+                updated += len(rows)
+        return updated
     except Exception as e:
-        print(f"An error occurred adding message to graph: {e}")
+        print(f"An error occurred backfilling ticket embeddings: {e}")
         conn.rollback()
-        return False
+        return updated
     finally:
         # Always return the connection to the pool
         if conn and conn_pool:
             conn_pool.putconn(conn)
 
 
-def get_conversation_history(session_id: str, n: int = 5) -> List[Dict[str, Any]]:
-    """Retrieves the last N messages from a conversation session graph.
+def _encode_ticket_cursor(created_at: datetime, row_id: int) -> str:
+    """Builds the opaque keyset cursor pointing just past a ticket row."""
+    return f"{created_at.isoformat()}|{row_id}"
 
-    This function queries the Apache AGE graph to find a `Session` node matching
-    the given `session_id`. It then traverses the graph to find all connected
-    `Message` nodes.
 
-    The Cypher query fetches the messages and sorts them by their timestamp in
-    descending order (newest first) to efficiently retrieve only the most
-    recent `n` messages. The final list is then reversed in Python to present
-    the conversation in the correct chronological order (oldest to newest).
+def _decode_ticket_cursor(cursor_token: str) -> Tuple[datetime, int]:
+    """Parses a cursor produced by `_encode_ticket_cursor`."""
+    created_at, row_id = cursor_token.rsplit("|", 1)
+    return datetime.fromisoformat(created_at), int(row_id)
 
-    The function also handles the conversion of data from AGE's native `agtype`
-    format into standard Python strings.
+
+def _fetch_ticket_page(
+    cursor,
+    user_id: int,
+    limit: Optional[int],
+    statuses: Optional[List[str]],
+    after: Optional[str]
+) -> List[Tuple]:
+    """Runs the keyset-paginated ticket listing on an open cursor.
+
+    The `ORDER BY created_at DESC, id DESC` and the row comparison against the
+    cursor match the `tickets_user_created_idx` index, so each page is an index
+    range scan regardless of how many tickets the user has.
+
+    Returns:
+        List[Tuple]: Rows of (id, ticket_id, status, description, created_at).
+    """
+    conditions = ["user_id = %s"]
+    params: List[Any] = [user_id]
+    if statuses:
+        conditions.append("status = ANY(%s)")
+        params.append(list(statuses))
+    if after:
+        conditions.append("(created_at, id) < (%s, %s)")
+        params.extend(_decode_ticket_cursor(after))
+    params.append(limit)
+
+    cursor.execute(
+        f"""
+        SELECT id, ticket_id, status, description, created_at
+        FROM tickets
+        WHERE {' AND '.join(conditions)}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s;
+        """,
+        params
+    )
+    return cursor.fetchall()
+
+
+@tracing.traced("db.get_tickets_by_user")
+def get_tickets_by_user(
+    user_id: int,
+    limit: Optional[int] = None,
+    statuses: Optional[List[str]] = None
+) -> Optional[List[Dict[str, Any]]]:
+    """Retrieves tickets for a specific user, sorted by creation date.
+
+    This function queries the `tickets` table for records matching the
+    provided `user_id`. The results are ordered in descending order of their
+    creation time (`created_at` column), ensuring that the newest tickets
+    appear first in the returned list. Use `get_tickets_page` to walk through
+    a long history page by page, or `get_ticket_summary` for an overview.
 
     Args:
-        session_id (str): The unique identifier for the conversation session.
-        n (int, optional): The number of recent messages to retrieve.
-            Defaults to 5.
+        user_id (int): The unique identifier of the user whose tickets are
+            to be fetched.
+        limit (Optional[int], optional): The maximum number of tickets to
+            return. Defaults to None (all tickets).
+        statuses (Optional[List[str]], optional): Only return tickets whose
+            status is in this list (e.g. ['Open']). Defaults to None (any status).
 
     Returns:
-        List[Dict[str, Any]]: A list of dictionaries, where each dictionary
-        represents a message and contains 'author' and 'text'. The list is
-        sorted in chronological order. Returns an empty list if the session
-        is not found or if a database error occurs.
+        Optional[List[Dict[str, Any]]]: A list of dictionaries, where each
+        dictionary represents a single ticket and contains the 'ticket_id',
+        'status', and 'description'. If the user has no tickets, an empty
+        list is returned. Returns `None` if a database connection cannot
+        be established or if an error occurs during the query.
     """
     conn = get_db_connection()
     if not conn:
-        return []
+        return None
 
-    # Note: session_id is directly embedded. This assumes session_id is a
-    # controlled value (like a UUID) and not arbitrary user input.
-    cypher_query = f"""
-    SELECT * FROM cypher('{GRAPH_NAME}', $$
-        MATCH (s:Session {{id: '{session_id}'}})-[:CONTAINS]->(m:Message)
-        RETURN m.author, m.text, m.timestamp
-        ORDER BY m.timestamp DESC
-        LIMIT {n}
-    $$) AS (author agtype, text agtype, ts agtype);
-    """
-    
-    history: List[Dict[str, Any]] = []
     try:
         with conn.cursor() as cursor:
-            cursor.execute(cypher_query)
-            rows = cursor.fetchall()
-            for row in rows:
-                # AGE returns agtype objects; convert them to native Python types resulting json like literal.
-                author_str = str(row[0]).strip('"') if row[0] else None
-                text_str = str(row[1]).strip('"') if row[1] else None
-                history.append({"author": author_str, "text": text_str})
-        
-        # The query returns results in reverse chronological order (newest first), so reversing.
-        return history[::-1]
+            rows = _fetch_ticket_page(cursor, user_id, limit, statuses, None)
+        return [{"ticket_id": row[1], "status": row[2], "description": row[3]} for row in rows]
     except Exception as e:
-        print(f"An error occurred getting conversation history: {e}")
-        return []
+        print(f"An error occurred getting tickets by user: {e}")
+        return None
     finally:
         # Always return the connection to the pool
         if conn and conn_pool:
             conn_pool.putconn(conn)
 
 
+@tracing.traced("db.get_tickets_page")
+def get_tickets_page(
+    user_id: int,
+    page_size: int = 20,
+    statuses: Optional[List[str]] = None,
+    after: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """Retrieves one page of a user's tickets using keyset pagination.
+
+    Unlike OFFSET pagination, the cost of fetching a page does not grow with
+    its position, because the query seeks directly to the row after `after`.
+
+    Args:
+        user_id (int): The unique identifier of the user.
+        page_size (int, optional): The number of tickets per page. Defaults to 20.
+        statuses (Optional[List[str]], optional): Only include tickets with
+            one of these statuses. Defaults to None (any status).
+        after (Optional[str], optional): The `next_cursor` returned with the
+            previous page. Defaults to None (first page).
+
+    Returns:
+        Optional[Dict[str, Any]]: A dictionary with 'tickets' (the page, newest
+        first, each with 'ticket_id', 'status', 'description' and 'created_at')
+        and 'next_cursor' (None on the last page). Returns `None` on error.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            # Fetch one extra row to know whether another page exists.
+            rows = _fetch_ticket_page(cursor, user_id, page_size + 1, statuses, after)
+        page = rows[:page_size]
+        next_cursor = _encode_ticket_cursor(page[-1][4], page[-1][0]) if len(rows) > page_size else None
+        return {
+            "tickets": [
+                {"ticket_id": row[1], "status": row[2], "description": row[3], "created_at": row[4].isoformat()}
+                for row in page
+            ],
+            "next_cursor": next_cursor,
+        }
+    except Exception as e:
+        print(f"An error occurred getting a page of tickets: {e}")
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.get_ticket_summary")
+def get_ticket_summary(user_id: int, recent: int = 5) -> Optional[Dict[str, Any]]:
+    """Summarizes a user's tickets: counts by status plus the most recent ones.
+
+    This is what the agent puts in the prompt for ticket history questions.
+    Its size is bounded by `recent` no matter how many tickets the user has,
+    while the counts still describe the full history.
+
+    Args:
+        user_id (int): The unique identifier of the user.
+        recent (int, optional): How many of the newest tickets to include.
+            Defaults to 5.
+
+    Returns:
+        Optional[Dict[str, Any]]: A dictionary with 'total' (int),
+        'by_status' (a mapping of status to count) and 'recent' (the newest
+        tickets, each with 'ticket_id', 'status' and 'description'). Returns
+        `None` if a database connection fails or an error occurs.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT status, COUNT(*) FROM tickets WHERE user_id = %s GROUP BY status ORDER BY COUNT(*) DESC;",
+                (user_id,)
+            )
+            by_status = {row[0]: row[1] for row in cursor.fetchall()}
+            rows = _fetch_ticket_page(cursor, user_id, recent, None, None)
+        return {
+            "total": sum(by_status.values()),
+            "by_status": by_status,
+            "recent": [{"ticket_id": row[1], "status": row[2], "description": row[3]} for row in rows],
+        }
+    except Exception as e:
+        print(f"An error occurred getting the ticket summary: {e}")
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+# --- CONVERSATION SESSIONS ---
+
+@tracing.traced("db.create_session")
+def create_session(user_id: int, session_id: Optional[str] = None) -> Optional[str]:
+    """Registers a new conversation for a user and returns its session ID.
+
+    Every conversation gets its own ID (a random UUID by default), which is
+    also the ID of its `Session` node in the graph, so conversations of the
+    same user never share one node. Registering an existing ID is a no-op.
+
+    Args:
+        user_id (int): The identifier of the user who owns the conversation.
+        session_id (Optional[str], optional): An explicit ID, e.g. for seeded
+            demo data. Defaults to a new UUID.
+
+    Returns:
+        Optional[str]: The session ID, or None if the insert failed.
+    """
+    session_id = session_id or str(uuid.uuid4())
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "INSERT INTO conversation_sessions (session_id, user_id) VALUES (%s, %s) "
+                "ON CONFLICT (session_id) DO NOTHING;",
+                (session_id, user_id)
+            )
+        conn.commit()
+        return session_id
+    except Exception as e:
+        print(f"An error occurred creating a session: {e}")
+        conn.rollback()
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.get_session")
+def get_session(session_id: str) -> Optional[Dict[str, Any]]:
+    """Retrieves a conversation's owner and server-side state.
+
+    Args:
+        session_id (str): The unique identifier for the conversation session.
+
+    Returns:
+        Optional[Dict[str, Any]]: A dictionary with 'session_id', 'user_id',
+        'active_ticket_id', 'created_at' and 'updated_at' (ISO strings).
+        Returns `None` if the session does not exist or an error occurs.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT session_id, user_id, active_ticket_id, created_at, updated_at "
+                "FROM conversation_sessions WHERE session_id = %s;",
+                (session_id,)
+            )
+            row = cursor.fetchone()
+        if not row:
+            return None
+        return {
+            "session_id": row[0],
+            "user_id": row[1],
+            "active_ticket_id": row[2],
+            "created_at": row[3].isoformat(),
+            "updated_at": row[4].isoformat(),
+        }
+    except Exception as e:
+        print(f"An error occurred getting a session: {e}")
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.begin_session_turn")
+def begin_session_turn(session_id: str, lease_s: float = SESSION_TURN_LEASE_S) -> Optional[Dict[str, Any]]:
+    """Claims the right to run the next turn of a conversation, across all processes.
+
+    The session row is locked (`SELECT ... FOR UPDATE`) only for the short
+    transaction that checks and sets its turn lease, so no connection is held
+    while the turn runs. Until the lease is released by `update_session` or
+    `end_session_turn`, or expires after `lease_s` (a worker that died), no
+    other worker can start a turn of the session.
+
+    Args:
+        session_id (str): The unique identifier for the conversation session.
+        lease_s (float, optional): The lease duration in seconds.
+
+    Returns:
+        Optional[Dict[str, Any]]: 'session_id', 'user_id', 'active_ticket_id'
+        and 'turn_token' (None if another turn holds the lease). Returns
+        `None` if the session does not exist or an error occurs.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT user_id, active_ticket_id, turn_lease_until > CURRENT_TIMESTAMP "
+                "FROM conversation_sessions WHERE session_id = %s FOR UPDATE;",
+                (session_id,)
+            )
+            row = cursor.fetchone()
+            if not row:
+                conn.rollback()
+                return None
+            turn_token = None
+            if not row[2]:
+                turn_token = uuid.uuid4().hex
+                cursor.execute(
+                    "UPDATE conversation_sessions SET turn_token = %s, "
+                    "turn_lease_until = CURRENT_TIMESTAMP + make_interval(secs => %s) WHERE session_id = %s;",
+                    (turn_token, lease_s, session_id)
+                )
+        conn.commit()
+        return {"session_id": session_id, "user_id": row[0], "active_ticket_id": row[1], "turn_token": turn_token}
+    except Exception as e:
+        print(f"An error occurred starting a session turn: {e}")
+        conn.rollback()
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.end_session_turn")
+def end_session_turn(session_id: str, turn_token: str) -> bool:
+    """Releases a turn lease taken by `begin_session_turn` without changing the session.
+
+    Returns:
+        bool: True if the lease was still held by `turn_token` and released.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "UPDATE conversation_sessions SET turn_token = NULL, turn_lease_until = NULL "
+                "WHERE session_id = %s AND turn_token = %s;",
+                (session_id, turn_token)
+            )
+            released = cursor.rowcount == 1
+        conn.commit()
+        return released
+    except Exception as e:
+        print(f"An error occurred ending a session turn: {e}")
+        conn.rollback()
+        return False
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.update_session")
+def update_session(session_id: str, active_ticket_id: Optional[str], turn_token: Optional[str] = None) -> bool:
+    """Stores a conversation's active ticket after a turn and marks it as recently used.
+
+    Args:
+        session_id (str): The unique identifier for the conversation session.
+        active_ticket_id (Optional[str]): The ticket the conversation is about,
+            or None.
+        turn_token (Optional[str], optional): The lease of the turn (from
+            `begin_session_turn`). If given, the session is only updated
+            while the turn still holds the lease, and the lease is released.
+
+    Returns:
+        bool: True if the session was updated, False otherwise.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+
+    try:
+        with conn.cursor() as cursor:
+            if turn_token is None:
+                cursor.execute(
+                    "UPDATE conversation_sessions SET active_ticket_id = %s, updated_at = CURRENT_TIMESTAMP "
+                    "WHERE session_id = %s;",
+                    (active_ticket_id, session_id)
+                )
+            else:
+                # A turn whose lease expired and was taken over must not overwrite the newer turn.
+                cursor.execute(
+                    "UPDATE conversation_sessions SET active_ticket_id = %s, updated_at = CURRENT_TIMESTAMP, "
+                    "turn_token = NULL, turn_lease_until = NULL WHERE session_id = %s AND turn_token = %s;",
+                    (active_ticket_id, session_id, turn_token)
+                )
+            updated = cursor.rowcount == 1
+        conn.commit()
+        return updated
+    except Exception as e:
+        print(f"An error occurred updating a session: {e}")
+        conn.rollback()
+        return False
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.list_sessions")
+def list_sessions(user_id: int, limit: int = 20) -> List[Dict[str, Any]]:
+    """Lists a user's most recently used conversations, newest first.
+
+    Args:
+        user_id (int): The unique identifier of the user.
+        limit (int, optional): The maximum number of sessions. Defaults to 20.
+
+    Returns:
+        List[Dict[str, Any]]: Sessions with 'session_id', 'active_ticket_id'
+        and 'updated_at'. Returns an empty list on error.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
+
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT session_id, active_ticket_id, updated_at FROM conversation_sessions "
+                "WHERE user_id = %s ORDER BY updated_at DESC LIMIT %s;",
+                (user_id, limit)
+            )
+            rows = cursor.fetchall()
+        return [
+            {"session_id": row[0], "active_ticket_id": row[1], "updated_at": row[2].isoformat()}
+            for row in rows
+        ]
+    except Exception as e:
+        print(f"An error occurred listing sessions: {e}")
+        return []
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+# --- CAG: GRAPH MEMORY FUNCTIONS (Apache AGE) ---
+
+# Cypher statements of the graph memory path. Each one is prepared on the
+# server once per connection (see `_execute_cypher`) and executed with a
+# single agtype parameter map, so the SQL text never varies between calls and
+# the parse/plan cost is not paid again. Values are referenced as `$name`.
+CYPHER_STATEMENTS: Dict[str, Tuple[str, str]] = {
+    "cypher_add_message": (
+        """
+        MERGE (u:User {id: $user_id})
+        MERGE (s:Session {id: $session_id})
+        MERGE (u)-[:HAS_SESSION]->(s)
+        CREATE (m:Message {text: $text, author: $author, timestamp: $timestamp, message_id: $message_id})
+        CREATE (s)-[:CONTAINS]->(m)
+        """,
+        "v agtype",
+    ),
+    "cypher_session_summary": (
+        """
+        MATCH (s:Session {id: $session_id})
+        RETURN s.summary, s.summarized_until, s.summarized_until_id
+        """,
+        "summary agtype, summarized_until agtype, summarized_until_id agtype",
+    ),
+    "cypher_messages_since": (
+        """
+        MATCH (s:Session {id: $session_id})-[:CONTAINS]->(m:Message)
+        WHERE m.timestamp > $since
+           OR (m.timestamp = $since AND coalesce(m.message_id, '') > $since_id)
+        RETURN m.author, m.text, m.timestamp, m.message_id
+        ORDER BY m.timestamp ASC, m.message_id ASC
+        """,
+        "author agtype, text agtype, ts agtype, message_id agtype",
+    ),
+    "cypher_sessions_to_fold": (
+        """
+        MATCH (s:Session)-[:CONTAINS]->(m:Message)
+        WHERE m.timestamp < $cutoff
+          AND (m.timestamp > coalesce(s.summarized_until, -1)
+               OR (m.timestamp = s.summarized_until
+                   AND coalesce(m.message_id, '') > coalesce(s.summarized_until_id, '')))
+        RETURN DISTINCT s.id
+        """,
+        "session_id agtype",
+    ),
+    "cypher_set_session_summary": (
+        """
+        MATCH (s:Session {id: $session_id})
+        SET s.summary = $summary, s.summarized_until = $summarized_until,
+            s.summarized_until_id = $summarized_until_id
+        RETURN s
+        """,
+        "v agtype",
+    ),
+}
+
+
+def _history_statement(limit: int) -> Tuple[str, str, str]:
+    """Returns the (name, cypher, columns) of the last-N history query.
+
+    AGE does not accept a parameter in `LIMIT`, so one statement is prepared
+    per distinct limit. In practice only one or two limits are ever used.
+    """
+    return (
+        f"cypher_history_last_{int(limit)}",
+        f"""
+        MATCH (s:Session {{id: $session_id}})-[:CONTAINS]->(m:Message)
+        RETURN m.author, m.text, m.timestamp, m.message_id
+        ORDER BY m.timestamp DESC, m.message_id DESC
+        LIMIT {int(limit)}
+        """,
+        "author agtype, text agtype, ts agtype, message_id agtype",
+    )
+
+
+def _execute_cypher(conn: AgeConnection, cursor, name: str, params: Dict[str, Any], statement: Optional[Tuple[str, str]] = None) -> None:
+    """Executes a named Cypher statement, preparing it on first use per connection.
+
+    Args:
+        conn (AgeConnection): The pooled connection the cursor belongs to.
+        cursor: An open cursor of `conn`.
+        name (str): The prepared statement name (a key of `CYPHER_STATEMENTS`
+            unless `statement` is given).
+        params (Dict[str, Any]): The values for the `$name` placeholders.
+            They are sent as one JSON-encoded agtype map, never interpolated.
+        statement (Optional[Tuple[str, str]], optional): An explicit
+            (cypher, columns) pair for statements not in `CYPHER_STATEMENTS`.
+    """
+    if name not in conn.prepared_statements:
+        cypher, columns = statement or CYPHER_STATEMENTS[name]
+        cursor.execute(
+            f"PREPARE {name}(agtype) AS "
+            f"SELECT * FROM cypher('{GRAPH_NAME}', $$ {cypher} $$, $1) AS ({columns});"
+        )
+        # Prepared statements are session-scoped and survive transaction rollbacks.
+        conn.prepared_statements.add(name)
+    cursor.execute(f"EXECUTE {name}(%s);", (json.dumps(params),))
+
+
+@tracing.traced("db.add_message_to_graph")
+def add_message_to_graph(user_id: int, session_id: str, message_text: str, author: str) -> bool:
+    """Adds a message node to a conversation graph in Apache AGE.
+
+    This function models a conversation by creating and linking nodes in the
+    graph. It follows this structure: (User)-[:HAS_SESSION]->(Session)-[:CONTAINS]->(Message).
+    It uses `MERGE` to idempotently create the User and Session nodes, ensuring
+    they are not duplicated. A new `Message` node is then created for each call.
+
+    **Query Construction Method:**
+    The Cypher query is a server-side prepared statement (`cypher_add_message`)
+    that receives all inputs (`user_id`, `session_id`, `message_text`,
+    `author`) through AGE's agtype parameter map. Nothing is interpolated into
+    the query text, which rules out Cypher injection and lets PostgreSQL reuse
+    the parsed and planned statement on every call over the same connection.
+
+    Args:
+        user_id (int): The identifier for the user who owns the session.
+        session_id (str): The unique identifier for the conversation session.
+        message_text (str): The content of the message to be added.
+        author (str): The author of the message (e.g., 'user', 'assistant').
+
+    Returns:
+        bool: True if the message was successfully added and the transaction
+              was committed. False if a database connection or query execution
+              error occurred.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+
+    try:
+        message = {
+            "user_id": user_id,
+            "session_id": session_id,
+            "text": message_text,
+            "author": author,
+            "timestamp": int(time.time() * 1000),
+            "message_id": memory_outbox.new_message_id(),
+        }
+        with conn.cursor() as cursor:
+            _insert_messages(conn, cursor, [message])
+        
+        conn.commit()
+        session_cache.history_cache.append(session_id, {"author": author, "text": message_text})
+        return True
+    except Exception as e:
+        print(f"An error occurred adding message to graph: {e}")
+        conn.rollback()
+        return False
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+def _insert_messages(conn: AgeConnection, cursor, messages: List[Dict[str, Any]]) -> None:
+    """Creates the given messages in the graph and notifies other processes, without committing."""
+    for message in messages:
+        params = {key: message[key] for key in ("user_id", "session_id", "text", "author", "timestamp", "message_id")}
+        _execute_cypher(conn, cursor, "cypher_add_message", params)
+    for session_id in {message["session_id"] for message in messages}:
+        # Delivered on commit; tells other app processes to drop their cached history.
+        cursor.execute(
+            "SELECT pg_notify(%s, %s);",
+            (session_cache.NOTIFY_CHANNEL, session_cache.notify_payload(session_id))
+        )
+
+
+@tracing.traced("db.write_message_batch")
+def write_message_batch(messages: List[Dict[str, Any]]) -> bool:
+    """Writes a batch of queued messages to the graph in a single transaction.
+
+    This is the writer callback of the memory outbox. The messages already
+    carry their timestamps and are already in the history cache, so only the
+    graph is updated.
+
+    Args:
+        messages (List[Dict[str, Any]]): Messages with 'user_id', 'session_id',
+            'text', 'author', 'timestamp' and 'message_id', in the order they
+            were queued.
+
+    Returns:
+        bool: True if the batch was committed, False if no connection was
+        available (the outbox keeps the messages and retries).
+
+    Raises:
+        Exception: The error of a failed write, after the rollback, so the
+        outbox can tell a rejected message (`is_permanent_write_error`)
+        from a transient failure.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+
+    try:
+        with conn.cursor() as cursor:
+            _insert_messages(conn, cursor, messages)
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+def is_permanent_write_error(error: Exception) -> bool:
+    """Returns True if the graph rejected a message itself (bad data or a bad
+    statement) rather than failing to write it; retrying cannot help."""
+    return isinstance(error, (psycopg2.DataError, psycopg2.ProgrammingError))
+
+
+def _drop_dead_lettered(message: Dict[str, Any]) -> None:
+    """Drops the cached history of a session whose message never reaches the graph."""
+    session_cache.history_cache.invalidate(message["session_id"])
+
+
+_outbox = memory_outbox.MemoryOutbox(
+    memory_outbox.MEMORY_OUTBOX_PATH,
+    write_message_batch,
+    is_permanent=is_permanent_write_error,
+    on_dead_letter=_drop_dead_lettered,
+)
+# Set when no outbox file could be claimed; messages are then written synchronously.
+_outbox_unavailable = False
+
+
+def _get_outbox() -> Optional[memory_outbox.MemoryOutbox]:
+    """Returns the started memory outbox, or None when messages are written synchronously."""
+    global _outbox_unavailable
+    if MEMORY_WRITE_MODE != "outbox" or _outbox_unavailable:
+        return None
+    try:
+        # Starting claims this process's log file and replays what a previous run left in it.
+        _outbox.start()
+    except (RuntimeError, OSError, sqlite3.Error) as e:
+        print(f"Warning: Memory outbox unavailable, writing messages synchronously: {e}")
+        _outbox_unavailable = True
+        return None
+    return _outbox
+
+
+def save_message(user_id: int, session_id: str, message_text: str, author: str) -> bool:
+    """Saves a conversation message without waiting for the graph write.
+
+    In the default "outbox" mode the message is appended to the durable local
+    outbox and to the history cache, and written to the graph by a background
+    batch writer. `get_conversation_history` merges queued messages, so the
+    session sees its own writes immediately. With `MEMORY_WRITE_MODE=sync`
+    this is `add_message_to_graph`.
+
+    Args:
+        user_id (int): The identifier for the user who owns the session.
+        session_id (str): The unique identifier for the conversation session.
+        message_text (str): The content of the message to be added.
+        author (str): The author of the message (e.g., 'user', 'agent').
+
+    Returns:
+        bool: True if the message was queued (or written), False otherwise.
+    """
+    outbox = _get_outbox()
+    if outbox is None:
+        return add_message_to_graph(user_id, session_id, message_text, author)
+    try:
+        outbox.enqueue(user_id, session_id, message_text, author)
+    except Exception as e:
+        print(f"An error occurred queuing a message, writing it directly: {e}")
+        return add_message_to_graph(user_id, session_id, message_text, author)
+    session_cache.history_cache.append(session_id, {"author": author, "text": message_text})
+    return True
+
+
+def flush_message_outbox(session_id: Optional[str] = None, timeout_s: Optional[float] = None) -> bool:
+    """Blocks until the queued messages have been written to the graph.
+
+    Args:
+        session_id (Optional[str], optional): Waits only for this session's
+            messages. None waits for every queued message.
+        timeout_s (Optional[float], optional): The longest time to wait.
+
+    Returns:
+        bool: False if `timeout_s` elapsed first.
+    """
+    outbox = _get_outbox()
+    return outbox.flush(session_id, timeout_s) if outbox else True
+
+
+def _merge_pending(messages: List[Dict[str, Any]], pending: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Appends queued messages that are not in the graph yet to messages read from it.
+
+    The outbox writes each session's messages in order, so the graph always
+    holds a prefix of them: a queued message is missing from the graph
+    exactly when it is newer than the newest message read, by
+    (timestamp, message_id). `pending` must be taken *before* the graph
+    read, or a batch committed in between is lost.
+    """
+    newest = max((_message_order(m) for m in messages), default=(0, ""))
+    return messages + [
+        {"author": m["author"], "text": m["text"], "timestamp": m["timestamp"], "message_id": m["message_id"]}
+        for m in pending if _message_order(m) > newest
+    ]
+
+
+def _message_order(message: Dict[str, Any]) -> Tuple[int, str]:
+    """Returns the unique sort key of a message (messages written before IDs sort first)."""
+    return message["timestamp"], message.get("message_id") or ""
+
+
+def _message_from_row(row) -> Dict[str, Any]:
+    """Converts an (author, text, timestamp, message_id) row of a Cypher query."""
+    return {
+        "author": _agtype_to_str(row[0]),
+        "text": _agtype_to_str(row[1]),
+        "timestamp": int(str(row[2])),
+        "message_id": _agtype_to_str(row[3]) if row[3] is not None else None,
+    }
+
+
+@tracing.traced("db.get_conversation_history")
+def get_conversation_history(session_id: str, n: int = 5) -> List[Dict[str, Any]]:
+    """Retrieves the last N messages from a conversation session graph.
+
+    This function queries the Apache AGE graph to find a `Session` node matching
+    the given `session_id`. It then traverses the graph to find all connected
+    `Message` nodes.
+
+    The Cypher query fetches the messages and sorts them by their timestamp in
+    descending order (newest first) to efficiently retrieve only the most
+    recent `n` messages. The final list is then reversed in Python to present
+    the conversation in the correct chronological order (oldest to newest).
+
+    The function also handles the conversion of data from AGE's native `agtype`
+    format into standard Python strings.
+
+    Recent history is served from the in-process `session_cache` when
+    possible; the graph is only queried on a cache miss, and the result
+    (up to `HISTORY_CACHE_DEPTH` messages) is cached for the next turn.
+    Messages still queued in the memory outbox are merged into a graph read,
+    so a session always sees its own writes.
+
+    Args:
+        session_id (str): The unique identifier for the conversation session.
+        n (int, optional): The number of recent messages to retrieve.
+            Defaults to 5.
+
+    Returns:
+        List[Dict[str, Any]]: A list of dictionaries, where each dictionary
+        represents a message and contains 'author' and 'text'. The list is
+        sorted in chronological order. Returns an empty list if the session
+        is not found or if a database error occurs.
+    """
+    cache_enabled = session_cache.is_enabled(_open_listener_connection)
+    if cache_enabled:
+        cached = session_cache.history_cache.get(session_id, n)
+        if cached is not None:
+            return cached
+        loaded_at = session_cache.history_cache.begin_load()
+        # Fetch a full cache entry so later turns can be served from memory.
+        limit = max(n, session_cache.history_cache.depth)
+    else:
+        limit = n
+
+    conn = get_db_connection()
+    if not conn:
+        return []
+
+    # session_id is passed as a parameter of the prepared statement, not embedded.
+    name, cypher, columns = _history_statement(limit)
+    outbox = _get_outbox()
+    pending = outbox.pending(session_id) if outbox else []
+    
+    history: List[Dict[str, Any]] = []
+    try:
+        with conn.cursor() as cursor:
+            _execute_cypher(conn, cursor, name, {"session_id": session_id}, (cypher, columns))
+            rows = cursor.fetchall()
+            for row in rows:
+                # AGE returns agtype objects; convert them to native Python types resulting json like literal.
+                history.append(_message_from_row(row))
+        
+        # The query returns results in reverse chronological order (newest first), so reversing.
+        history = _merge_pending(history[::-1], pending)
+        history = [{"author": m["author"], "text": m["text"]} for m in history]
+        if cache_enabled:
+            session_cache.history_cache.put(session_id, history, loaded_at)
+        return history[-n:] if n > 0 else []
+    except Exception as e:
+        print(f"An error occurred getting conversation history: {e}")
+        return []
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.get_session_summary")
+def get_session_summary(session_id: str) -> Dict[str, Any]:
+    """Retrieves the rolling summary stored on a `Session` node.
+
+    The summary condenses every message of the session up to (and including)
+    the `summarized_until` timestamp; see `summarizer.py`. Like the history,
+    it is served from the in-process `session_cache` when possible.
+
+    Args:
+        session_id (str): The unique identifier for the conversation session.
+
+    Returns:
+        Dict[str, Any]: A dictionary with 'summary' (str, empty if the
+        session has not been summarized yet), 'summarized_until' (the
+        millisecond timestamp of the newest folded message, 0 if none) and
+        'summarized_until_id' (its message ID, "" if none or unknown).
+        Database errors are reported as an empty summary.
+    """
+    empty = {"summary": "", "summarized_until": 0, "summarized_until_id": ""}
+    cache_enabled = session_cache.is_enabled(_open_listener_connection)
+    if cache_enabled:
+        cached = session_cache.history_cache.get_summary(session_id)
+        if cached is not None:
+            return cached
+        loaded_at = session_cache.history_cache.begin_load()
+
+    conn = get_db_connection()
+    if not conn:
+        return empty
+
+    try:
+        with conn.cursor() as cursor:
+            _execute_cypher(conn, cursor, "cypher_session_summary", {"session_id": session_id})
+            row = cursor.fetchone()
+        record = dict(empty)
+        if row:
+            record["summary"] = _agtype_to_str(row[0]) or ""
+            record["summarized_until"] = int(str(row[1])) if row[1] is not None else 0
+            record["summarized_until_id"] = _agtype_to_str(row[2]) if row[2] is not None else ""
+        if cache_enabled:
+            session_cache.history_cache.put_summary(session_id, record, loaded_at)
+        return record
+    except Exception as e:
+        print(f"An error occurred getting session summary: {e}")
+        return empty
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.get_messages_to_summarize")
+def get_messages_to_summarize(session_id: str, keep_last: int, since: int, since_id: str = "") -> List[Dict[str, Any]]:
+    """Retrieves the messages that have fallen out of the recent-history window.
+
+    Returns every message after the watermark (`since`, `since_id`) except
+    the newest `keep_last` ones, which the agent still sends verbatim.
+    Because the summarizer runs after every turn, this is normally only a
+    couple of messages. Messages still queued in the memory outbox count
+    towards the newest ones.
+
+    The watermark is the (timestamp, message ID) of the newest folded
+    message, not just its timestamp: messages written by different processes
+    can share a millisecond, and a strict timestamp comparison would skip
+    the ones sharing the watermark's millisecond forever.
+
+    Args:
+        session_id (str): The unique identifier for the conversation session.
+        keep_last (int): The number of most recent messages to leave out.
+        since (int): The timestamp of the newest message already summarized.
+        since_id (str, optional): Its message ID ("" for none or unknown).
+
+    Returns:
+        List[Dict[str, Any]]: Messages in chronological order, each with
+        'author', 'text', 'timestamp' and 'message_id'. Returns an empty
+        list on error.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
+
+    outbox = _get_outbox()
+    pending = outbox.pending(session_id) if outbox else []
+    try:
+        with conn.cursor() as cursor:
+            _execute_cypher(
+                conn, cursor, "cypher_messages_since",
+                {"session_id": session_id, "since": int(since), "since_id": since_id or ""}
+            )
+            rows = cursor.fetchall()
+        messages = [_message_from_row(row) for row in rows]
+        watermark = (int(since), since_id or "")
+        messages = _merge_pending(messages, [m for m in pending if _message_order(m) > watermark])
+        return messages[:-keep_last] if keep_last > 0 else messages
+    except Exception as e:
+        print(f"An error occurred getting messages to summarize: {e}")
+        return []
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.set_session_summary")
+def set_session_summary(session_id: str, summary: str, summarized_until: int, summarized_until_id: str = "") -> bool:
+    """Stores the rolling summary on a `Session` node.
+
+    Args:
+        session_id (str): The unique identifier for the conversation session.
+        summary (str): The updated summary text.
+        summarized_until (int): The timestamp of the newest message folded
+            into the summary.
+        summarized_until_id (str, optional): The message ID of that message
+            (see `get_messages_to_summarize`).
+
+    Returns:
+        bool: True if the summary was committed, False otherwise.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return False
+
+    record = {"summary": summary, "summarized_until": int(summarized_until), "summarized_until_id": summarized_until_id or ""}
+    params = {"session_id": session_id, **record}
+    try:
+        with conn.cursor() as cursor:
+            _execute_cypher(conn, cursor, "cypher_set_session_summary", params)
+            cursor.execute(
+                "SELECT pg_notify(%s, %s);",
+                (session_cache.NOTIFY_CHANNEL, session_cache.notify_payload(session_id))
+            )
+        conn.commit()
+        session_cache.history_cache.put_summary(session_id, record)
+        return True
+    except Exception as e:
+        print(f"An error occurred setting session summary: {e}")
+        conn.rollback()
+        return False
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+# --- GRAPH RETENTION (see graph_retention.py) ---
+
+def _expire_messages_statement(batch_size: int, folded_only: bool) -> Tuple[str, str, str]:
+    """Returns the (name, cypher, columns) of the statement deleting one batch of old messages.
+
+    The message properties are projected before `DETACH DELETE`, so the
+    deleted messages are returned for archiving. AGE does not accept a
+    parameter in `LIMIT`, so one statement is prepared per batch size.
+    """
+    condition = "m.timestamp < $cutoff"
+    if folded_only:
+        # Never delete a message the session summary does not cover yet.
+        condition += (
+            " AND (m.timestamp < coalesce(s.summarized_until, -1)"
+            " OR (m.timestamp = s.summarized_until"
+            " AND coalesce(m.message_id, '') <= coalesce(s.summarized_until_id, '')))"
+        )
+    return (
+        f"cypher_expire_messages_{'folded_' if folded_only else ''}{int(batch_size)}",
+        f"""
+        MATCH (s:Session)-[:CONTAINS]->(m:Message)
+        WHERE {condition}
+        WITH s.id AS session_id, m.author AS author, m.text AS text, m.timestamp AS ts,
+             m.message_id AS message_id, m
+        LIMIT {int(batch_size)}
+        DETACH DELETE m
+        RETURN session_id, author, text, ts, message_id
+        """,
+        "session_id agtype, author agtype, text agtype, ts agtype, message_id agtype",
+    )
+
+
+@tracing.traced("db.get_sessions_to_fold")
+def get_sessions_to_fold(cutoff: int) -> List[str]:
+    """Returns the sessions with messages older than `cutoff` that are not in their summary yet.
+
+    Args:
+        cutoff (int): A millisecond timestamp (the retention horizon).
+
+    Returns:
+        List[str]: Session IDs. Returns an empty list on error.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return []
+
+    try:
+        with conn.cursor() as cursor:
+            _execute_cypher(conn, cursor, "cypher_sessions_to_fold", {"cutoff": int(cutoff)})
+            return [_agtype_to_str(row[0]) for row in cursor.fetchall()]
+    except Exception as e:
+        print(f"An error occurred listing sessions to fold: {e}")
+        return []
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+@tracing.traced("db.delete_expired_messages")
+def delete_expired_messages(
+    cutoff: int,
+    batch_size: int = 500,
+    archive: bool = True,
+    folded_only: bool = False,
+    lock_timeout_ms: int = 2000
+) -> Optional[int]:
+    """Deletes one batch of `Message` nodes older than `cutoff` from the graph.
+
+    Each batch is its own short transaction, so the label tables are never
+    locked for long and concurrent conversation writes keep going. The
+    transaction gives up instead of queueing behind other locks for more than
+    `lock_timeout_ms`.
+
+    Args:
+        cutoff (int): Messages with an older millisecond timestamp are deleted.
+        batch_size (int, optional): The maximum number of messages per batch.
+        archive (bool, optional): If True, the deleted messages are copied into
+            `message_archive` in the same transaction. Without `folded_only`,
+            messages the session summary does not cover are deleted too.
+        folded_only (bool, optional): If True, only messages already folded
+            into their session's summary are deleted.
+        lock_timeout_ms (int, optional): The lock wait limit of the batch.
+
+    Returns:
+        Optional[int]: The number of deleted messages (0 once none are left),
+        or None if the batch failed and was rolled back.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    name, cypher, columns = _expire_messages_statement(batch_size, folded_only)
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SET LOCAL lock_timeout = %s;", (f"{int(lock_timeout_ms)}ms",))
+            _execute_cypher(conn, cursor, name, {"cutoff": int(cutoff)}, (cypher, columns))
+            # Messages written before they had IDs have none (NULL in the archive).
+            rows = [
+                (
+                    _agtype_to_str(row[0]), _agtype_to_str(row[1]), _agtype_to_str(row[2]),
+                    int(str(row[3])), _agtype_to_str(row[4])
+                )
+                for row in cursor.fetchall()
+            ]
+            if archive and rows:
+                execute_values(
+                    cursor,
+                    "INSERT INTO message_archive (session_id, author, text, sent_at, message_id) VALUES %s;",
+                    rows,
+                    template="(%s, %s, %s, to_timestamp(%s / 1000.0), %s)"
+                )
+            session_ids = {row[0] for row in rows}
+            for session_id in session_ids:
+                # Tells other app processes to drop their cached history of the session.
+                cursor.execute(
+                    "SELECT pg_notify(%s, %s);",
+                    (session_cache.NOTIFY_CHANNEL, session_cache.notify_payload(session_id))
+                )
+        conn.commit()
+        for session_id in session_ids:
+            session_cache.history_cache.invalidate(session_id)
+        return len(rows)
+    except Exception as e:
+        print(f"An error occurred deleting expired messages: {e}")
+        conn.rollback()
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+def get_graph_stats() -> Optional[Dict[str, Dict[str, int]]]:
+    """Returns the row count and on-disk size (table plus indexes) of every graph label.
+
+    Returns:
+        Optional[Dict[str, Dict[str, int]]]: {label: {"rows": ..., "bytes": ...}},
+        or None on error.
+    """
+    conn = get_db_connection()
+    if not conn:
+        return None
+
+    try:
+        stats = {}
+        with conn.cursor() as cursor:
+            for label in GRAPH_VERTEX_LABELS + GRAPH_EDGE_LABELS:
+                # Labels are fixed identifiers, never user input.
+                relation = f'"{GRAPH_NAME}"."{label}"'
+                cursor.execute(f"SELECT count(*), pg_total_relation_size(%s::regclass) FROM {relation};", (relation,))
+                rows, size = cursor.fetchone()
+                stats[label] = {"rows": int(rows), "bytes": int(size)}
+        conn.commit()
+        return stats
+    except Exception as e:
+        print(f"An error occurred getting graph stats: {e}")
+        conn.rollback()
+        return None
+    finally:
+        # Always return the connection to the pool
+        if conn and conn_pool:
+            conn_pool.putconn(conn)
+
+
+def vacuum_graph_tables(labels: Tuple[str, ...] = ("Message", "CONTAINS")) -> bool:
+    """Runs a plain `VACUUM (ANALYZE)` on graph label tables so deleted rows can be reused.
+
+    A plain VACUUM takes no lock that blocks reads or writes. It needs
+    autocommit, so it runs on a dedicated connection instead of a pooled one.
+
+    Returns:
+        bool: True if every table was vacuumed.
+    """
+    try:
+        conn = psycopg2.connect(
+            dbname=DB_NAME, user=DB_USER, password=DB_PASSWORD,
+            host=DB_HOST, port=DB_PORT
+        )
+    except Exception as e:
+        print(f"An error occurred connecting to vacuum the graph: {e}")
+        return False
+    try:
+        conn.autocommit = True
+        with conn.cursor() as cursor:
+            for label in labels:
+                cursor.execute(f'VACUUM (ANALYZE) "{GRAPH_NAME}"."{label}";')
+        return True
+    except Exception as e:
+        print(f"An error occurred vacuuming the graph: {e}")
+        return False
+    finally:
+        conn.close()
+
+
+def _agtype_to_str(value: Any) -> Optional[str]:
+    """Decodes an agtype string scalar (a JSON string literal) into a Python string.
+
+    Decoding (rather than stripping the quotes) unescapes newlines and quotes,
+    so history read from the graph matches the text that was written.
+    """
+    if value is None:
+        return None
+    raw = str(value)
+    try:
+        decoded = json.loads(raw)
+    except ValueError:
+        return raw.strip('"')
+    return decoded if isinstance(decoded, str) else raw
+
+
 # --- Example Usage for Testing ---
 if __name__ == '__main__':
     print("Testing database functions...")
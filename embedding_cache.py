@@ -0,0 +1,161 @@
+# embedding_cache.py
+
+"""
+Persistent cache of text embeddings, keyed by model version and content hash.
+
+Embedding the same text twice gives the same vector, so both the knowledge
+base ingestion (`ingest_embeddings.py`) and the query path
+(`database.query_vector_db`) look vectors up here before running the model.
+Re-ingesting an unchanged corpus then costs one SQLite lookup per document,
+and repeated user queries skip the encoder.
+
+Entries are keyed on `(namespace, sha256(text))`, where the namespace is
+`<model name>@<EMBEDDING_MODEL_VERSION>`. Upgrading the model (or bumping the
+version after changing preprocessing) starts a new namespace; old entries
+stay in place until `prune` removes them, so rolling back is free as well.
+
+Vectors are stored as raw float32 bytes in a local SQLite file
+(`EMBEDDING_CACHE_PATH`), fronted by a small in-process LRU for hot queries.
+Set `EMBEDDING_CACHE=off` to bypass it.
+"""
+
+# Standard library imports
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+# Third-party imports
+import numpy as np
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "on").lower() != "off"
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite3")
+# Bump when the model weights or text preprocessing change without a new model name.
+EMBEDDING_MODEL_VERSION = os.getenv("EMBEDDING_MODEL_VERSION", "1")
+EMBEDDING_CACHE_MEMORY_SIZE = int(os.getenv("EMBEDDING_CACHE_MEMORY_SIZE", "1024"))
+# SQLite limits the number of bound parameters per statement.
+LOOKUP_CHUNK_SIZE = 500
+
+
+def namespace_for(model_name: str, version: str = EMBEDDING_MODEL_VERSION) -> str:
+    """Returns the cache namespace of a model version."""
+    return f"{model_name}@{version}"
+
+
+def text_hash(text: str) -> bytes:
+    return hashlib.sha256(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """A thread-safe SQLite store of float32 vectors for one model namespace."""
+
+    def __init__(self, model_name: str, path: str = EMBEDDING_CACHE_PATH, memory_size: int = EMBEDDING_CACHE_MEMORY_SIZE):
+        self.namespace = namespace_for(model_name)
+        self.path = path
+        self.memory_size = memory_size
+        self._db: Optional[sqlite3.Connection] = None
+        self._memory: "OrderedDict[bytes, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_many(self, texts: Sequence[str]) -> List[Optional[np.ndarray]]:
+        """Returns the cached vector of each text, or None where there is none."""
+        keys = [text_hash(text) for text in texts]
+        found: Dict[bytes, np.ndarray] = {}
+        with self._lock:
+            missing = []
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is None:
+                    missing.append(key)
+                else:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            db = self._connect()
+            for i in range(0, len(missing), LOOKUP_CHUNK_SIZE):
+                chunk = missing[i:i + LOOKUP_CHUNK_SIZE]
+                rows = db.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE namespace = ? "
+                    f"AND text_hash IN ({','.join('?' * len(chunk))});",
+                    (self.namespace, *chunk)
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = np.frombuffer(blob, dtype=np.float32)
+                    self._remember(key, found[key])
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for vector in results if vector is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        return self.get_many([text])[0]
+
+    def put_many(self, texts: Sequence[str], vectors: Sequence[np.ndarray]) -> None:
+        """Stores vectors for texts; existing entries are replaced."""
+        rows = [
+            (self.namespace, text_hash(text), np.asarray(vector, dtype=np.float32).tobytes())
+            for text, vector in zip(texts, vectors)
+        ]
+        with self._lock:
+            db = self._connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO embeddings (namespace, text_hash, vector) VALUES (?, ?, ?);", rows
+                )
+            for _, key, blob in rows[-self.memory_size:]:
+                self._remember(key, np.frombuffer(blob, dtype=np.float32))
+
+    def put(self, text: str, vector: np.ndarray) -> None:
+        self.put_many([text], [vector])
+
+    def prune(self, keep_namespaces: Optional[Sequence[str]] = None) -> int:
+        """Deletes entries of other namespaces (by default all but this one) and returns the count."""
+        keep = list(keep_namespaces or [self.namespace])
+        with self._lock:
+            db = self._connect()
+            with db:
+                cursor = db.execute(
+                    f"DELETE FROM embeddings WHERE namespace NOT IN ({','.join('?' * len(keep))});", keep
+                )
+            return cursor.rowcount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "memory_entries": len(self._memory)}
+
+    def _remember(self, key: bytes, vector: np.ndarray) -> None:
+        # Caller holds the lock.
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_size:
+            self._memory.popitem(last=False)
+
+    def _connect(self) -> sqlite3.Connection:
+        # Caller holds the lock. Opened lazily so importing the module has no side effects.
+        if self._db is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._db = sqlite3.connect(self.path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL;")
+            self._db.execute("PRAGMA synchronous=NORMAL;")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    namespace TEXT NOT NULL,
+                    text_hash BLOB NOT NULL,
+                    vector BLOB NOT NULL,
+                    PRIMARY KEY (namespace, text_hash)
+                ) WITHOUT ROWID;
+                """
+            )
+        return self._db
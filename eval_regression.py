@@ -0,0 +1,275 @@
+# eval_regression.py
+
+"""
+Deterministic answer-quality regression suite for `agent.get_agent_response`.
+
+Replays the scripted conversations in `mock_data/eval_scenarios.json` (one
+per intent path: ticket inquiry, ticket history, ticket creation, new issue,
+general question, greeting) and checks each turn against its expectations:
+
+- the branch taken (intent, model tier, which pipeline stages ran),
+- the knowledge base URLs retrieved by the vector search,
+- the prompt token counts of the LLM calls,
+- the active ticket and fragments of the final answer.
+
+The LLM is replaced by `StubLlm`, which answers deterministically in-process
+(intents from the keyword classifier of `fake_groq_server.py`, the refined
+search query is the user's query itself), so runs are repeatable and need no
+Groq API key. The database is the real PostgreSQL instance configured in
+`.env`; point it at a scratch database populated with `ingest_data.py`, as
+the ticket creation scenario writes new tickets.
+
+Observations come from the turn traces (see `tracing.py`), so the suite checks
+exactly what the agent did rather than what it answered. `--record` saves the
+observations as a baseline; `--baseline` then also fails if the branch or the
+retrieved URLs changed, or if a prompt grew beyond `--token-tolerance`. Use it
+before and after a performance change to verify that behavior stayed the same.
+
+Usage:
+    python3 eval_regression.py
+    python3 eval_regression.py --record eval_baseline.json
+    python3 eval_regression.py --baseline eval_baseline.json --token-tolerance 0.05
+"""
+
+# Standard library imports
+import argparse
+import json
+import os
+import re
+import sys
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+# Local application/library specific imports
+import fake_groq_server
+import prompts
+import tracing
+
+DEFAULT_SCENARIOS_PATH = "mock_data/eval_scenarios.json"
+
+# Pipeline stages that define the branch a turn took, in pipeline order.
+BRANCH_SPANS = (
+    "intent_llm",
+    "db.get_ticket_details",
+    "db.get_ticket_summary",
+    "db.create_ticket",
+    "embedding",
+    "db.find_similar_tickets",
+    "refinement_llm",
+    "vector_search",
+    "synthesis_llm",
+)
+LLM_SPANS = ("intent_llm", "refinement_llm", "synthesis_llm")
+
+
+class StubLlm:
+    """A deterministic stand-in for `LlmClient` with the same interface.
+
+    Token counts are estimated from the rendered prompts and recorded on the
+    current span like real usage, so prompt growth shows up in the results.
+    """
+
+    def _record(self, system_prompt: str, user_prompt: str, completion: str, model: str) -> None:
+        tracing.set_attributes(
+            model=model,
+            prompt_tokens=prompts.estimate_tokens(system_prompt) + prompts.estimate_tokens(user_prompt),
+            completion_tokens=prompts.estimate_tokens(completion),
+        )
+
+    def generate_intent(self, system_prompt: str, user_prompt: str, fallback: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        intent = fake_groq_server.classify_intent(user_prompt)
+        self._record(system_prompt, user_prompt, json.dumps(intent), "stub-intent")
+        return intent
+
+    def generate_response(self, system_prompt: str, user_prompt: str, tier: str = "large", cache_key: Optional[str] = None) -> str:
+        if system_prompt == prompts.REFINEMENT.system:
+            # Keep the user's query, so retrieval depends only on the embedding model.
+            match = re.search(r'"(.*)"', user_prompt, re.DOTALL)
+            content = match.group(1) if match else user_prompt
+        else:
+            content = f"Stub answer from the {tier} model."
+        self._record(system_prompt, user_prompt, content, f"stub-{tier}")
+        return content
+
+    def stream_response(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        on_token: Callable[[str], None],
+        tier: str = "large",
+        cache_key: Optional[str] = None
+    ) -> str:
+        content = self.generate_response(system_prompt, user_prompt, tier)
+        on_token(content)
+        return content
+
+    def generate_summary(self, system_prompt: str, user_prompt: str) -> str:
+        content = "Stub summary of the earlier conversation."
+        self._record(system_prompt, user_prompt, content, "stub-summary")
+        return content
+
+
+class CollectingExporter:
+    """Keeps finished turns in memory instead of writing them out."""
+
+    def __init__(self):
+        self.turns: List[Dict[str, Any]] = []
+
+    def export(self, turn: tracing.Turn) -> None:
+        self.turns.append(turn.to_dict())
+
+
+def observe(trace: Dict[str, Any], response: str, active_ticket_id: Optional[str]) -> Dict[str, Any]:
+    """Extracts what a turn did from its trace."""
+    span_names = {span["name"] for span in trace["spans"]}
+    urls: List[str] = []
+    prompt_tokens: Dict[str, int] = {}
+    for span in trace["spans"]:
+        attributes = span["attributes"]
+        if span["name"] == "vector_search":
+            urls = list(attributes.get("urls") or [])
+        if span["name"] in LLM_SPANS and attributes.get("prompt_tokens") is not None:
+            prompt_tokens[span["name"]] = prompt_tokens.get(span["name"], 0) + attributes["prompt_tokens"]
+    return {
+        "intent": trace["attributes"].get("intent"),
+        "model_tier": trace["attributes"].get("model_tier"),
+        "branch": [name for name in BRANCH_SPANS if name in span_names],
+        "spans": sorted(span_names),
+        "urls": urls,
+        "prompt_tokens": prompt_tokens,
+        "active_ticket_id": active_ticket_id,
+        "response": response,
+    }
+
+
+def check_expectations(observation: Dict[str, Any], expect: Dict[str, Any]) -> List[str]:
+    """Returns the failed expectations of a turn (empty if it passed)."""
+    failures = []
+    for key in ("intent", "model_tier", "active_ticket_id"):
+        if key in expect and observation[key] != expect[key]:
+            failures.append(f"{key} is {observation[key]!r}, expected {expect[key]!r}")
+    pattern = expect.get("active_ticket_pattern")
+    if pattern and not re.match(pattern, observation["active_ticket_id"] or ""):
+        failures.append(f"active_ticket_id {observation['active_ticket_id']!r} does not match {pattern!r}")
+    for name in expect.get("spans", []):
+        if name not in observation["spans"]:
+            failures.append(f"stage {name!r} did not run")
+    for name in expect.get("no_spans", []):
+        if name in observation["spans"]:
+            failures.append(f"stage {name!r} ran but should not have")
+    for url in expect.get("urls_include", []):
+        if url not in observation["urls"]:
+            failures.append(f"{url} was not retrieved (got {observation['urls']})")
+    for name, limit in expect.get("max_prompt_tokens", {}).items():
+        tokens = observation["prompt_tokens"].get(name)
+        if tokens is None:
+            # A limit implies the call: a branch that skips it must not pass silently.
+            failures.append(f"{name} did not run, but its prompt has a limit of {limit} tokens")
+        elif tokens > limit:
+            failures.append(f"{name} prompt has {tokens} tokens, limit {limit}")
+    for text in expect.get("response_contains", []):
+        if text not in observation["response"]:
+            failures.append(f"response does not contain {text!r}")
+    return failures
+
+
+def compare_to_baseline(observation: Dict[str, Any], baseline: Dict[str, Any], token_tolerance: float) -> List[str]:
+    """Returns the differences between a turn and its recorded baseline."""
+    failures = []
+    for key in ("intent", "model_tier", "branch", "urls"):
+        if observation[key] != baseline.get(key):
+            failures.append(f"{key} changed from {baseline.get(key)!r} to {observation[key]!r}")
+    for name, tokens in observation["prompt_tokens"].items():
+        recorded = baseline.get("prompt_tokens", {}).get(name)
+        if recorded and tokens > recorded * (1 + token_tolerance):
+            failures.append(f"{name} prompt grew from {recorded} to {tokens} tokens")
+    return failures
+
+
+def run_scenarios(agent_module, scenarios: List[Dict[str, Any]], exporter: CollectingExporter, run_id: str) -> List[Dict[str, Any]]:
+    """Plays every scenario in a fresh session and returns one result per turn."""
+    results = []
+    for scenario in scenarios:
+        session_id = f"eval-{run_id}-{scenario['name']}"
+        active_ticket_id = None
+        for turn_index, turn in enumerate(scenario["turns"]):
+            exported = len(exporter.turns)
+            response, active_ticket_id = agent_module.get_agent_response(
+                scenario["user_id"], session_id, turn["query"], active_ticket_id
+            )
+            trace = exporter.turns[exported] if len(exporter.turns) > exported else {"attributes": {}, "spans": []}
+            results.append({
+                "key": f"{scenario['name']}#{turn_index}",
+                "query": turn["query"],
+                "expect": turn.get("expect", {}),
+                "observation": observe(trace, response, active_ticket_id),
+            })
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay scripted conversations and check the agent's behavior.")
+    parser.add_argument("--scenarios", default=DEFAULT_SCENARIOS_PATH, help="JSON file with the evaluation scenarios.")
+    parser.add_argument("--only", action="append", help="Run only the named scenario (repeatable).")
+    parser.add_argument("--record", help="Write the observations to this baseline file.")
+    parser.add_argument("--baseline", help="Also compare the observations with this baseline file.")
+    parser.add_argument("--token-tolerance", type=float, default=0.05, help="Allowed prompt growth over the baseline (0.05 = 5%%).")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    args = parser.parse_args()
+
+    with open(args.scenarios, "r", encoding="utf-8") as f:
+        scenarios = json.load(f)
+    if args.only:
+        scenarios = [s for s in scenarios if s["name"] in args.only]
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    # Memory writes run inline so every turn sees the previous one; no real LLM is called.
+    os.environ["MEMORY_WRITE_MODE"] = "sync"
+    os.environ.setdefault("GROQ_API_KEY", "stub-key")
+
+    # Imported late so the agent picks up the environment configured above.
+    import agent
+
+    stub = StubLlm()
+    agent.llm = stub
+    agent.summarizer.llm = stub
+    exporter = CollectingExporter()
+    tracing.set_exporter(exporter)
+
+    results = run_scenarios(agent, scenarios, exporter, uuid.uuid4().hex[:8])
+    failed = 0
+    for result in results:
+        failures = check_expectations(result["observation"], result["expect"])
+        if args.baseline:
+            if result["key"] in baseline:
+                failures += compare_to_baseline(result["observation"], baseline[result["key"]], args.token_tolerance)
+            else:
+                failures.append("not in the baseline")
+        result["failures"] = failures
+        failed += bool(failures)
+
+    if args.record:
+        with open(args.record, "w", encoding="utf-8") as f:
+            json.dump({r["key"]: r["observation"] for r in results}, f, indent=2)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        for result in results:
+            observation = result["observation"]
+            status = "FAIL" if result["failures"] else "PASS"
+            print(f"{status}  {result['key']:<28} {observation['intent'] or '-':<24} {observation['model_tier'] or '-':<9} {' > '.join(observation['branch'])}")
+            for failure in result["failures"]:
+                print(f"      - {failure}")
+        print(f"{len(results) - failed}/{len(results)} turns passed.")
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
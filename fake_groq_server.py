@@ -0,0 +1,253 @@
+# fake_groq_server.py
+
+"""
+A local stand-in for Groq's OpenAI-compatible chat completions endpoint.
+
+The server answers `POST /openai/v1/chat/completions` with well-formed
+completions so the agent can be exercised without an API key or quota. It
+simulates provider latency with a fixed time-to-first-token plus a token
+generation rate, which makes throughput measurements meaningful.
+
+Requests that ask for `response_format={"type": "json_object"}` (the intent
+classifier) receive a small keyword-based classification so the agent walks
+its normal branches; every other request receives filler text. Requests with
+`stream=true` receive the completion as server-sent chunks, paced at the
+generation rate, with the usage in the last chunk (as Groq reports it).
+Prompt caching is simulated per system prompt: once a system prompt has been
+seen, its tokens are reported as `prompt_tokens_details.cached_tokens`.
+`GET /openai/v1/models` answers the connection warm-up of `startup.py`.
+
+To simulate a provider brownout, a share of requests can fail with HTTP 503
+(`--error-rate`) or stall for a long time before answering (`--stall-rate`,
+`--stall-ms`).
+
+Point the agent at it with:
+    GROQ_BASE_URL=http://127.0.0.1:8765 GROQ_API_KEY=fake python3 ...
+
+Usage:
+    python3 fake_groq_server.py --port 8765 --latency-ms 150 --tokens-per-sec 250
+    python3 fake_groq_server.py --error-rate 0.2 --stall-rate 0.1 --stall-ms 20000
+"""
+
+# Standard library imports
+import argparse
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional
+
+CHAT_COMPLETIONS_PATH = "/openai/v1/chat/completions"
+MODELS_PATH = "/openai/v1/models"
+TICKET_ID_PATTERN = re.compile(r"\b(T(?:ICKET)?-[A-Z0-9]+)\b", re.IGNORECASE)
+GREETING_PATTERN = re.compile(r"^\W*(hi|hello|hey|good (morning|afternoon|evening))\W*$", re.IGNORECASE)
+
+# Hashes of the system prompts seen so far (the simulated prompt cache).
+_seen_system_prompts = set()
+_seen_lock = threading.Lock()
+
+
+class FakeGroqConfig:
+    """Latency and size settings shared by all request handlers."""
+
+    def __init__(
+        self,
+        latency_ms: float = 150.0,
+        tokens_per_sec: float = 250.0,
+        completion_tokens: int = 120,
+        error_rate: float = 0.0,
+        stall_rate: float = 0.0,
+        stall_ms: float = 20000.0
+    ):
+        self.latency_ms = latency_ms
+        self.tokens_per_sec = tokens_per_sec
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.stall_rate = stall_rate
+        self.stall_ms = stall_ms
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximates a token count as one token per four characters."""
+    return max(1, len(text) // 4)
+
+
+def classify_intent(user_prompt: str) -> Dict[str, Any]:
+    """Returns a deterministic intent classification for the agent's intent prompt."""
+    match = re.search(r'"(.*)"', user_prompt, re.DOTALL)
+    query = match.group(1) if match else user_prompt
+    lowered = query.lower()
+
+    ticket_match = TICKET_ID_PATTERN.search(query)
+    if ticket_match:
+        return {"intent": "ticket_inquiry", "ticket_id": ticket_match.group(1).upper()}
+    if "ticket" in lowered and any(word in lowered for word in ("create", "open", "yes")):
+        return {"intent": "ticket_creation_request", "ticket_id": None}
+    if "ticket" in lowered:
+        return {"intent": "ticket_history_inquiry", "ticket_id": None}
+    if GREETING_PATTERN.match(query):
+        return {"intent": "greeting", "ticket_id": None}
+    if lowered.rstrip().endswith("?"):
+        return {"intent": "general_question", "ticket_id": None}
+    return {"intent": "new_issue", "ticket_id": None}
+
+
+def build_completion(body: Dict[str, Any], config: FakeGroqConfig) -> Dict[str, Any]:
+    """Builds an OpenAI-shaped chat completion for a request body."""
+    messages = body.get("messages", [])
+    prompt_text = "".join(str(m.get("content", "")) for m in messages)
+    user_prompt = next((m.get("content", "") for m in reversed(messages) if m.get("role") == "user"), "")
+    system_prompt = "".join(str(m.get("content", "")) for m in messages if m.get("role") == "system")
+    with _seen_lock:
+        key = hash(system_prompt)
+        cached_tokens = estimate_tokens(system_prompt) if system_prompt and key in _seen_system_prompts else 0
+        _seen_system_prompts.add(key)
+
+    if (body.get("response_format") or {}).get("type") == "json_object":
+        content = json.dumps(classify_intent(user_prompt))
+        completion_tokens = estimate_tokens(content)
+    else:
+        completion_tokens = min(config.completion_tokens, body.get("max_tokens") or config.completion_tokens)
+        content = " ".join(["lorem"] * completion_tokens)
+
+    return {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "fake-model"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        "usage": {
+            "prompt_tokens": estimate_tokens(prompt_text),
+            "completion_tokens": completion_tokens,
+            "total_tokens": estimate_tokens(prompt_text) + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens},
+        },
+    }
+
+
+class FakeGroqHandler(BaseHTTPRequestHandler):
+    """Serves chat completions with simulated latency."""
+
+    config = FakeGroqConfig()
+
+    def do_GET(self) -> None:
+        # Used by `LlmClient.warm_up`.
+        if self.path.rstrip("/") != MODELS_PATH:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        models = ["llama-3.1-8b-instant", "llama-3.3-70b-versatile"]
+        self._send_json(200, {"object": "list", "data": [{"id": m, "object": "model", "owned_by": "fake"} for m in models]})
+
+    def do_POST(self) -> None:
+        if self.path.rstrip("/") != CHAT_COMPLETIONS_PATH:
+            self._send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError:
+            self._send_json(400, {"error": {"message": "Invalid JSON body."}})
+            return
+
+        roll = random.random()
+        if roll < self.config.error_rate:
+            time.sleep(self.config.latency_ms / 1000)
+            self._send_json(503, {"error": {"message": "Simulated overload.", "type": "service_unavailable"}})
+            return
+        if roll < self.config.error_rate + self.config.stall_rate:
+            time.sleep(self.config.stall_ms / 1000)
+
+        completion = build_completion(body, self.config)
+        if body.get("stream"):
+            self._send_stream(completion)
+            return
+        generation_s = completion["usage"]["completion_tokens"] / self.config.tokens_per_sec
+        time.sleep(self.config.latency_ms / 1000 + generation_s)
+        self._send_json(200, completion)
+
+    def _send_stream(self, completion: Dict[str, Any]) -> None:
+        """Sends a completion as `chat.completion.chunk` events, one word per chunk."""
+        time.sleep(self.config.latency_ms / 1000)
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        words = completion["choices"][0]["message"]["content"].split(" ")
+        chunk = {key: completion[key] for key in ("id", "created", "model")}
+        chunk["object"] = "chat.completion.chunk"
+        for i, word in enumerate(words):
+            text = word if i == 0 else f" {word}"
+            time.sleep(estimate_tokens(text) / self.config.tokens_per_sec)
+            chunk["choices"] = [{"index": 0, "delta": {"role": "assistant", "content": text}, "finish_reason": None}]
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+        chunk["choices"] = [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        chunk["x_groq"] = {"id": completion["id"], "usage": completion["usage"]}
+        self.wfile.write(f"data: {json.dumps(chunk)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def _send_json(self, status: int, payload: Dict[str, Any]) -> None:
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # Keep the console quiet under load.
+        pass
+
+
+def start_server(host: str = "127.0.0.1", port: int = 8765, config: Optional[FakeGroqConfig] = None) -> ThreadingHTTPServer:
+    """Starts the fake server on a daemon thread and returns it.
+
+    Args:
+        host (str, optional): The interface to bind. Defaults to "127.0.0.1".
+        port (int, optional): The port to bind; 0 picks a free port. Defaults to 8765.
+        config (Optional[FakeGroqConfig], optional): Latency settings.
+
+    Returns:
+        ThreadingHTTPServer: The running server. Call `shutdown()` to stop it.
+    """
+    handler = type("ConfiguredFakeGroqHandler", (FakeGroqHandler,), {"config": config or FakeGroqConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Fake Groq chat completions server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Simulated time to first token.")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="Simulated generation rate.")
+    parser.add_argument("--completion-tokens", type=int, default=120, help="Length of non-JSON completions.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with HTTP 503.")
+    parser.add_argument("--stall-rate", type=float, default=0.0, help="Share of requests that stall before answering.")
+    parser.add_argument("--stall-ms", type=float, default=20000.0, help="How long a stalled request hangs.")
+    args = parser.parse_args()
+
+    config = FakeGroqConfig(
+        args.latency_ms, args.tokens_per_sec, args.completion_tokens,
+        args.error_rate, args.stall_rate, args.stall_ms
+    )
+    handler = type("ConfiguredFakeGroqHandler", (FakeGroqHandler,), {"config": config})
+    server = ThreadingHTTPServer((args.host, args.port), handler)
+    print(f"Fake Groq server listening on http://{args.host}:{args.port}{CHAT_COMPLETIONS_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
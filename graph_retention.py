@@ -0,0 +1,181 @@
+# graph_retention.py
+
+"""
+Retention job for the conversation graph.
+
+Every turn adds two `Message` nodes and two `CONTAINS` edges, and nothing
+expired them, so the AGE label tables (and the `MERGE`s and history
+traversals that scan them) grew forever. This job removes messages older
+than `GRAPH_RETENTION_DAYS` in one of two modes:
+
+- "archive" (default): each batch is copied into the `message_archive`
+  table (migrations/007_message_archive.sql) in the same transaction that
+  deletes it from the graph. No LLM is called, so expired messages the
+  session summary does not cover yet are deleted too: their content stays
+  in the archive, which the agent never reads, and drops out of the
+  conversation context of a resumed session.
+- "fold": expired messages are first folded into their session's rolling
+  summary (one LLM call per session, see `summarizer.py`), and only
+  messages the summary covers are deleted. A session whose fold fails keeps
+  its messages until the next run.
+
+Either way the agent keeps the session's summary and only the verbatim old
+messages leave the graph; only "fold" guarantees that the summary covers
+them. Use it when old sessions are resumed. Deletes run in batches of
+`GRAPH_RETENTION_BATCH_SIZE`, each its own short transaction with a lock
+timeout, with a pause between batches, so concurrent conversation writes are
+never blocked for long. Afterwards the label tables are vacuumed (plain
+`VACUUM`, no exclusive lock) so the freed space is reused. The report shows
+the graph size before and after.
+
+Usage:
+    python3 graph_retention.py --days 90
+    python3 graph_retention.py --days 30 --mode fold --batch-size 200 --json
+"""
+
+# Standard library imports
+import argparse
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Local application/library specific imports
+import database as db
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+GRAPH_RETENTION_DAYS = float(os.getenv("GRAPH_RETENTION_DAYS", "90"))
+GRAPH_RETENTION_MODE = os.getenv("GRAPH_RETENTION_MODE", "archive").lower()
+GRAPH_RETENTION_BATCH_SIZE = int(os.getenv("GRAPH_RETENTION_BATCH_SIZE", "500"))
+# Pause between batches, leaving room for the conversation writes.
+GRAPH_RETENTION_PAUSE_S = float(os.getenv("GRAPH_RETENTION_PAUSE_S", "0.2"))
+GRAPH_RETENTION_LOCK_TIMEOUT_MS = int(os.getenv("GRAPH_RETENTION_LOCK_TIMEOUT_MS", "2000"))
+# Consecutive failed batches (e.g. lock timeouts) before the run gives up.
+MAX_FAILED_BATCHES = 3
+MODES = ("archive", "fold")
+
+
+def fold_expired_sessions(cutoff: int) -> Dict[str, int]:
+    """Folds the expired, not yet summarized messages of every session into its summary."""
+    # Imported here: only the fold mode needs the LLM client.
+    from llm_client import LlmClient
+    from summarizer import ConversationSummarizer
+
+    summarizer = ConversationSummarizer(LlmClient(api_key=os.getenv("GROQ_API_KEY")))
+    folded, failed = 0, 0
+    for session_id in db.get_sessions_to_fold(cutoff):
+        if summarizer.fold_expired(session_id, cutoff):
+            folded += 1
+        else:
+            failed += 1
+            print(f"Warning: Could not fold session {session_id}; its expired messages are kept.")
+    return {"folded_sessions": folded, "failed_sessions": failed}
+
+
+def delete_expired(
+    cutoff: int,
+    mode: str,
+    batch_size: int = GRAPH_RETENTION_BATCH_SIZE,
+    pause_s: float = GRAPH_RETENTION_PAUSE_S,
+    max_batches: Optional[int] = None
+) -> Dict[str, int]:
+    """Deletes expired messages batch by batch until none are left (or `max_batches`)."""
+    deleted, batches, failures = 0, 0, 0
+    while max_batches is None or batches < max_batches:
+        count = db.delete_expired_messages(
+            cutoff, batch_size,
+            archive=(mode == "archive"),
+            folded_only=(mode == "fold"),
+            lock_timeout_ms=GRAPH_RETENTION_LOCK_TIMEOUT_MS
+        )
+        if count is None:
+            failures += 1
+            if failures >= MAX_FAILED_BATCHES:
+                print(f"Warning: Stopping after {failures} failed batches in a row.")
+                break
+        else:
+            failures = 0
+            batches += 1
+            deleted += count
+            if count < batch_size:
+                break
+        time.sleep(pause_s)
+    return {"deleted_messages": deleted, "batches": batches}
+
+
+def run_retention(
+    days: float = GRAPH_RETENTION_DAYS,
+    mode: str = GRAPH_RETENTION_MODE,
+    batch_size: int = GRAPH_RETENTION_BATCH_SIZE,
+    pause_s: float = GRAPH_RETENTION_PAUSE_S,
+    max_batches: Optional[int] = None,
+    vacuum: bool = True
+) -> Dict[str, Any]:
+    """Runs one retention pass and returns its report.
+
+    Args:
+        days (float): Messages older than this many days are removed.
+        mode (str): "archive" or "fold" (see the module docstring).
+        batch_size (int): Messages deleted per transaction.
+        pause_s (float): Sleep between batches.
+        max_batches (Optional[int]): Stop after this many batches (None: no limit).
+        vacuum (bool): Vacuum the Message and CONTAINS tables afterwards.
+
+    Returns:
+        Dict[str, Any]: The cutoff, what was folded and deleted, the elapsed
+        time and the graph size before and after (see `db.get_graph_stats`).
+    """
+    if mode not in MODES:
+        raise ValueError(f"Unknown retention mode '{mode}', expected one of {MODES}.")
+    cutoff = int((time.time() - days * 86400) * 1000)
+    report: Dict[str, Any] = {"mode": mode, "days": days, "cutoff": cutoff, "before": db.get_graph_stats()}
+
+    start = time.perf_counter()
+    if mode == "fold":
+        report.update(fold_expired_sessions(cutoff))
+    report.update(delete_expired(cutoff, mode, batch_size, pause_s, max_batches))
+    if vacuum and report["deleted_messages"]:
+        report["vacuumed"] = db.vacuum_graph_tables()
+    report["elapsed_s"] = time.perf_counter() - start
+    report["after"] = db.get_graph_stats()
+    return report
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"Removed {report['deleted_messages']} messages older than {report['days']:g} days "
+          f"in {report['batches']} batches ({report['mode']} mode, {report['elapsed_s']:.1f}s).")
+    if report["mode"] == "fold":
+        print(f"Folded {report['folded_sessions']} sessions into their summaries ({report['failed_sessions']} failed).")
+    before, after = report["before"] or {}, report["after"] or {}
+    print(f"{'label':<12} {'rows before':>12} {'rows after':>12} {'MB before':>10} {'MB after':>10}")
+    for label in before:
+        b, a = before[label], after.get(label, {"rows": 0, "bytes": 0})
+        print(f"{label:<12} {b['rows']:>12} {a['rows']:>12} {b['bytes'] / 1e6:>10.1f} {a['bytes'] / 1e6:>10.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Remove old conversation messages from the graph.")
+    parser.add_argument("--days", type=float, default=GRAPH_RETENTION_DAYS, help="Retention horizon in days.")
+    parser.add_argument("--mode", choices=MODES, default=GRAPH_RETENTION_MODE, help="Archive or fold expired messages.")
+    parser.add_argument("--batch-size", type=int, default=GRAPH_RETENTION_BATCH_SIZE, help="Messages deleted per transaction.")
+    parser.add_argument("--pause-s", type=float, default=GRAPH_RETENTION_PAUSE_S, help="Sleep between batches.")
+    parser.add_argument("--max-batches", type=int, help="Stop after this many batches.")
+    parser.add_argument("--no-vacuum", dest="vacuum", action="store_false", help="Skip the VACUUM of the label tables.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    report = run_retention(args.days, args.mode, args.batch_size, args.pause_s, args.max_batches, args.vacuum)
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
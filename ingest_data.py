@@ -1,7 +1,10 @@
+import argparse
 import os
+import re
 import psycopg2
 import csv
 from dotenv import load_dotenv
+from psycopg2.extras import execute_values
 
 # Load environment variables from .env file
 load_dotenv()
@@ -16,11 +19,112 @@ DB_PORT = os.getenv("DB_PORT")
 # --- FILE PATHS ---
 # Path to your knowledge base CSV file
 KB_CSV_PATH = 'mock_data/knowledge_base_with_embeddings.csv'
+# Source CSV (url, title, content) and the float32 embeddings written by ingest_embeddings.py.
+# When the .npy file exists it is used instead of KB_CSV_PATH.
+KB_SOURCE_CSV_PATH = 'data/postgresql_docs_kb.csv'
+KB_EMBEDDINGS_PATH = 'data/postgresql_docs_kb_embeddings.npy'
+KB_INSERT_PAGE_SIZE = 500
+# Path to the customers CSV (user_id, name, pg_version)
+CUSTOMERS_CSV_PATH = 'mock_data/customers.csv'
+
+# Documents are tagged with the PostgreSQL major version in their URL
+# (https://www.postgresql.org/docs/15/...); this is used when there is none.
+DEFAULT_PG_VERSION = 15
+DOC_VERSION_PATTERN = re.compile(r'/docs/(\d+)/')
+# Ticket log lines start with an ISO timestamp ("2025-10-26T10:00:00Z: ...").
+LOG_LINE_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2}T[0-9:.]+Z?)\s*:\s*(.*)$')
+
+
+def doc_version(url: str) -> int:
+    """Returns the PostgreSQL major version a documentation URL belongs to."""
+    match = DOC_VERSION_PATTERN.search(url or '')
+    return int(match.group(1)) if match else DEFAULT_PG_VERSION
+
+
+def log_events(log: str) -> list:
+    """Splits a ticket log into (timestamp or None, entry) pairs, one per non-empty line."""
+    events = []
+    for line in (log or '').splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = LOG_LINE_PATTERN.match(line)
+        events.append((match.group(1), match.group(2)) if match else (None, line))
+    return events
+
+
+def embed_texts(texts: list) -> list:
+    """Embeds short texts (ticket descriptions) with the agent's model, as pgvector text."""
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(TICKET_EMBEDDING_MODEL)
+    return [str(vector.tolist()) for vector in model.encode(texts)]
+
+
+def embeddings_path_for(csv_path: str) -> str:
+    """Returns the .npy file ingest_embeddings.py writes for a source CSV."""
+    return f"{os.path.splitext(csv_path)[0]}_embeddings.npy"
+
+
+def ingest_knowledge_base_npy(cursor, csv_path: str = KB_SOURCE_CSV_PATH, embeddings_path: str = KB_EMBEDDINGS_PATH) -> int:
+    """Inserts the source CSV rows with their embeddings from the .npy file.
+
+    The embeddings are memory-mapped, so only one page of rows is held in
+    memory at a time. Each document is tagged with the version in its URL.
+    """
+    import numpy as np
+
+    embeddings = np.load(embeddings_path, mmap_mode='r')
+    insert_count = 0
+    insert_sql = "INSERT INTO pg_docs (title, url, content, pg_version, embedding) VALUES %s;"
+    with open(csv_path, 'r', encoding='utf-8', newline='') as f:
+        page = []
+        for row in csv.DictReader(f):
+            vector = '[' + ','.join(f'{x:.8g}' for x in embeddings[insert_count]) + ']'
+            page.append((row['title'], row['url'], row['content'], doc_version(row['url']), vector))
+            insert_count += 1
+            if len(page) == KB_INSERT_PAGE_SIZE:
+                execute_values(cursor, insert_sql, page)
+                page = []
+        if page:
+            execute_values(cursor, insert_sql, page)
+    if insert_count != len(embeddings):
+        raise ValueError(
+            f"{csv_path} has {insert_count} rows but {embeddings_path} has {len(embeddings)}; "
+            "re-run ingest_embeddings.py."
+        )
+    return insert_count
+
+
+def create_version_indexes(cursor) -> list:
+    """Creates a partial HNSW index for every documented PostgreSQL version.
+
+    A search filtered to one version then scans only that version's index,
+    so the filter neither reduces recall nor falls back to a sequential scan.
+    """
+    cursor.execute("SELECT DISTINCT pg_version FROM pg_docs ORDER BY pg_version;")
+    versions = [row[0] for row in cursor.fetchall()]
+    for version in versions:
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS pg_docs_embedding_v{int(version)}_idx ON pg_docs "
+            f"USING hnsw (embedding vector_cosine_ops) WHERE pg_version = {int(version)};"
+        )
+    return versions
+
 # Path to your new sample tickets CSV file
 TICKETS_CSV_PATH = 'mock_data/sample_tickets.csv'
+# Must match database.EMBEDDING_MODEL_NAME.
+TICKET_EMBEDDING_MODEL = 'all-MiniLM-L6-v2'
+
+def setup_database(kb_sources: list = None):
+    """Connects to the database, runs the schema, and ingests all mock data.
 
-def setup_database():
-    """Connects to the database, runs the schema, and ingests all mock data."""
+    Args:
+        kb_sources (list, optional): Knowledge base CSVs to load, e.g. one per
+            PostgreSQL version. Each needs its `<name>_embeddings.npy` file from
+            ingest_embeddings.py. Defaults to KB_SOURCE_CSV_PATH (or the legacy
+            KB_CSV_PATH when its embeddings have not been computed).
+    """
     conn = None
     try:
         print("Connecting to the PostgreSQL database...")
@@ -38,40 +142,71 @@ def setup_database():
         print("Schema created successfully.")
 
         # --- 2. Ingest Knowledge Base from CSV ---
-        print(f"Ingesting knowledge base from {KB_CSV_PATH}...")
-        with open(KB_CSV_PATH, 'r', encoding='utf-8') as f:
-            reader = csv.reader(f)
-            header = next(reader) # Skip header row
+        if kb_sources:
             insert_count = 0
-            for row in reader:
-                # IMPORTANT: Adjust these indices to match your CSV's column order
-                # Example assumes: title, url, content, embedding_string
-                title = row[0]
-                url = row[1]
-                content = row[2]
-                embedding_str = row[3]
-                
-                cursor.execute(
-                    "INSERT INTO pg_docs (title, url, content, embedding) VALUES (%s, %s, %s, %s);",
-                    (title, url, content, embedding_str)
-                )
-                insert_count += 1
+            for csv_path in kb_sources:
+                print(f"Ingesting knowledge base from {csv_path} and {embeddings_path_for(csv_path)}...")
+                insert_count += ingest_knowledge_base_npy(cursor, csv_path, embeddings_path_for(csv_path))
+        elif os.path.exists(KB_EMBEDDINGS_PATH):
+            print(f"Ingesting knowledge base from {KB_SOURCE_CSV_PATH} and {KB_EMBEDDINGS_PATH}...")
+            insert_count = ingest_knowledge_base_npy(cursor)
+        else:
+            print(f"Ingesting knowledge base from {KB_CSV_PATH}...")
+            with open(KB_CSV_PATH, 'r', encoding='utf-8') as f:
+                reader = csv.reader(f)
+                header = next(reader) # Skip header row
+                insert_count = 0
+                for row in reader:
+                    # IMPORTANT: Adjust these indices to match your CSV's column order
+                    # Example assumes: title, url, content, embedding_string
+                    title = row[0]
+                    url = row[1]
+                    content = row[2]
+                    embedding_str = row[3]
+                    
+                    cursor.execute(
+                        "INSERT INTO pg_docs (title, url, content, pg_version, embedding) VALUES (%s, %s, %s, %s, %s);",
+                        (title, url, content, doc_version(url), embedding_str)
+                    )
+                    insert_count += 1
+        # Fill the half-precision column used by the quantized search modes.
+        cursor.execute("UPDATE pg_docs SET embedding_half = embedding::halfvec(384) WHERE embedding_half IS NULL;")
+        versions = create_version_indexes(cursor)
         conn.commit()
-        print(f"Successfully ingested {insert_count} documents into pg_docs.")
+        print(f"Successfully ingested {insert_count} documents into pg_docs (PostgreSQL versions: {versions}).")
+
+        # --- 2b. Ingest Customers from CSV ---
+        print(f"Ingesting customers from {CUSTOMERS_CSV_PATH}...")
+        with open(CUSTOMERS_CSV_PATH, 'r', encoding='utf-8') as f:
+            rows = [(row['user_id'], row['name'], row['pg_version'] or None) for row in csv.DictReader(f)]
+        execute_values(cursor, "INSERT INTO customers (user_id, name, pg_version) VALUES %s;", rows)
+        conn.commit()
+        print(f"Successfully ingested {len(rows)} customers.")
 
         # --- 3. Ingest Sample Tickets from CSV ---
         print(f"Ingesting sample tickets from {TICKETS_CSV_PATH}...")
         with open(TICKETS_CSV_PATH, 'r', encoding='utf-8') as f:
             reader = csv.reader(f)
             header = next(reader) # Skip the header row ('ticket_id', 'user_id', etc.)
-            insert_count = 0
-            for row in reader:
-                # The row is a list of strings: [ticket_id, user_id, description, log]
+            ticket_rows = list(reader)
+        # Descriptions are embedded once here; retrieval uses the stored vectors.
+        embeddings = embed_texts([row[2] for row in ticket_rows])
+        insert_count = 0
+        for row, embedding in zip(ticket_rows, embeddings):
+            # The row is a list of strings: [ticket_id, user_id, description, log, status]
+            status = row[4] if len(row) > 4 and row[4] else 'Open'
+            cursor.execute(
+                "INSERT INTO tickets (ticket_id, user_id, description, status, embedding) VALUES (%s, %s, %s, %s, %s);",
+                (row[0], row[1], row[2], status, embedding)
+            )
+            # Each log line becomes an entry of the append-only ticket log.
+            for logged_at, entry in log_events(row[3]):
                 cursor.execute(
-                    "INSERT INTO tickets (ticket_id, user_id, description, log) VALUES (%s, %s, %s, %s);",
-                    (row[0], row[1], row[2], row[3]) # Unpack the row directly
+                    "INSERT INTO ticket_events (ticket_id, created_at, entry) "
+                    "VALUES (%s, COALESCE(%s::timestamp AT TIME ZONE 'UTC', CURRENT_TIMESTAMP), %s);",
+                    (row[0], logged_at, entry)
                 )
-                insert_count += 1
+            insert_count += 1
         conn.commit()
         print(f"Successfully ingested {insert_count} sample tickets.")
 
@@ -92,4 +227,10 @@ def setup_database():
             print("Database connection closed.")
 
 if __name__ == '__main__':
-    setup_database()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Create the schema and load the mock data.")
+    parser.add_argument(
+        "--kb", action="append", dest="kb_sources",
+        help="Knowledge base CSV to load (repeat for several PostgreSQL versions)."
+    )
+    args = parser.parse_args()
+    setup_database(args.kb_sources)
\ No newline at end of file
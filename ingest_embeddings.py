@@ -0,0 +1,276 @@
+# ingest_embeddings.py
+
+"""
+Computes knowledge base embeddings in parallel and stores them as binary float32.
+
+`mock_data/knowledge_base_with_embeddings.py` encodes every document in one
+process and writes the vectors back into a CSV as text, which is slow on
+large document sets and more than doubles the file size. This command instead:
+
+- streams the source CSV (url, title, content) in batches of `--batch-size`
+  rows, without loading it into memory;
+- encodes the batches on a process pool, with the model loaded once per
+  worker process and one torch thread per worker, so throughput scales with
+  the number of cores;
+- writes the vectors into a float32 `.npy` file (row i belongs to CSV row i),
+  filled in place through a memory map;
+- records the number of finished rows in a checkpoint file, so an
+  interrupted run resumes where it stopped instead of starting over;
+- looks every document up in the persistent `embedding_cache` first and
+  only encodes texts it has not seen with this model version, so
+  re-ingesting an unchanged corpus does not start the worker processes.
+
+`ingest_data.py` loads the `.npy` file alongside the source CSV.
+
+Usage:
+    python3 ingest_embeddings.py --input data/postgresql_docs_kb.csv
+    python3 ingest_embeddings.py --workers 8 --batch-size 128 --output data/kb_embeddings.npy
+"""
+
+# Standard library imports
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+# Third-party imports
+import numpy as np
+
+# Local application/library specific imports
+import embedding_cache
+
+DEFAULT_INPUT_PATH = "data/postgresql_docs_kb.csv"
+DEFAULT_MODEL = "all-MiniLM-L6-v2"
+TEXT_COLUMN = "content"
+
+# Set in each worker process by `_init_worker`.
+_worker_model = None
+
+
+def default_output_path(input_path: str) -> str:
+    """Returns the `.npy` path used for `input_path` when none is given."""
+    return f"{os.path.splitext(input_path)[0]}_embeddings.npy"
+
+
+def checkpoint_path(output_path: str) -> str:
+    return f"{os.path.splitext(output_path)[0]}.checkpoint.json"
+
+
+def _init_worker(model_name: str, torch_threads: int) -> None:
+    """Loads the embedding model once per worker process."""
+    global _worker_model
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    # One intra-op thread per process; parallelism comes from the pool.
+    torch.set_num_threads(torch_threads)
+    _worker_model = SentenceTransformer(model_name)
+
+
+def _encode_batch(start: int, texts: List[str]) -> Tuple[int, np.ndarray]:
+    """Encodes one batch in a worker process and returns it with its first row index."""
+    embeddings = _worker_model.encode(texts, batch_size=len(texts), show_progress_bar=False)
+    return start, np.asarray(embeddings, dtype=np.float32)
+
+
+def count_rows(input_path: str) -> int:
+    """Counts the data rows of a CSV file (fields may span several lines)."""
+    with open(input_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return sum(1 for _ in reader)
+
+
+def iter_batches(input_path: str, batch_size: int, skip: int = 0) -> Iterator[Tuple[int, List[str]]]:
+    """Streams (first row index, texts) batches from the CSV, skipping the first `skip` rows."""
+    with open(input_path, "r", encoding="utf-8", newline="") as f:
+        reader = csv.DictReader(f)
+        batch: List[str] = []
+        start = skip
+        for index, row in enumerate(reader):
+            if index < skip:
+                continue
+            batch.append(row[TEXT_COLUMN] or "")
+            if len(batch) == batch_size:
+                yield start, batch
+                start += len(batch)
+                batch = []
+        if batch:
+            yield start, batch
+
+
+def load_checkpoint(input_path: str, output_path: str, model_name: str, total_rows: int) -> int:
+    """Returns the number of rows already embedded by a previous, compatible run."""
+    path = checkpoint_path(output_path)
+    if not (os.path.exists(path) and os.path.exists(output_path)):
+        return 0
+    with open(path, "r", encoding="utf-8") as f:
+        checkpoint = json.load(f)
+    stat = os.stat(input_path)
+    if (checkpoint.get("input") != os.path.abspath(input_path)
+            or checkpoint.get("input_size") != stat.st_size
+            or checkpoint.get("input_mtime") != stat.st_mtime
+            or checkpoint.get("model") != model_name
+            or checkpoint.get("rows") != total_rows):
+        print("INFO: Input or model changed since the last checkpoint; starting over.")
+        return 0
+    return int(checkpoint.get("done", 0))
+
+
+def save_checkpoint(input_path: str, output_path: str, model_name: str, total_rows: int, done: int) -> None:
+    """Atomically records that the first `done` rows are embedded."""
+    stat = os.stat(input_path)
+    checkpoint = {
+        "input": os.path.abspath(input_path),
+        "input_size": stat.st_size,
+        "input_mtime": stat.st_mtime,
+        "model": model_name,
+        "rows": total_rows,
+        "done": done,
+    }
+    path = checkpoint_path(output_path)
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        json.dump(checkpoint, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def embed_file(
+    input_path: str,
+    output_path: str,
+    model_name: str = DEFAULT_MODEL,
+    workers: Optional[int] = None,
+    batch_size: int = 256,
+    torch_threads: int = 1,
+    checkpoint_every: int = 10,
+    use_cache: bool = embedding_cache.EMBEDDING_CACHE_ENABLED
+) -> Dict[str, Any]:
+    """Embeds the `content` column of `input_path` into a float32 `.npy` file.
+
+    Args:
+        input_path (str): A CSV with `url`, `title` and `content` columns.
+        output_path (str): The `.npy` file to write; row i embeds CSV row i.
+        model_name (str, optional): The SentenceTransformers model.
+        workers (Optional[int], optional): Worker processes. Defaults to the CPU count.
+        batch_size (int, optional): Rows per task sent to a worker.
+        torch_threads (int, optional): Torch threads per worker.
+        checkpoint_every (int, optional): Completed batches between checkpoints.
+        use_cache (bool, optional): Reuse and store vectors in the embedding cache.
+
+    Returns:
+        Dict[str, Any]: 'rows', 'resumed_from', 'cached', 'dim', 'seconds'
+        and 'rows_per_sec'.
+    """
+    workers = workers or os.cpu_count() or 1
+    total_rows = count_rows(input_path)
+    done = load_checkpoint(input_path, output_path, model_name, total_rows)
+    resumed_from = done
+    if done:
+        print(f"INFO: Resuming after {done} of {total_rows} rows.")
+
+    matrix = np.lib.format.open_memmap(output_path, mode="r+") if done else None
+    finished: Dict[int, int] = {}  # first row -> row count of batches finished out of order
+    batches_since_checkpoint = 0
+    cache = embedding_cache.EmbeddingCache(model_name) if use_cache else None
+    cached_rows = 0
+    start_time = time.perf_counter()
+
+    def store(start: int, embeddings: np.ndarray) -> None:
+        nonlocal matrix, batches_since_checkpoint
+        if matrix is None:
+            matrix = np.lib.format.open_memmap(
+                output_path, mode="w+", dtype=np.float32, shape=(total_rows, embeddings.shape[1])
+            )
+        matrix[start:start + len(embeddings)] = embeddings
+        finished[start] = len(embeddings)
+        batches_since_checkpoint += 1
+
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(workers, mp_context=context, initializer=_init_worker, initargs=(model_name, torch_threads)) as pool:
+        batches = iter_batches(input_path, batch_size, skip=done)
+        # future -> (first row, all texts of the batch, cached vectors or None per text)
+        in_flight: Dict[Any, Tuple[int, List[str], List[Optional[np.ndarray]]]] = {}
+        exhausted = False
+        while in_flight or not exhausted:
+            # Keep a bounded number of batches queued so memory stays flat on large files.
+            while not exhausted and len(in_flight) < workers * 2:
+                batch = next(batches, None)
+                if batch is None:
+                    exhausted = True
+                    break
+                start, texts = batch
+                cached = cache.get_many(texts) if cache else [None] * len(texts)
+                missing = [text for text, vector in zip(texts, cached) if vector is None]
+                cached_rows += len(texts) - len(missing)
+                if missing:
+                    # The pool only starts worker processes once something needs encoding.
+                    in_flight[pool.submit(_encode_batch, start, missing)] = (start, texts, cached)
+                else:
+                    store(start, np.stack(cached))
+
+            if in_flight:
+                completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in completed:
+                    start, texts, cached = in_flight.pop(future)
+                    _, encoded = future.result()
+                    if cache:
+                        cache.put_many([t for t, v in zip(texts, cached) if v is None], encoded)
+                    vectors = iter(encoded)
+                    store(start, np.stack([v if v is not None else next(vectors) for v in cached]))
+
+            # Only the contiguous prefix of finished rows counts as done.
+            while done in finished:
+                done += finished.pop(done)
+            if batches_since_checkpoint >= checkpoint_every:
+                matrix.flush()
+                save_checkpoint(input_path, output_path, model_name, total_rows, done)
+                batches_since_checkpoint = 0
+                print(f"INFO: Embedded {done}/{total_rows} rows.")
+
+    if matrix is not None:
+        matrix.flush()
+    save_checkpoint(input_path, output_path, model_name, total_rows, done)
+    seconds = time.perf_counter() - start_time
+    return {
+        "rows": total_rows,
+        "resumed_from": resumed_from,
+        "cached": cached_rows,
+        "dim": int(matrix.shape[1]) if matrix is not None else None,
+        "seconds": seconds,
+        "rows_per_sec": (total_rows - resumed_from) / seconds if seconds else 0.0,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Embed a knowledge base CSV into a float32 .npy file using a process pool.")
+    parser.add_argument("--input", default=DEFAULT_INPUT_PATH, help="CSV with url, title and content columns.")
+    parser.add_argument("--output", help="Output .npy file. Defaults to <input>_embeddings.npy.")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="SentenceTransformers model name.")
+    parser.add_argument("--workers", type=int, help="Worker processes. Defaults to the CPU count.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Rows per batch sent to a worker.")
+    parser.add_argument("--torch-threads", type=int, default=1, help="Torch threads per worker.")
+    parser.add_argument("--checkpoint-every", type=int, default=10, help="Batches between checkpoints.")
+    parser.add_argument("--no-cache", dest="use_cache", action="store_false", help="Ignore the embedding cache.")
+    args = parser.parse_args()
+
+    output_path = args.output or default_output_path(args.input)
+    try:
+        result = embed_file(
+            args.input, output_path, args.model, args.workers,
+            args.batch_size, args.torch_threads, args.checkpoint_every, args.use_cache
+        )
+    except FileNotFoundError as e:
+        print(f"[ERROR] File not found: {e.filename}")
+        sys.exit(1)
+    print(
+        f"Embedded {result['rows']} rows (dimension {result['dim']}) into {output_path} "
+        f"in {result['seconds']:.1f}s ({result['rows_per_sec']:.1f} rows/sec, {result['cached']} from cache)."
+    )
+
+
+if __name__ == "__main__":
+    main()
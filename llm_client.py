@@ -1,8 +1,53 @@
 # llm_client.py
 
 import groq
+import hashlib
 import json
-from typing import Dict, Any
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Any, List, Optional, Sequence
+
+import tracing
+from resilience import (
+    BoundedExecutor, CircuitBreaker, CircuitOpenError, DeadlineExceeded, LatencyTracker, call_with_retries, hedged_call
+)
+
+# Groq models backing each tier of the two-model strategy.
+MODEL_TIERS = {
+    "small": "llama-3.1-8b-instant",      # Fast model for classification and short answers
+    "large": "llama-3.3-70b-versatile",   # Powerful model for knowledge base synthesis
+}
+
+# --- RESILIENCE CONFIGURATION ---
+# Total time budget per call, including retries.
+LLM_INTENT_DEADLINE_S = float(os.getenv("LLM_INTENT_DEADLINE_S", "5"))
+LLM_RESPONSE_DEADLINE_S = float(os.getenv("LLM_RESPONSE_DEADLINE_S", "30"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "3"))
+# Hedge the intent call once it is slower than the observed p95 (never earlier than the floor).
+LLM_HEDGE_INTENT = os.getenv("LLM_HEDGE_INTENT", "false").lower() == "true"
+LLM_HEDGE_MIN_DELAY_S = float(os.getenv("LLM_HEDGE_MIN_DELAY_S", "0.3"))
+# Workers for hedged calls: a primary and a hedge per concurrent API turn. The
+# API's limit is read from the environment because `api.py` imports this module.
+LLM_HEDGE_POOL_SIZE = int(os.getenv("LLM_HEDGE_POOL_SIZE", str(2 * int(os.getenv("API_MAX_INFLIGHT_TURNS", "32")))))
+LLM_BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+LLM_BREAKER_RESET_S = float(os.getenv("LLM_BREAKER_RESET_S", "30"))
+# Number of recent answers kept to serve repeated questions while the provider is down.
+LLM_RESPONSE_CACHE_SIZE = int(os.getenv("LLM_RESPONSE_CACHE_SIZE", "256"))
+
+DEFAULT_INTENT = {"intent": "general_question", "ticket_id": None}
+ERROR_RESPONSE = "I'm sorry, I encountered a technical error and couldn't process your request. Please try again."
+
+
+def is_retryable(error: Exception) -> bool:
+    """Returns True for transient Groq errors: timeouts, connection errors, 429 and 5xx."""
+    if isinstance(error, groq.APIConnectionError):  # Includes APITimeoutError
+        return True
+    if isinstance(error, groq.APIStatusError):
+        return error.status_code == 429 or error.status_code >= 500
+    return False
+
 
 class LlmClient:
     """A client for interacting with the Groq API, optimized for a two-model strategy.
@@ -15,6 +60,10 @@ class LlmClient:
         structured tasks, and a powerful, large model for response generation).
     3.  Handling potential errors, such as API failures or invalid JSON output,
         and providing safe fallback responses.
+    4.  Keeping latency bounded when the provider degrades: every call has a
+        deadline, transient errors are retried with jittered backoff, the
+        intent call can be hedged, and a circuit breaker makes callers degrade
+        immediately (local intent fast path, cached answers) during an outage.
     """
     def __init__(self, api_key: str):
         """Initializes the LlmClient with the necessary API key.
@@ -27,32 +76,104 @@ class LlmClient:
         """
         if not api_key:
             raise ValueError("Groq API key is required.")
-        self.client = groq.Groq(api_key=api_key)
+        # Retries are handled by `call_with_retries` so they respect the call deadline.
+        self.client = groq.Groq(api_key=api_key, max_retries=0)
+        self.breaker = CircuitBreaker(LLM_BREAKER_FAILURES, LLM_BREAKER_RESET_S)
+        self.intent_latency = LatencyTracker()
+        self._hedge_executor = BoundedExecutor(LLM_HEDGE_POOL_SIZE, thread_name_prefix="llm-hedge") if LLM_HEDGE_INTENT else None
+        self._response_cache: "OrderedDict[str, str]" = OrderedDict()
+        self._response_cache_lock = threading.Lock()
+
+    def warm_up(self) -> bool:
+        """Opens the HTTPS connection to the provider ahead of the first turn.
+
+        Lists the available models, which costs no tokens. The SDK keeps the
+        connection (DNS, TCP and TLS already done) for the next request.
 
-    def generate_intent(self, system_prompt: str, user_prompt: str) -> Dict[str, Any]:
+        Returns:
+            bool: True if the provider answered.
+        """
+        try:
+            self.client.models.list(timeout=LLM_INTENT_DEADLINE_S)
+            return True
+        except Exception as e:
+            print(f"Warning: LLM warm-up request failed: {e}")
+            return False
+
+    def _create(self, deadline_s: float, hedge: bool = False, **request: Any):
+        """Sends a chat completion request through the breaker, retries and (optionally) hedging.
+
+        Raises:
+            CircuitOpenError: If the circuit breaker is open.
+            Exception: The final provider error once retries or the deadline are exhausted.
+        """
+        if not self.breaker.allow():
+            raise CircuitOpenError("LLM circuit breaker is open.")
+
+        def attempt(remaining_s: float):
+            start = time.perf_counter()
+            if hedge and self._hedge_executor:
+                hedge_after = max(LLM_HEDGE_MIN_DELAY_S, self.intent_latency.percentile(95, default=remaining_s))
+                response = hedged_call(
+                    lambda timeout_s: self.client.chat.completions.create(timeout=timeout_s, **request),
+                    remaining_s,
+                    min(hedge_after, remaining_s),
+                    self._hedge_executor
+                )
+            else:
+                response = self.client.chat.completions.create(timeout=remaining_s, **request)
+            if hedge:
+                self.intent_latency.record(time.perf_counter() - start)
+            return response
+
+        try:
+            response = call_with_retries(attempt, deadline_s, is_retryable, max_attempts=LLM_MAX_ATTEMPTS)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        self.breaker.record_success()
+        # A stream reports its usage in its last chunk (see `stream_response`).
+        if not request.get("stream"):
+            _record_usage(response)
+        return response
+
+    def generate_intent(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        fallback: Optional[Dict[str, Any]] = None
+    ) -> Dict[str, Any]:
         """Performs structured intent classification using a fast, small LLM.
 
         This method is optimized for speed and accuracy in a classification task.
         It uses Groq's `llama-3.1-8b-instant` model with forced JSON output and zero
         temperature to get a deterministic, machine-readable classification of the
-        user's intent.
+        user's intent. When `LLM_HEDGE_INTENT` is enabled, a duplicate request is
+        sent if the first one is slower than the recent p95.
 
-        If the LLM fails to produce valid JSON or if an API error occurs, this
-        method provides a safe fallback response to prevent the agent from crashing.
+        If the LLM fails to produce valid JSON, if an API error occurs, or if the
+        circuit breaker is open, this method provides a safe fallback response to
+        prevent the agent from crashing.
 
         Args:
             system_prompt (str): The system prompt that defines the rules and
                 expected JSON schema for the classification task.
             user_prompt (str): The user's query that needs to be classified.
+            fallback (Optional[Dict[str, Any]], optional): The classification to
+                return on failure, typically from the local fast path
+                (`model_router.classify_intent_locally`). Defaults to
+                `{"intent": "general_question", "ticket_id": None}`.
 
         Returns:
             Dict[str, Any]: A dictionary containing the classified intent and any
-            extracted entities (e.g., 'ticket_id'). On failure, returns a default
-            dictionary: `{"intent": "general_question", "ticket_id": None}`.
+            extracted entities (e.g., 'ticket_id'). On failure, returns `fallback`.
         """
+        fallback = fallback or DEFAULT_INTENT
         try:
-            response = self.client.chat.completions.create(
-                model="llama-3.1-8b-instant",  # The fast model for classification
+            response = self._create(
+                LLM_INTENT_DEADLINE_S,
+                hedge=True,
+                model=MODEL_TIERS["small"],  # The fast model for classification
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -61,40 +182,59 @@ class LlmClient:
                 temperature=0  # No creativity needed for classification
             )
             return json.loads(response.choices[0].message.content)
-        
+
         except json.JSONDecodeError:
             print("Warning: LLM failed to produce valid JSON for intent classification.")
             # Fallback to a safe default if the model messes up the JSON
-            return {"intent": "general_question", "ticket_id": None}
+            return dict(fallback)
+        except CircuitOpenError:
+            tracing.set_attributes(degraded="circuit_open")
+            return dict(fallback)
         except Exception as e:
             print(f"An error occurred during intent generation: {e}")
-            return {"intent": "general_question", "ticket_id": None}
+            tracing.set_attributes(degraded="error")
+            return dict(fallback)
 
 
-    def generate_response(self, system_prompt: str, user_prompt: str) -> str:
+    def generate_response(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        tier: str = "large",
+        cache_key: Optional[str] = None
+    ) -> str:
         """Generates a conversational response using a powerful, large LLM.
 
         This method is designed for high-quality, context-aware response synthesis.
-        It uses Groq's `llama-3.3-70b-versatile` model, which has strong reasoning
-        capabilities, to generate a human-like response based on the provided
-        context and instructions in the prompts.
+        By default it uses Groq's `llama-3.3-70b-versatile` model, which has strong
+        reasoning capabilities, to generate a human-like response based on the
+        provided context and instructions in the prompts. Callers can pass
+        `tier="small"` to route simple, context-only answers to the fast model
+        (see `model_router.py`).
 
-        If any API error occurs, it returns a user-friendly error message to be
-        displayed directly in the chat interface.
+        With a `cache_key` (see `response_cache_key`), the answer is remembered
+        in a small LRU. If the provider fails or the circuit breaker is open, a
+        previous answer stored under the same key is returned when one exists.
 
         Args:
             system_prompt (str): The system prompt that defines the agent's persona,
                 rules, and instructions for how to use the provided context.
             user_prompt (str): The complete context (e.g., ticket data, knowledge
                 base articles, conversation history) and the user's original query.
+            tier (str, optional): The model tier, a key of `MODEL_TIERS`.
+                Defaults to "large".
+            cache_key (Optional[str], optional): The key of the answer in the
+                fallback cache. None (the default) neither stores nor serves
+                cached answers, e.g. for prompts with user-specific context.
 
         Returns:
             str: A string containing the generated conversational response.
-            On failure, returns a generic error message for the user.
+            On failure, returns a cached answer or a generic error message for the user.
         """
         try:
-            response = self.client.chat.completions.create(
-                model="llama-3.3-70b-versatile",  # The powerful model for synthesis
+            response = self._create(
+                LLM_RESPONSE_DEADLINE_S,
+                model=MODEL_TIERS[tier],
                 messages=[
                     {"role": "system", "content": system_prompt},
                     {"role": "user", "content": user_prompt}
@@ -102,7 +242,191 @@ class LlmClient:
                 temperature=0.1,  # A little creativity, but keeping it factual
                 max_tokens=1024
             )
-            return response.choices[0].message.content
+            content = response.choices[0].message.content
+            self._remember_response(cache_key, content)
+            return content
+        except Exception as e:
+            if not isinstance(e, CircuitOpenError):
+                print(f"An error occurred during response generation: {e}")
+            cached = self._cached_response(cache_key)
+            tracing.set_attributes(degraded="cached_answer" if cached else "error_message")
+            return cached or ERROR_RESPONSE
+
+    def stream_response(
+        self,
+        system_prompt: str,
+        user_prompt: str,
+        on_token: Callable[[str], None],
+        tier: str = "large",
+        cache_key: Optional[str] = None
+    ) -> str:
+        """Generates a response like `generate_response`, passing it on as it is produced.
+
+        The completion is requested with `stream=True` and every text delta is
+        handed to `on_token` as soon as it arrives, so a client can render the
+        answer while the model is still generating it. Retries and the circuit
+        breaker apply until the stream is open; a stream that breaks off after
+        some text was delivered returns that partial text instead of starting
+        over. If nothing was delivered, the cached answer or the error message
+        is passed to `on_token` as a single chunk.
+
+        Args:
+            system_prompt (str): The system prompt, as for `generate_response`.
+            user_prompt (str): The context and the user's query.
+            on_token (Callable[[str], None]): Called with each chunk of text.
+                It runs on the calling thread and should return quickly.
+            tier (str, optional): The model tier. Defaults to "large".
+            cache_key (Optional[str], optional): The fallback cache key, as
+                for `generate_response`.
+
+        Returns:
+            str: The full response, i.e. the concatenation of all chunks passed
+            to `on_token`.
+        """
+        parts: List[str] = []
+        stream_open = False
+        start = time.perf_counter()
+        try:
+            stream = self._create(
+                LLM_RESPONSE_DEADLINE_S,
+                model=MODEL_TIERS[tier],
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0.1,
+                max_tokens=1024,
+                stream=True
+            )
+            stream_open = True
+            for chunk in stream:
+                _record_stream_usage(chunk)
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    if not parts:
+                        tracing.set_attributes(first_token_ms=round((time.perf_counter() - start) * 1000, 2))
+                    parts.append(delta)
+                    on_token(delta)
+            content = "".join(parts)
+            self._remember_response(cache_key, content)
+            return content
         except Exception as e:
-            print(f"An error occurred during response generation: {e}")
-            return "I'm sorry, I encountered a technical error and couldn't process your request. Please try again."
\ No newline at end of file
+            if stream_open:
+                # `_create` only sees the stream open; a broken stream counts as a failure too.
+                self._record_error(e)
+            if not isinstance(e, CircuitOpenError):
+                print(f"An error occurred during response streaming: {e}")
+            if parts:
+                # Part of the answer already reached the user, so it is kept as is.
+                tracing.set_attributes(degraded="stream_interrupted")
+                return "".join(parts)
+            cached = self._cached_response(cache_key)
+            tracing.set_attributes(degraded="cached_answer" if cached else "error_message")
+            fallback = cached or ERROR_RESPONSE
+            on_token(fallback)
+            return fallback
+
+    def generate_summary(self, system_prompt: str, user_prompt: str) -> str:
+        """Condenses conversation messages into a short summary using the fast LLM.
+
+        Summarization runs in the background after a turn, so it uses the same
+        small `llama-3.1-8b-instant` model as intent classification to keep it
+        cheap. Unlike `generate_response`, failures are not turned into a
+        user-facing message: the caller keeps the previous summary instead.
+
+        Args:
+            system_prompt (str): Instructions describing how to summarize.
+            user_prompt (str): The previous summary and the messages to fold in.
+
+        Returns:
+            str: The updated summary, or an empty string if the call failed.
+        """
+        try:
+            response = self._create(
+                LLM_RESPONSE_DEADLINE_S,
+                model=MODEL_TIERS["small"],  # The fast model is enough for condensing text
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                temperature=0,
+                max_tokens=300
+            )
+            return response.choices[0].message.content.strip()
+        except Exception as e:
+            print(f"An error occurred during summary generation: {e}")
+            return ""
+
+    def _record_error(self, error: Exception) -> None:
+        """Counts an error towards the circuit breaker only if it signals an unhealthy provider.
+
+        Timeouts (including an exhausted deadline), connection errors, 429
+        and 5xx are failures. A request the
+        provider rejected (400, 401, 413, context length) or an error of the
+        caller does not open the breaker for everyone else.
+        """
+        if isinstance(error, DeadlineExceeded) or is_retryable(error):
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_neutral()
+
+    def _remember_response(self, cache_key: Optional[str], content: str) -> None:
+        if cache_key is None:
+            return
+        with self._response_cache_lock:
+            self._response_cache[cache_key] = content
+            self._response_cache.move_to_end(cache_key)
+            while len(self._response_cache) > LLM_RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
+
+    def _cached_response(self, cache_key: Optional[str]) -> Optional[str]:
+        if cache_key is None:
+            return None
+        with self._response_cache_lock:
+            return self._response_cache.get(cache_key)
+
+
+def response_cache_key(tier: str, intent: str, query: str, sources: Sequence[str] = ()) -> str:
+    """Returns the fallback cache key of an answer.
+
+    The full prompt almost never repeats (it carries the retrieved context,
+    the history and the summary), so answers are keyed by what the question
+    is instead: the tier, the intent, the query with case and whitespace
+    normalized, and the sources the answer was based on (e.g. the URLs of
+    the retrieved articles). Only use it for answers that depend on nothing
+    else, i.e. turns without user-specific context.
+    """
+    normalized = " ".join(query.lower().split())
+    key = "\0".join([tier, intent, normalized, *sources])
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+def _record_stream_usage(chunk) -> None:
+    """Records the usage Groq attaches to the last chunk of a stream (under `x_groq`)."""
+    usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or getattr(chunk, "usage", None)
+    if usage is not None:
+        tracing.set_attributes(
+            model=getattr(chunk, "model", None),
+            prompt_tokens=getattr(usage, "prompt_tokens", None),
+            completion_tokens=getattr(usage, "completion_tokens", None),
+            cached_tokens=_cached_tokens(usage),
+        )
+
+
+def _cached_tokens(usage) -> Optional[int]:
+    """Returns the prompt tokens served from the provider's prompt cache, if reported."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        return details.get("cached_tokens")
+    return getattr(details, "cached_tokens", None)
+
+
+def _record_usage(response) -> None:
+    """Attaches the model name and token counts of a completion to the current trace span."""
+    usage = getattr(response, "usage", None)
+    tracing.set_attributes(
+        model=getattr(response, "model", None),
+        prompt_tokens=getattr(usage, "prompt_tokens", None),
+        completion_tokens=getattr(usage, "completion_tokens", None),
+        cached_tokens=_cached_tokens(usage),
+    )
@@ -0,0 +1,196 @@
+# load_test.py
+
+"""
+Offline load test for `agent.get_agent_response`.
+
+Replays multi-turn conversation scripts (by default the seeded
+`session_user_1` conversation and a new-user conversation from
+`mock_data/load_test_conversations.json`) at N concurrent sessions and
+reports throughput, per-turn latency percentiles and connection pool
+saturation.
+
+With `--fake-groq` (the default) the LLM calls go to a local instance of
+`fake_groq_server.py`, so no Groq API key or quota is needed. The database is
+still the real PostgreSQL instance configured in `.env`, so run
+`ingest_data.py` first.
+
+Every virtual session uses its own session ID, so the graph memory grows the
+same way it would with real users.
+
+Usage:
+    python3 load_test.py --sessions 20 --iterations 3
+    python3 load_test.py --sessions 50 --latency-ms 300 --max-p95-ms 4000 --json
+"""
+
+# Standard library imports
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+# Local application/library specific imports
+import fake_groq_server
+from tracing import percentile
+
+DEFAULT_SCRIPTS_PATH = "mock_data/load_test_conversations.json"
+
+
+class PoolMonitor:
+    """Samples the database connection pool utilization on a background thread."""
+
+    def __init__(self, db_module, interval_s: float = 0.05):
+        self.db = db_module
+        self.interval_s = interval_s
+        self.samples: List[int] = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self.samples.append(self.db.get_pool_stats()["in_use"])
+            self._stop.wait(self.interval_s)
+
+
+def run_session(agent_module, script: Dict[str, Any], run_id: str, index: int, iterations: int) -> List[Dict[str, Any]]:
+    """Plays one conversation script `iterations` times as a single virtual user.
+
+    Returns:
+        List[Dict[str, Any]]: One record per turn with its latency and outcome.
+    """
+    records = []
+    for iteration in range(iterations):
+        session_id = f"loadtest-{run_id}-{script['name']}-{index}-{iteration}"
+        active_ticket_id = None
+        for turn_index, query in enumerate(script["turns"]):
+            start = time.perf_counter()
+            error = None
+            try:
+                _, active_ticket_id = agent_module.get_agent_response(
+                    script["user_id"], session_id, query, active_ticket_id
+                )
+            except Exception as e:
+                error = repr(e)
+            records.append({
+                "script": script["name"],
+                "turn": turn_index,
+                "latency_ms": (time.perf_counter() - start) * 1000,
+                "error": error,
+            })
+    return records
+
+
+def summarize(
+    records: List[Dict[str, Any]],
+    wall_s: float,
+    pool_samples: List[int],
+    pool_stats: Dict[str, Any],
+    routing: Dict[str, Any]
+) -> Dict[str, Any]:
+    """Aggregates the turn records and pool samples into the final report."""
+    latencies = [r["latency_ms"] for r in records if not r["error"]]
+    maxconn = pool_stats["maxconn"] or 1
+    return {
+        "turns": len(records),
+        "errors": sum(1 for r in records if r["error"]),
+        "wall_s": wall_s,
+        "turns_per_sec": len(records) / wall_s if wall_s else 0.0,
+        "latency_ms": {
+            "p50": percentile(latencies, 50),
+            "p95": percentile(latencies, 95),
+            "p99": percentile(latencies, 99),
+            "max": max(latencies, default=0.0),
+        },
+        "pool": {
+            "maxconn": pool_stats["maxconn"],
+            "peak_in_use": pool_stats["peak_in_use"],
+            "mean_utilization": (sum(pool_samples) / len(pool_samples) / maxconn) if pool_samples else 0.0,
+            "saturated_share": (sum(1 for s in pool_samples if s >= maxconn) / len(pool_samples)) if pool_samples else 0.0,
+            "exhausted_checkouts": pool_stats["exhausted"],
+        },
+        "routing": routing,
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    latency = report["latency_ms"]
+    pool_report = report["pool"]
+    print(f"Turns:          {report['turns']} ({report['errors']} errors) in {report['wall_s']:.1f}s")
+    print(f"Throughput:     {report['turns_per_sec']:.2f} turns/sec")
+    print(f"Latency (ms):   p50={latency['p50']:.0f}  p95={latency['p95']:.0f}  p99={latency['p99']:.0f}  max={latency['max']:.0f}")
+    print(
+        f"DB pool:        peak {pool_report['peak_in_use']}/{pool_report['maxconn']} in use, "
+        f"mean utilization {pool_report['mean_utilization']:.0%}, "
+        f"saturated {pool_report['saturated_share']:.0%} of the time, "
+        f"{pool_report['exhausted_checkouts']} exhausted checkouts"
+    )
+    routing = report["routing"]
+    shares = ", ".join(f"{tier} {share:.0%}" for tier, share in routing["share"].items())
+    saved = routing["estimated_saved_ms"]
+    print(f"Model tiers:    {shares}" + (f" (~{saved / 1000:.1f}s saved vs. all-large)" if saved is not None else ""))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Replay conversation scripts against the agent at N concurrent sessions.")
+    parser.add_argument("--scripts", default=DEFAULT_SCRIPTS_PATH, help="JSON file with conversation scripts.")
+    parser.add_argument("--sessions", type=int, default=10, help="Number of concurrent virtual sessions.")
+    parser.add_argument("--iterations", type=int, default=1, help="Times each session replays its script.")
+    parser.add_argument("--no-fake-groq", dest="fake_groq", action="store_false", help="Use the real Groq API from .env.")
+    parser.add_argument("--latency-ms", type=float, default=150.0, help="Fake server time to first token.")
+    parser.add_argument("--tokens-per-sec", type=float, default=250.0, help="Fake server generation rate.")
+    parser.add_argument("--max-p95-ms", type=float, help="Exit non-zero if the p95 turn latency exceeds this value.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    args = parser.parse_args()
+
+    with open(args.scripts, "r", encoding="utf-8") as f:
+        scripts = json.load(f)
+
+    if args.fake_groq:
+        config = fake_groq_server.FakeGroqConfig(args.latency_ms, args.tokens_per_sec)
+        server = fake_groq_server.start_server(port=0, config=config)
+        # The Groq SDK reads GROQ_BASE_URL when no base_url is passed explicitly.
+        os.environ["GROQ_BASE_URL"] = f"http://127.0.0.1:{server.server_address[1]}"
+        os.environ.setdefault("GROQ_API_KEY", "fake-key")
+
+    # Imported late so the agent picks up the environment configured above.
+    import agent
+    import database as db
+    import model_router
+
+    run_id = uuid.uuid4().hex[:8]
+    monitor = PoolMonitor(db)
+    monitor.start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessions) as executor:
+        futures = [
+            executor.submit(run_session, agent, scripts[i % len(scripts)], run_id, i, args.iterations)
+            for i in range(args.sessions)
+        ]
+        records = [record for future in futures for record in future.result()]
+    wall_s = time.perf_counter() - start
+    monitor.stop()
+
+    report = summarize(records, wall_s, monitor.samples, db.get_pool_stats(), model_router.routing_stats.snapshot())
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+    if args.max_p95_ms is not None and report["latency_ms"]["p95"] > args.max_p95_ms:
+        print(f"FAIL: p95 latency {report['latency_ms']['p95']:.0f}ms exceeds {args.max_p95_ms:.0f}ms.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
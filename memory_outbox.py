@@ -0,0 +1,379 @@
+# memory_outbox.py
+
+"""
+Durable outbox that takes conversation memory writes off the critical path.
+
+Saving a turn used to mean two synchronous graph commits before the answer was
+returned. With the outbox, `enqueue` only appends the message to a local
+SQLite log (WAL mode, one small insert) and returns; a background writer
+thread drains the log in batches and commits each batch to Apache AGE in a
+single transaction. Rows are deleted from the log only after the graph commit
+succeeded, so a crash or restart never loses a message: leftover rows are
+replayed when the outbox starts again. Delivery is at-least-once: a crash
+between the graph commit and the log cleanup can write a batch twice.
+
+A batch that fails `MEMORY_OUTBOX_MAX_ATTEMPTS` times in a row, or once with
+a permanent error, is written one message at a time. A message that fails
+alone with an error the writer classifies as permanent (`is_permanent`, e.g.
+bad agtype) is moved to the `dead_letter` table of the log, so one poison
+message cannot stop the graph writes of every session in the process. Every
+other error (an outage, a timeout, a lock conflict) is retried, however
+often it happens, so a message is never dropped because the graph was down.
+
+Messages that are queued but not yet in the graph are kept in memory per
+session (`pending`), so reads can merge them and a session always sees its
+own writes. Every message gets its timestamp at enqueue time, strictly
+increasing within a session, so the graph order matches the order in which
+messages were produced rather than when the batch was written. Messages of
+the same session written by other processes can still share a millisecond,
+so every message also gets a random `message_id`; (timestamp, message_id)
+orders messages uniquely (see the summary watermark in `database.py`).
+
+Each app process needs its own log file: two processes sharing one would
+replay each other's messages and delete rows the other has not written yet.
+`MEMORY_OUTBOX_PATH` is therefore only the base name. On start the outbox
+claims the first free slot, `memory_outbox.sqlite3`, `memory_outbox.1.sqlite3`,
+... by taking an exclusive lock on the slot's `.lock` file, held until the
+process exits. Uvicorn workers, the Streamlit app and scripts that share a
+directory each get their own file, and a restarted process takes over (and
+replays) the file of one that crashed. If no slot of the
+`MEMORY_OUTBOX_MAX_SLOTS` is free, `start` fails instead of sharing one.
+"""
+
+# Standard library imports
+import atexit
+import fcntl
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+MEMORY_OUTBOX_PATH = os.getenv("MEMORY_OUTBOX_PATH", "outbox/memory_outbox.sqlite3")
+MEMORY_OUTBOX_BATCH_SIZE = int(os.getenv("MEMORY_OUTBOX_BATCH_SIZE", "100"))
+# How long the writer waits to collect more messages into a batch.
+MEMORY_OUTBOX_FLUSH_INTERVAL_S = float(os.getenv("MEMORY_OUTBOX_FLUSH_INTERVAL_S", "0.05"))
+# "normal" survives process crashes; "full" also fsyncs every insert to survive power loss.
+MEMORY_OUTBOX_SYNCHRONOUS = os.getenv("MEMORY_OUTBOX_SYNCHRONOUS", "normal").upper()
+# Processes that can hold an outbox file in the same directory at once.
+MEMORY_OUTBOX_MAX_SLOTS = int(os.getenv("MEMORY_OUTBOX_MAX_SLOTS", "64"))
+MAX_RETRY_DELAY_S = 5.0
+# Failed attempts of the same batch before it is written message by message.
+MEMORY_OUTBOX_MAX_ATTEMPTS = int(os.getenv("MEMORY_OUTBOX_MAX_ATTEMPTS", "5"))
+
+
+def new_message_id() -> str:
+    """Returns a unique message ID, the tie-breaker of messages with the same timestamp."""
+    return uuid.uuid4().hex
+
+
+def slot_path(base_path: str, slot: int) -> str:
+    """Returns the log file of an outbox slot (slot 0 is the base path itself)."""
+    if slot == 0:
+        return base_path
+    stem, extension = os.path.splitext(base_path)
+    return f"{stem}.{slot}{extension}"
+
+
+def claim_slot(base_path: str, max_slots: int = MEMORY_OUTBOX_MAX_SLOTS):
+    """Locks the first free outbox slot of this directory for the lifetime of the process.
+
+    Args:
+        base_path (str): `MEMORY_OUTBOX_PATH`.
+        max_slots (int, optional): The number of slots to try.
+
+    Returns:
+        (str, file): The slot's log file and its open lock file. The lock is
+        released when the lock file is closed or the process exits.
+
+    Raises:
+        RuntimeError: If every slot is held by another process.
+    """
+    for slot in range(max_slots):
+        path = slot_path(base_path, slot)
+        lock_file = open(path + ".lock", "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            continue
+        return path, lock_file
+    raise RuntimeError(f"All {max_slots} memory outbox slots of {base_path} are in use by other processes.")
+
+
+class MemoryOutbox:
+    """A SQLite-backed queue of graph messages with a batching writer thread."""
+
+    def __init__(
+        self,
+        path: str,
+        write_batch: Callable[[List[Dict[str, Any]]], bool],
+        is_permanent: Optional[Callable[[Exception], bool]] = None,
+        on_dead_letter: Optional[Callable[[Dict[str, Any]], None]] = None,
+        batch_size: int = MEMORY_OUTBOX_BATCH_SIZE,
+        flush_interval_s: float = MEMORY_OUTBOX_FLUSH_INTERVAL_S
+    ):
+        """Initializes the outbox. Call `start` before enqueuing.
+
+        Args:
+            path (str): The base name of the SQLite file holding queued
+                messages; `start` claims a free slot of it (see `claim_slot`).
+            write_batch (Callable[[List[Dict[str, Any]]], bool]): Commits a
+                batch of messages to the graph in one transaction and returns
+                True on success, or raises. Each message has 'user_id',
+                'session_id', 'author', 'text', 'timestamp' and 'message_id'.
+            is_permanent (Optional[Callable[[Exception], bool]], optional):
+                Returns True for errors raised by `write_batch` that no retry
+                can fix; a message failing alone with one is dead-lettered.
+                Without it, every failure is retried.
+            on_dead_letter (Optional[Callable[[Dict[str, Any]], None]], optional):
+                Called with every dead-lettered message, e.g. to drop it from
+                caches that assumed it would reach the graph.
+            batch_size (int, optional): The maximum messages per transaction.
+            flush_interval_s (float, optional): How long to wait for more
+                messages before writing a partial batch.
+        """
+        self.base_path = path
+        self.path = path
+        self.write_batch = write_batch
+        self.is_permanent = is_permanent
+        self.on_dead_letter = on_dead_letter
+        self.batch_size = batch_size
+        self.flush_interval_s = flush_interval_s
+        self._db: Optional[sqlite3.Connection] = None
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._drained = threading.Condition(self._lock)
+        self._thread: Optional[threading.Thread] = None
+        self._lock_file = None
+        self.written = 0
+        self.failed_batches = 0
+        self.dead_lettered = 0
+
+    def start(self) -> None:
+        """Opens the log, reloads messages left by a previous run and starts the writer."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            directory = os.path.dirname(self.base_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.path, self._lock_file = claim_slot(self.base_path)
+            # Autocommit mode: every insert/delete is its own short transaction.
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL;")
+            self._db.execute(f"PRAGMA synchronous={'FULL' if MEMORY_OUTBOX_SYNCHRONOUS == 'FULL' else 'NORMAL'};")
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS outbox (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id NOT NULL,  -- No type affinity: keeps ints and strings as given
+                    session_id TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    message_id TEXT
+                );
+                """
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(outbox);")]
+            if "message_id" not in columns:
+                # Logs written before messages had IDs; their rows get one on replay.
+                self._db.execute("ALTER TABLE outbox ADD COLUMN message_id TEXT;")
+            # Messages the graph rejected, kept for inspection (see `_write_one_by_one`).
+            self._db.execute(
+                """
+                CREATE TABLE IF NOT EXISTS dead_letter (
+                    id INTEGER PRIMARY KEY,
+                    user_id NOT NULL,
+                    session_id TEXT NOT NULL,
+                    author TEXT NOT NULL,
+                    text TEXT NOT NULL,
+                    timestamp INTEGER NOT NULL,
+                    message_id TEXT,
+                    error TEXT,
+                    failed_at INTEGER NOT NULL
+                );
+                """
+            )
+            columns = [row[1] for row in self._db.execute("PRAGMA table_info(dead_letter);")]
+            if "message_id" not in columns:
+                self._db.execute("ALTER TABLE dead_letter ADD COLUMN message_id TEXT;")
+            rows = self._db.execute(
+                "SELECT id, user_id, session_id, author, text, timestamp, message_id FROM outbox ORDER BY id;"
+            ).fetchall()
+            for row in rows:
+                message = dict(zip(("id", "user_id", "session_id", "author", "text", "timestamp", "message_id"), row))
+                message["message_id"] = message["message_id"] or new_message_id()
+                self._track(message)
+            if rows:
+                print(f"INFO: Replaying {len(rows)} queued memory writes from {self.path}.")
+            self._thread = threading.Thread(target=self._run, name="memory-outbox-writer", daemon=True)
+            self._thread.start()
+        atexit.register(self.flush, timeout_s=5.0)
+        self._wake.set()
+
+    def enqueue(self, user_id: Any, session_id: str, text: str, author: str) -> Dict[str, Any]:
+        """Durably queues a message for the graph and returns it with its timestamp and message ID."""
+        with self._lock:
+            queued = self._pending.get(session_id)
+            timestamp = int(time.time() * 1000)
+            if queued:
+                timestamp = max(timestamp, queued[-1]["timestamp"] + 1)
+            message = {
+                "user_id": user_id,
+                "session_id": session_id,
+                "author": author,
+                "text": text,
+                "timestamp": timestamp,
+                "message_id": new_message_id(),
+            }
+            cursor = self._db.execute(
+                "INSERT INTO outbox (user_id, session_id, author, text, timestamp, message_id) VALUES (?, ?, ?, ?, ?, ?);",
+                (message["user_id"], session_id, author, text, timestamp, message["message_id"])
+            )
+            message["id"] = cursor.lastrowid
+            self._track(message)
+        self._wake.set()
+        return message
+
+    def pending(self, session_id: str) -> List[Dict[str, Any]]:
+        """Returns the session's messages that are queued but not yet in the graph."""
+        with self._lock:
+            return [dict(m) for m in self._pending.get(session_id, ())]
+
+    def flush(self, session_id: Optional[str] = None, timeout_s: Optional[float] = None) -> bool:
+        """Blocks until the queued messages are in the graph. Returns False on timeout.
+
+        Args:
+            session_id (Optional[str], optional): Waits only for this
+                session's messages, not for the backlog of other sessions.
+                None waits for the whole queue.
+            timeout_s (Optional[float], optional): The longest time to wait.
+        """
+        self._wake.set()
+        with self._lock:
+            if session_id is None:
+                return self._drained.wait_for(lambda: not self._queue, timeout=timeout_s)
+            return self._drained.wait_for(lambda: session_id not in self._pending, timeout=timeout_s)
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the queue depth and writer counters."""
+        with self._lock:
+            return {
+                "queued": len(self._queue),
+                "written": self.written,
+                "failed_batches": self.failed_batches,
+                "dead_lettered": self.dead_lettered,
+            }
+
+    def _track(self, message: Dict[str, Any]) -> None:
+        # Caller holds the lock.
+        self._queue.append(message)
+        self._pending.setdefault(message["session_id"], []).append(message)
+
+    def _run(self) -> None:
+        retry_delay = 0.0
+        attempts = 0
+        while True:
+            self._wake.wait()
+            # Give concurrent turns a moment to add to the batch.
+            time.sleep(self.flush_interval_s + retry_delay)
+            with self._lock:
+                batch = [self._queue[i] for i in range(min(self.batch_size, len(self._queue)))]
+                if not batch:
+                    self._wake.clear()
+                    continue
+
+            permanent = False
+            if attempts >= MEMORY_OUTBOX_MAX_ATTEMPTS:
+                # The head batch keeps failing: find the messages that cannot be written.
+                ok = self._write_one_by_one(batch)
+            else:
+                ok, error = self._write(batch)
+                if ok:
+                    self._remove_head(batch)
+                else:
+                    permanent = self._permanent(error)
+            if not ok:
+                # A permanent error will not go away: look for its message right away.
+                attempts = MEMORY_OUTBOX_MAX_ATTEMPTS if permanent else attempts + 1
+                with self._lock:
+                    self.failed_batches += 1
+                retry_delay = min(MAX_RETRY_DELAY_S, max(0.1, retry_delay * 2))
+                continue
+            retry_delay = 0.0
+            attempts = 0
+
+    def _write(self, batch: List[Dict[str, Any]]) -> Tuple[bool, Optional[Exception]]:
+        """Calls the writer and returns whether it succeeded, with the raised error if any."""
+        try:
+            return bool(self.write_batch(batch)), None
+        except Exception as e:
+            print(f"Warning: Memory outbox batch failed: {e}")
+            return False, e
+
+    def _permanent(self, error: Optional[Exception]) -> bool:
+        """Returns True if `error` cannot be fixed by retrying (see `is_permanent`)."""
+        return error is not None and self.is_permanent is not None and self.is_permanent(error)
+
+    def _write_one_by_one(self, batch: List[Dict[str, Any]]) -> bool:
+        """Writes a batch message by message, dead-lettering messages the graph rejects.
+
+        A message that fails alone with a permanent error is moved to the
+        `dead_letter` table so it no longer blocks every session behind it.
+        Any other failure may be an outage: the message stays at the head
+        and False is returned, so it is retried.
+        """
+        for message in batch:
+            ok, error = self._write([message])
+            if not ok:
+                if not self._permanent(error):
+                    return False
+                print(f"Warning: Moving memory outbox message {message['id']} of session "
+                      f"{message['session_id']} to the dead-letter table: {error}")
+                self._remove_head([message], error=f"{type(error).__name__}: {error}")
+                if self.on_dead_letter is not None:
+                    self.on_dead_letter(message)
+                continue
+            self._remove_head([message])
+        return True
+
+    def _remove_head(self, messages: List[Dict[str, Any]], error: Optional[str] = None) -> None:
+        """Removes written (or, with `error`, dead-lettered) messages from the head of the queue."""
+        with self._lock:
+            if error is not None:
+                # The message ID comes from memory: rows of old logs have none in the outbox.
+                self._db.execute(
+                    "INSERT INTO dead_letter (id, user_id, session_id, author, text, timestamp, message_id, error, failed_at) "
+                    "SELECT id, user_id, session_id, author, text, timestamp, ?, ?, ? FROM outbox WHERE id = ?;",
+                    (messages[0]["message_id"], error, int(time.time() * 1000), messages[0]["id"])
+                )
+            # The messages are the head of the queue, which is in id order.
+            self._db.execute("DELETE FROM outbox WHERE id <= ?;", (messages[-1]["id"],))
+            session_drained = False
+            for message in messages:
+                self._queue.popleft()
+                queued = self._pending[message["session_id"]]
+                queued.pop(0)
+                if not queued:
+                    del self._pending[message["session_id"]]
+                    session_drained = True
+            if error is None:
+                self.written += len(messages)
+            else:
+                self.dead_lettered += len(messages)
+            # Wakes the flushes of sessions that are now fully written (and of the whole queue).
+            if session_drained:
+                self._drained.notify_all()
@@ -0,0 +1,31 @@
+-- Migration 001: half-precision and binary-quantized storage for pg_docs embeddings.
+-- Requires pgvector 0.7.0 or later (halfvec, bit and binary_quantize).
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/001_quantized_embeddings.sql
+
+BEGIN;
+
+-- Half-precision copy of the embeddings: 2 bytes per dimension instead of 4.
+ALTER TABLE pg_docs ADD COLUMN IF NOT EXISTS embedding_half halfvec(384);
+UPDATE pg_docs SET embedding_half = embedding::halfvec(384)
+WHERE embedding_half IS NULL AND embedding IS NOT NULL;
+
+-- The search query orders by cosine distance (<=>), but the original index was
+-- built with vector_l2_ops and could not serve it. Rebuild it with cosine ops.
+DROP INDEX IF EXISTS pg_docs_embedding_idx;
+CREATE INDEX IF NOT EXISTS pg_docs_embedding_cosine_idx ON pg_docs USING hnsw (embedding vector_cosine_ops);
+
+-- VECTOR_SEARCH_MODE=half: HNSW over the halfvec column.
+CREATE INDEX IF NOT EXISTS pg_docs_embedding_half_idx ON pg_docs USING hnsw (embedding_half halfvec_cosine_ops);
+
+-- VECTOR_SEARCH_MODE=binary: HNSW over the 1-bit-per-dimension sign quantization
+-- (48 bytes per row). Candidates found by Hamming distance are re-scored with
+-- the halfvec column. The query must use exactly this expression.
+CREATE INDEX IF NOT EXISTS pg_docs_embedding_bit_idx ON pg_docs
+    USING hnsw ((binary_quantize(embedding_half)::bit(384)) bit_hamming_ops);
+
+COMMIT;
+
+-- Once VECTOR_SEARCH_MODE=half or binary is in use, the float32 column can be
+-- dropped to reclaim its storage (VECTOR_SEARCH_MODE=full then stops working):
+--     ALTER TABLE pg_docs DROP COLUMN embedding;
@@ -0,0 +1,37 @@
+-- Migration 002: PostgreSQL major version of each knowledge base document, and
+-- the version each customer runs, for version-filtered retrieval.
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/002_doc_versions.sql
+
+BEGIN;
+
+ALTER TABLE pg_docs ADD COLUMN IF NOT EXISTS pg_version SMALLINT;
+-- Documentation URLs look like https://www.postgresql.org/docs/15/...
+UPDATE pg_docs SET pg_version = COALESCE(substring(url FROM '/docs/([0-9]+)/')::smallint, 15)
+WHERE pg_version IS NULL;
+ALTER TABLE pg_docs ALTER COLUMN pg_version SET NOT NULL;
+CREATE INDEX IF NOT EXISTS pg_docs_pg_version_idx ON pg_docs (pg_version);
+
+CREATE TABLE IF NOT EXISTS customers (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT,
+    pg_version SMALLINT
+);
+
+-- One partial HNSW index per documented version: a filtered search is then a
+-- plain index scan over that version's documents only, with no recall loss.
+-- ingest_data.py creates the index for versions added later.
+DO $$
+DECLARE
+    v SMALLINT;
+BEGIN
+    FOR v IN SELECT DISTINCT pg_version FROM pg_docs LOOP
+        EXECUTE format(
+            'CREATE INDEX IF NOT EXISTS pg_docs_embedding_v%s_idx ON pg_docs '
+            'USING hnsw (embedding vector_cosine_ops) WHERE pg_version = %s', v, v
+        );
+    END LOOP;
+END
+$$;
+
+COMMIT;
@@ -0,0 +1,20 @@
+-- Migration 003: server-side conversation sessions.
+-- Each conversation gets its own session ID (a UUID) instead of one fixed
+-- session per demo user, and per-session state such as the active ticket is
+-- kept here so any app or API worker can serve the next turn.
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/003_conversation_sessions.sql
+
+CREATE TABLE IF NOT EXISTS conversation_sessions (
+    session_id VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    active_ticket_id VARCHAR(50),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS conversation_sessions_user_idx ON conversation_sessions (user_id, updated_at DESC);
+
+-- Register the seeded demo conversation (see utils.py).
+INSERT INTO conversation_sessions (session_id, user_id) VALUES ('session_user_1', 1)
+ON CONFLICT (session_id) DO NOTHING;
@@ -0,0 +1,51 @@
+-- Migration 004: server-generated ticket IDs and an append-only ticket log.
+-- New tickets get IDs from a sequence (TICKET-000001, ...) instead of a
+-- truncated UUID generated in Python, so IDs never collide. The `log` TEXT
+-- column is split into one `ticket_events` row per line: appending an entry
+-- is a small insert instead of a rewrite of the whole ticket row, and the
+-- last N entries are an index range scan.
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/004_ticket_events.sql
+
+BEGIN;
+
+-- Random IDs from before this migration have 8 hex digits; sequence IDs have
+-- 6 digits until the millionth ticket, so the two schemes cannot meet in practice.
+CREATE SEQUENCE IF NOT EXISTS ticket_number_seq;
+ALTER TABLE tickets
+    ALTER COLUMN ticket_id SET DEFAULT 'TICKET-' || lpad(nextval('ticket_number_seq')::text, 6, '0');
+
+CREATE TABLE IF NOT EXISTS ticket_events (
+    id BIGSERIAL PRIMARY KEY,
+    ticket_id VARCHAR(50) NOT NULL REFERENCES tickets (ticket_id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ticket_events_ticket_idx ON ticket_events (ticket_id, id);
+
+-- Move every non-empty log line into its own event. Lines written by the agent
+-- start with an ISO timestamp ("2025-10-26T10:00:00Z: ..."), which becomes the
+-- event time; other lines take the ticket's creation time.
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'tickets' AND column_name = 'log'
+    ) THEN
+        INSERT INTO ticket_events (ticket_id, created_at, entry)
+        SELECT t.ticket_id,
+               COALESCE((m.parts[1])::timestamp AT TIME ZONE 'UTC', t.created_at),
+               COALESCE(m.parts[2], btrim(l.line))
+        FROM tickets t
+        CROSS JOIN LATERAL regexp_split_to_table(t.log, E'\n') WITH ORDINALITY AS l (line, n)
+        LEFT JOIN LATERAL (
+            SELECT regexp_match(btrim(l.line), '^(\d{4}-\d{2}-\d{2}T[0-9:.]+Z?)\s*:\s*(.*)$') AS parts
+        ) m ON TRUE
+        WHERE btrim(l.line) <> ''
+        ORDER BY t.id, l.n;
+        ALTER TABLE tickets DROP COLUMN log;
+    END IF;
+END
+$$;
+
+COMMIT;
@@ -0,0 +1,19 @@
+-- Migration 005: stored embeddings of ticket descriptions.
+-- The agent used to re-embed the active ticket's description on every turn;
+-- now it is embedded once when the ticket is created and reused for
+-- retrieval. Resolved tickets are also searched for similar past issues.
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/005_ticket_embeddings.sql
+-- Then compute the vectors of existing tickets once:
+--     python3 -c "import database; print(database.backfill_ticket_embeddings())"
+
+BEGIN;
+
+ALTER TABLE tickets ADD COLUMN IF NOT EXISTS embedding VECTOR(384);
+
+-- Only resolved tickets are searched for known resolutions. The predicate must
+-- match database.RESOLVED_TICKET_STATUSES.
+CREATE INDEX IF NOT EXISTS tickets_resolved_embedding_idx ON tickets
+    USING hnsw (embedding vector_cosine_ops) WHERE status IN ('Resolved', 'Closed');
+
+COMMIT;
@@ -0,0 +1,10 @@
+-- Migration 006: pg_prewarm for the startup warm-up.
+-- With STARTUP_PG_PREWARM=true, `startup.py` loads the knowledge base table
+-- and its indexes (including the HNSW index) into shared buffers, so the
+-- first searches after a database restart do not read them from disk.
+-- Optional, and not part of schema.sql: pg_prewarm ships with PostgreSQL
+-- contrib, which some servers do not install or allow-list. Run this on new
+-- and existing databases that use the prewarm. Safe to run more than once:
+--     psql -d <database> -f migrations/006_pg_prewarm.sql
+
+CREATE EXTENSION IF NOT EXISTS pg_prewarm;
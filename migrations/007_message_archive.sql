@@ -0,0 +1,17 @@
+-- Migration 007: cold archive for expired conversation messages.
+-- `graph_retention.py` removes Message nodes older than the retention horizon
+-- from the graph in small batches and, in "archive" mode, copies them here in
+-- the same transaction.
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/007_message_archive.sql
+
+CREATE TABLE IF NOT EXISTS message_archive (
+    id BIGSERIAL PRIMARY KEY,
+    session_id VARCHAR(64) NOT NULL,
+    author TEXT,
+    text TEXT,
+    sent_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS message_archive_session_idx ON message_archive (session_id, sent_at);
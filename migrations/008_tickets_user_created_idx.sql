@@ -0,0 +1,13 @@
+-- Migration 008: composite index behind the per-user ticket listing.
+-- `get_tickets_page` (keyset pagination) and `get_ticket_summary` order a
+-- user's tickets by `created_at DESC, id DESC`; without this index existing
+-- databases scan and sort the whole tickets table for every ticket-history
+-- question. INCLUDE (status) lets the per-status counts run as an
+-- index-only scan.
+-- CREATE INDEX CONCURRENTLY does not block ticket writes but cannot run inside
+-- a transaction block, so this file has no BEGIN/COMMIT. Safe to run more than
+-- once (if an interrupted build left an INVALID index, drop it and rerun):
+--     psql -d <database> -f migrations/008_tickets_user_created_idx.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tickets_user_created_idx
+    ON tickets (user_id, created_at DESC, id DESC) INCLUDE (status);
@@ -0,0 +1,14 @@
+-- Migration 009: per-session turn lease.
+-- `agent.respond_in_session` claims the lease before a turn and releases it
+-- afterwards (`database.begin_session_turn` / `update_session`), so two API
+-- workers can never run turns of the same conversation at once. The lease
+-- expires after SESSION_TURN_LEASE_S in case a worker dies mid-turn.
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/009_session_turn_lease.sql
+
+BEGIN;
+
+ALTER TABLE conversation_sessions ADD COLUMN IF NOT EXISTS turn_token VARCHAR(32);
+ALTER TABLE conversation_sessions ADD COLUMN IF NOT EXISTS turn_lease_until TIMESTAMP WITH TIME ZONE;
+
+COMMIT;
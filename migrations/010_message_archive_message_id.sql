@@ -0,0 +1,9 @@
+-- Migration 010: message IDs in the message archive.
+-- `graph_retention.py` now archives each message with its `message_id`, the
+-- tie-breaker of messages with the same timestamp, so archived messages keep
+-- the (timestamp, message_id) order of the graph. Rows archived before this
+-- migration keep a NULL message_id.
+-- Safe to run more than once:
+--     psql -d <database> -f migrations/010_message_archive_message_id.sql
+
+ALTER TABLE message_archive ADD COLUMN IF NOT EXISTS message_id VARCHAR(32);
@@ -0,0 +1,171 @@
+# model_router.py
+
+"""
+Chooses how each agent turn's final response is produced.
+
+Not every turn needs the large synthesis model. The router picks one of three
+tiers per turn, based on the intent and the context that was gathered:
+
+- "template": answered locally without any LLM call (greetings, ticket status
+  lookups and unknown ticket IDs, where the answer is just the ticket fields).
+- "small": the fast 8B model, for short context-only answers such as listing
+  tickets or recapping the conversation, where no knowledge base synthesis is
+  needed.
+- "large": the 70B model, reserved for turns that must synthesize an answer
+  from knowledge base articles or carry a large context.
+
+`RoutingStats` counts the tier distribution and estimates the latency saved
+compared to sending every turn to the large model.
+"""
+
+# Standard library imports
+import os
+import re
+import threading
+from typing import Any, Dict, Optional
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+TIER_TEMPLATE = "template"
+TIER_SMALL = "small"
+TIER_LARGE = "large"
+
+# Context-only turns up to this size are answered by the small model.
+SMALL_MODEL_MAX_CONTEXT_CHARS = int(os.getenv("SMALL_MODEL_MAX_CONTEXT_CHARS", "4000"))
+
+# A ticket question is a pure status lookup if it asks for status/details and
+# not for a fix; those are answered from the ticket fields alone.
+STATUS_LOOKUP_PATTERN = re.compile(r"\b(status|update|progress|details?|state)\b", re.IGNORECASE)
+SOLUTION_PATTERN = re.compile(r"\b(how|why|fix|solve|solution|resolve|workaround|help)\b", re.IGNORECASE)
+
+# Patterns of the local intent fast path, used when the intent LLM is unavailable.
+TICKET_ID_PATTERN = re.compile(r"\b(T(?:ICKET)?-[A-Z0-9]+)\b", re.IGNORECASE)
+GREETING_PATTERN = re.compile(r"^\W*(hi|hello|hey|good (morning|afternoon|evening))\W*$", re.IGNORECASE)
+CREATE_TICKET_PATTERN = re.compile(r"\b(create|open|file|raise)\b.*\bticket\b|^\W*(yes|yeah|sure)\b", re.IGNORECASE)
+TICKET_HISTORY_PATTERN = re.compile(r"\b(my|all|last|latest|recent)\b.*\btickets?\b", re.IGNORECASE)
+
+GREETING_RESPONSE = (
+    "Hello! I'm your PostgreSQL support assistant. I can look up your tickets, "
+    "help troubleshoot database issues, or answer questions about PostgreSQL. How can I help you today?"
+)
+
+
+def classify_intent_locally(user_query: str) -> Dict[str, Any]:
+    """Classifies a query with keyword rules, without calling an LLM.
+
+    This is the degraded fast path used when the intent model fails or its
+    circuit breaker is open. It recognizes explicit ticket IDs, ticket
+    creation and listing requests, and greetings; anything else is treated as
+    a general question so the knowledge base is still searched.
+
+    Args:
+        user_query (str): The raw text input from the user.
+
+    Returns:
+        Dict[str, Any]: A classification with the same shape as the LLM's
+        ('intent' and 'ticket_id').
+    """
+    ticket_match = TICKET_ID_PATTERN.search(user_query)
+    if ticket_match:
+        return {"intent": "ticket_inquiry", "ticket_id": ticket_match.group(1).upper()}
+    if CREATE_TICKET_PATTERN.search(user_query):
+        return {"intent": "ticket_creation_request", "ticket_id": None}
+    if TICKET_HISTORY_PATTERN.search(user_query):
+        return {"intent": "ticket_history_inquiry", "ticket_id": None}
+    if GREETING_PATTERN.match(user_query):
+        return {"intent": "greeting", "ticket_id": None}
+    return {"intent": "general_question", "ticket_id": None}
+
+
+def is_status_lookup(user_query: str) -> bool:
+    """Returns True if a ticket question only asks for the ticket's status or details."""
+    return bool(STATUS_LOOKUP_PATTERN.search(user_query)) and not SOLUTION_PATTERN.search(user_query)
+
+
+def choose_tier(context: str, has_knowledge_chunks: bool) -> str:
+    """Selects the model tier for the synthesis step of a turn.
+
+    Template answers are decided earlier in the pipeline (they skip retrieval
+    entirely); this function chooses between the two LLM tiers.
+
+    Args:
+        context (str): The context that will be sent to the model.
+        has_knowledge_chunks (bool): Whether knowledge base articles were retrieved.
+
+    Returns:
+        str: `TIER_SMALL` or `TIER_LARGE`.
+    """
+    if not has_knowledge_chunks and len(context) <= SMALL_MODEL_MAX_CONTEXT_CHARS:
+        return TIER_SMALL
+    return TIER_LARGE
+
+
+def render_ticket_status(ticket: Dict[str, Any]) -> str:
+    """Renders a ticket's fields as the answer to a status lookup."""
+    events = ticket.get("events") or []
+    response = (
+        f"Here are the details for ticket **{ticket['ticket_id']}**:\n"
+        f"- **Status:** {ticket.get('status') or 'Unknown'}\n"
+        f"- **Description:** {ticket.get('description') or 'No description provided.'}\n"
+    )
+    if events:
+        latest = events[-1]
+        response += f"- **Latest update:** {latest['at'][:16].replace('T', ' ')}: {latest['entry']}\n"
+    response += "\nWould you like help troubleshooting this issue?"
+    return response
+
+
+def render_ticket_not_found(ticket_id: str) -> str:
+    """Renders the answer for a ticket ID that does not exist."""
+    return (
+        f"I couldn't find a ticket with ID {ticket_id}. Please double-check the ID, "
+        "or ask me to list your tickets."
+    )
+
+
+class RoutingStats:
+    """Thread-safe counters of routed turns and their response latency per tier."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = {TIER_TEMPLATE: 0, TIER_SMALL: 0, TIER_LARGE: 0}
+        self._latency_ms = {TIER_TEMPLATE: 0.0, TIER_SMALL: 0.0, TIER_LARGE: 0.0}
+
+    def record(self, tier: str, latency_ms: float) -> None:
+        """Records one turn answered by `tier` in `latency_ms`."""
+        with self._lock:
+            self._counts[tier] += 1
+            self._latency_ms[tier] += latency_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the tier distribution, mean latencies and estimated savings.
+
+        The saving is estimated as the mean latency of large-model responses
+        multiplied by the number of turns routed elsewhere, minus the time
+        those turns actually took. It is None until a large-model response
+        has been observed.
+        """
+        with self._lock:
+            counts = dict(self._counts)
+            latency = dict(self._latency_ms)
+        total = sum(counts.values())
+        mean_ms = {tier: (latency[tier] / counts[tier] if counts[tier] else None) for tier in counts}
+        saved_ms: Optional[float] = None
+        if mean_ms[TIER_LARGE] is not None:
+            rerouted = counts[TIER_TEMPLATE] + counts[TIER_SMALL]
+            saved_ms = mean_ms[TIER_LARGE] * rerouted - latency[TIER_TEMPLATE] - latency[TIER_SMALL]
+        return {
+            "turns": total,
+            "counts": counts,
+            "share": {tier: (count / total if total else 0.0) for tier, count in counts.items()},
+            "mean_ms": mean_ms,
+            "estimated_saved_ms": saved_ms,
+        }
+
+
+routing_stats = RoutingStats()
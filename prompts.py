@@ -0,0 +1,155 @@
+# prompts.py
+
+"""
+Versioned registry of the agent's LLM prompts.
+
+Every prompt is a static system prompt followed by a user message in which
+the variable parts (conversation context, the user's query) come last. The
+system prompts are normalized once at import (dedented and stripped), so the
+bytes sent to the provider are identical on every call and across processes.
+Providers with automatic prompt caching (Groq on supported models, OpenAI-
+compatible servers) then reuse the cached prefix instead of processing it
+again; the cache hits show up as `cached_tokens` in the trace spans.
+
+Each prompt has a `version`, which must be bumped whenever its text changes,
+and a short fingerprint of its static part. Both are recorded on the LLM span
+of every call together with estimated static/dynamic token counts, so the
+effect of a prompt change on size and cache hits can be measured with
+`trace_report.py`.
+"""
+
+# Standard library imports
+import hashlib
+import textwrap
+from typing import Any, Dict, Tuple
+
+# Local application/library specific imports
+import tracing
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximates a token count as one token per four characters."""
+    return max(1, len(text) // 4) if text else 0
+
+
+def _text(text: str) -> str:
+    return textwrap.dedent(text).strip()
+
+
+class Prompt:
+    """A named, versioned prompt with a byte-stable system part."""
+
+    def __init__(self, name: str, version: str, system: str, user_template: str):
+        self.name = name
+        self.version = version
+        self.system = _text(system)
+        self.user_template = user_template
+        self.fingerprint = hashlib.sha256(self.system.encode("utf-8")).hexdigest()[:12]
+        self.system_tokens = estimate_tokens(self.system)
+
+    @property
+    def id(self) -> str:
+        return f"{self.name}@{self.version}"
+
+    def render(self, **values: Any) -> Tuple[str, str]:
+        """Returns the (system prompt, user prompt) pair for one call.
+
+        Called inside the LLM's trace span, it also records the prompt ID,
+        fingerprint and the estimated static and dynamic token counts.
+        """
+        user = self.user_template.format(**values)
+        tracing.set_attributes(
+            prompt=self.id,
+            prompt_fingerprint=self.fingerprint,
+            static_tokens_est=self.system_tokens,
+            dynamic_tokens_est=estimate_tokens(user),
+        )
+        return self.system, user
+
+
+REGISTRY: Dict[str, Prompt] = {}
+
+
+def register(prompt: Prompt) -> Prompt:
+    if prompt.name in REGISTRY:
+        raise ValueError(f"Prompt '{prompt.name}' is already registered.")
+    REGISTRY[prompt.name] = prompt
+    return prompt
+
+
+def get(name: str) -> Prompt:
+    return REGISTRY[name]
+
+
+def describe() -> str:
+    """Returns one line per registered prompt with its version, fingerprint and static size."""
+    return "\n".join(
+        f"{p.id:<16} {p.fingerprint}  ~{p.system_tokens} static tokens"
+        for p in REGISTRY.values()
+    )
+
+
+# --- PROMPTS ---
+
+INTENT = register(Prompt(
+    "intent", "2",
+    system="""
+    You are an expert intent classification system. Your task is to analyze a user's query
+    and output a JSON object with two keys: "intent" and "ticket_id".
+    The "intent" can be one of:
+    - "ticket_inquiry": The user is asking about a SPECIFIC ticket and provides a ticket ID.
+    - "ticket_history_inquiry": The user is asking about their tickets in general (e.g., "what's my ticket status?", "my last ticket", "list all my tickets").
+    - "ticket_creation_request": The user is explicitly asking to create a ticket (e.g., "can you create a ticket?", "yes, please create one").
+    - "new_issue": The user is describing a new problem for the first time.
+    - "general_question": The user is asking a general informational question.
+    - "greeting": A simple greeting.
+
+    The "ticket_id" should be the extracted ticket ID if the intent is "ticket_inquiry", otherwise it must be null.
+    You must always respond with ONLY the JSON object and nothing else.
+    """,
+    user_template='Analyze the following user\'s query: "{user_query}"',
+))
+
+REFINEMENT = register(Prompt(
+    "refinement", "2",
+    system="""
+    You are an expert at extracting concise technical search queries from user descriptions of problems. Respond with only the refined search query, no other text.
+    """,
+    user_template='Extract the core problem or keywords from the user\'s query: "{user_query}"',
+))
+
+# The instruction that used to follow the query in the user message is part of
+# the static system prompt now, so the user message ends with the query.
+SYNTHESIS = register(Prompt(
+    "synthesis", "2",
+    system="""
+    You are a helpful and personable expert PostgreSQL support agent. Your goal is to assist users by providing direct answers and solutions in a conversational way.
+
+    Your primary task is to answer the user's query based *only* on the information provided in the Context.
+
+    Here are your rules in order of priority:
+    1.  **List Tickets:** If the user asks for their tickets and the Context contains "The user's ticket history summary", you MUST list all the tickets under 'recent'. Start your response with a friendly phrase like "Here is a list of your tickets:" and format them clearly using a bulleted list. If 'total' is larger than the number of tickets listed, also state the total and the counts per status from 'by_status'.
+    2.  **Summarize Conversation:** If the user asks about their past questions (e.g., "what did I ask?") and the Context contains "The user's recent conversation history", you MUST summarize the 'user' messages from that history.
+    3.  **Summarize Single Tickets:** If the Context contains "Ticket Information" or "CURRENT ACTIVE TICKET CONTEXT", summarize the ticket's status and description for the user.
+    4.  **Answer from Knowledge Base (Provide Solutions, Not Just Links):** If the Context contains "Relevant Knowledge Base Articles", your main goal is to act as an expert who has read them.
+        - You MUST synthesize a direct answer by summarizing the key information and steps from the article 'content'.
+        - Explain the potential solutions to the user in your own words.
+        - **DO NOT just provide a list of links.** Your primary response must be the explanation.
+        - You MAY include the URL at the end of your explanation as a reference for the user to learn more, but the answer itself comes first.
+        - If the Context contains "Similar Resolved Tickets", you MAY mention that a similar issue was resolved before and how ('resolution').
+    5.  **Handle New Issues (Offer to Create a Ticket):** If the user describes a new issue and the provided articles do not seem to solve their specific problem, you MUST acknowledge this and then offer to create a ticket for them. For example: "I found some articles about server setup and authentication, but they might not solve your specific installation issue. Would you like me to create a ticket for this?"
+    6.  **Fallback:** If, after following all the rules above, you genuinely cannot find any relevant information in the context to answer the query, you should say: "I'm sorry, I couldn't find specific information on that topic in my knowledge base."
+    7.  **Style:** Never mention the words "Context" or "Knowledge Base" in your response. Be friendly and helpful.
+
+    The user message contains the Context between "---" lines, followed by the User's Query. Based ONLY on the context provided, generate a helpful and concise response according to your rules.
+    """,
+    user_template="Context:\n---\n{context}\n---\nUser's Query: {user_query}",
+))
+
+SUMMARY = register(Prompt(
+    "summary", "2",
+    system="""
+    You maintain a running summary of a customer support conversation about PostgreSQL. Merge the new messages into the existing summary. Keep the user's problems, error messages, ticket IDs, decisions and any solutions already given. Drop greetings and small talk. Write at most 120 words in plain prose. Respond with only the updated summary.
+    """,
+    user_template="Existing summary:\n{summary}\n\nNew messages:\n{transcript}",
+))
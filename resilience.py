@@ -0,0 +1,261 @@
+# resilience.py
+
+"""
+Building blocks that keep LLM call latency bounded when the provider degrades.
+
+- `call_with_retries`: retries retryable errors with jittered exponential
+  backoff, without ever exceeding an overall deadline.
+- `LatencyTracker`: a rolling window of recent call latencies, used to derive
+  the hedging delay from the observed p95.
+- `hedged_call`: starts a second, identical request if the first one has not
+  answered after a delay, and returns whichever finishes first.
+- `BoundedExecutor`: the thread pool of hedged calls; it refuses work instead
+  of queuing it, so a saturated pool never delays a request.
+- `CircuitBreaker`: stops calling a failing provider for a cool-down period so
+  callers can degrade immediately instead of waiting on timeouts.
+
+The module is provider-agnostic; `llm_client.py` wires it to the Groq SDK.
+"""
+
+# Standard library imports
+import contextvars
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Deque, Optional, TypeVar
+
+# Local application/library specific imports
+from tracing import percentile
+
+T = TypeVar("T")
+
+
+class DeadlineExceeded(Exception):
+    """Raised when a call cannot complete (or be retried) within its deadline."""
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling the provider while the circuit breaker is open."""
+
+
+def call_with_retries(
+    func: Callable[[float], T],
+    deadline_s: float,
+    is_retryable: Callable[[Exception], bool],
+    max_attempts: int = 3,
+    base_delay_s: float = 0.25,
+    max_delay_s: float = 2.0
+) -> T:
+    """Calls `func` until it succeeds, a non-retryable error occurs or time runs out.
+
+    Backoff uses "full jitter": each wait is uniformly random between zero and
+    an exponentially growing cap, which spreads retries from many concurrent
+    sessions instead of synchronizing them.
+
+    Args:
+        func (Callable[[float], T]): The call to make. It receives the number
+            of seconds left before the deadline and should use it as its timeout.
+        deadline_s (float): The total time budget for all attempts, in seconds.
+        is_retryable (Callable[[Exception], bool]): Decides whether an error
+            is transient (timeouts, 429, 5xx) and worth retrying.
+        max_attempts (int, optional): The maximum number of attempts. Defaults to 3.
+        base_delay_s (float, optional): The backoff cap of the first retry. Defaults to 0.25.
+        max_delay_s (float, optional): The largest backoff cap. Defaults to 2.0.
+
+    Returns:
+        T: The result of the first successful attempt.
+
+    Raises:
+        DeadlineExceeded: If the budget is used up before an attempt succeeds.
+        Exception: The last error, if it is not retryable or attempts run out.
+    """
+    deadline = time.monotonic() + deadline_s
+    attempt = 0
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Deadline of {deadline_s:.1f}s exceeded after {attempt} attempts.")
+        attempt += 1
+        try:
+            return func(remaining)
+        except Exception as e:
+            if attempt >= max_attempts or not is_retryable(e):
+                raise
+            delay = random.uniform(0, min(max_delay_s, base_delay_s * 2 ** (attempt - 1)))
+            if time.monotonic() + delay >= deadline:
+                raise DeadlineExceeded(f"No time left to retry after: {e!r}") from e
+            print(f"Warning: Retrying LLM call after {delay:.2f}s (attempt {attempt} failed: {e!r}).")
+            time.sleep(delay)
+
+
+class LatencyTracker:
+    """Keeps the most recent call latencies to estimate a percentile."""
+
+    def __init__(self, window: int = 200):
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, latency_s: float) -> None:
+        with self._lock:
+            self._samples.append(latency_s)
+
+    def percentile(self, pct: float, default: float) -> float:
+        """Returns the `pct` percentile of the window, or `default` with fewer than 20 samples."""
+        with self._lock:
+            samples = list(self._samples)
+        if len(samples) < 20:
+            return default
+        return percentile(samples, pct)
+
+
+class BoundedExecutor:
+    """A thread pool that runs a task only if a worker is free, never queuing it."""
+
+    def __init__(self, max_workers: int, thread_name_prefix: str = ""):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=thread_name_prefix)
+        self._slots = threading.BoundedSemaphore(max_workers)
+
+    def try_submit(self, func: Callable[..., T], *args) -> Optional["Future[T]"]:
+        """Starts `func(*args)` on a free worker, or returns None if every worker is busy."""
+        if not self._slots.acquire(blocking=False):
+            return None
+        try:
+            future = self._pool.submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
+
+
+def hedged_call(func: Callable[[float], T], budget_s: float, hedge_after_s: float, executor: BoundedExecutor) -> T:
+    """Runs `func`, and a second copy of it if the first is slower than `hedge_after_s`.
+
+    The first successful result wins; the slower request is left to finish in
+    the background and its result is discarded. If both fail, the error of the
+    first request is raised. If the pool has no free worker, the request runs
+    on the caller's thread without a hedge, and if no worker is free for the
+    hedge, the first request is simply awaited.
+
+    Args:
+        func (Callable[[float], T]): An idempotent call (e.g. a classification
+            request). It receives the time left of `budget_s` when it starts,
+            so time spent before it runs is not granted twice.
+        budget_s (float): The time budget of the call, e.g. its timeout.
+        hedge_after_s (float): How long to wait before sending the hedge request.
+        executor (BoundedExecutor): Runs the requests.
+
+    Returns:
+        T: The result of whichever request succeeded first.
+
+    Raises:
+        DeadlineExceeded: If the budget ran out before a request could start.
+    """
+    start = time.monotonic()
+
+    def run() -> T:
+        remaining_s = budget_s - (time.monotonic() - start)
+        if remaining_s <= 0:
+            raise DeadlineExceeded("The call's budget ran out before the request started.")
+        return func(remaining_s)
+
+    # Copy the caller's context so tracing spans still see the current turn.
+    primary = executor.try_submit(contextvars.copy_context().run, run)
+    if primary is None:
+        return run()
+    done, _ = wait([primary], timeout=hedge_after_s)
+    if done:
+        return primary.result()
+
+    hedge = executor.try_submit(contextvars.copy_context().run, run)
+    if hedge is None:
+        print(f"INFO: Not hedging request still running after {hedge_after_s:.2f}s: no free worker.")
+        return primary.result()
+    print(f"INFO: Hedging request still running after {hedge_after_s:.2f}s.")
+    pending = {primary, hedge}
+    first_error: Optional[BaseException] = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            error = future.exception()
+            if error is None:
+                return future.result()
+            if first_error is None or future is primary:
+                first_error = error
+    raise first_error
+
+
+class CircuitBreaker:
+    """A consecutive-failure circuit breaker with a half-open probe.
+
+    - closed: calls flow normally; `failure_threshold` consecutive failures open it.
+    - open: calls are rejected for `reset_timeout_s`.
+    - half-open: one probe call is allowed; success closes the circuit,
+      failure opens it again.
+
+    Only failures that indicate an unhealthy provider should be recorded
+    (see `record_neutral` for the others).
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_s: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout_s = reset_timeout_s
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state()
+
+    def allow(self) -> bool:
+        """Returns True if a call may be made now."""
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._probe_in_flight or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    print(f"Warning: Circuit breaker opened after {self._failures} consecutive failures.")
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def record_neutral(self) -> None:
+        """Ends a call whose error says nothing about the provider's health (e.g. a 400).
+
+        The failure count is kept as is; a half-open probe is released so the
+        next call can probe again.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def _current_state(self) -> str:
+        # Caller holds the lock.
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout_s:
+            self._state = self.HALF_OPEN
+        return self._state
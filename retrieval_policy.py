@@ -0,0 +1,237 @@
+# retrieval_policy.py
+
+"""
+Per-intent retrieval parameters for the knowledge base search.
+
+Every turn used to fetch k=3 articles and cut each to 750 characters,
+whatever the user asked. A `RetrievalPolicy` decides per intent:
+
+- `k`: how many articles may reach the prompt (0 skips retrieval),
+- `max_distance`: articles further from the query than this cosine distance
+  are dropped (the closest one is always kept),
+- `chunk_chars` / `budget_chars`: the truncation of each article and of all
+  articles together,
+- `early_stop_gap`: if the best article is closer than the runner-up by at
+  least this much, it is the answer and the rest is noise, so only it is kept.
+- `diversify`: over-fetch `fetch_factor` candidates per slot and pick the `k`
+  articles by maximal marginal relevance (MMR) over their stored embeddings,
+  so near-duplicate pages do not fill every slot with the same content.
+
+`query_vector_db` fetches `fetch_k` candidates with their distances (and
+embeddings) and `RetrievalPolicy.select` trims them. Candidates are first
+collapsed to one per page: the same URL, anchor or documentation version
+counts as one section. For example, a ticket follow-up keeps a single,
+longer article while a new issue gets broader, de-duplicated recall.
+
+Individual values can be overridden per intent with the JSON environment
+variable `RETRIEVAL_POLICY_OVERRIDES`, e.g. '{"new_issue": {"k": 6}}'.
+"""
+
+# Standard library imports
+import json
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+# Third-party imports
+import numpy as np
+from dotenv import load_dotenv
+
+# Local application/library specific imports
+import tracing
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+RETRIEVAL_POLICY_OVERRIDES = os.getenv("RETRIEVAL_POLICY_OVERRIDES", "")
+# A remaining budget smaller than this is not worth another (truncated) article.
+MIN_CHUNK_CHARS = 200
+# Candidates fetched per result slot when a policy diversifies.
+RETRIEVAL_FETCH_FACTOR = int(os.getenv("RETRIEVAL_FETCH_FACTOR", "3"))
+# MMR trade-off: 1.0 ranks by relevance only, lower values favor novelty.
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", "0.7"))
+# Candidates at least this similar (cosine) to a selected article are duplicates.
+DUPLICATE_SIMILARITY = float(os.getenv("RETRIEVAL_DUPLICATE_SIMILARITY", "0.95"))
+DOCS_VERSION_PATTERN = re.compile(r"/docs/[^/]+/")
+
+
+def section_key(url: str) -> str:
+    """Returns the page a URL belongs to, ignoring its anchor and documentation version."""
+    return DOCS_VERSION_PATTERN.sub("/docs/*/", url.split("#", 1)[0])
+
+
+def collapse_sections(chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Keeps the closest chunk of every page (input sorted by distance)."""
+    seen = set()
+    collapsed = []
+    for chunk in chunks:
+        key = section_key(chunk["url"])
+        if key not in seen:
+            seen.add(key)
+            collapsed.append(chunk)
+    return collapsed
+
+
+def mmr_order(distances: np.ndarray, embeddings: np.ndarray, k: int, mmr_lambda: float = RETRIEVAL_MMR_LAMBDA) -> List[int]:
+    """Selects up to `k` candidates by maximal marginal relevance.
+
+    Each step picks the candidate maximizing
+    `lambda * relevance - (1 - lambda) * max similarity to the selected ones`,
+    where relevance is the cosine similarity to the query (1 - distance).
+    Candidates that are near-duplicates of a selected one are never picked.
+
+    Args:
+        distances (np.ndarray): Cosine distances to the query, shape (n,).
+        embeddings (np.ndarray): Candidate vectors, shape (n, dim).
+        k (int): The maximum number of candidates to select.
+        mmr_lambda (float, optional): The relevance/novelty trade-off.
+
+    Returns:
+        List[int]: Indexes of the selected candidates, in selection order.
+    """
+    if len(distances) == 0 or k <= 0:
+        return []
+    relevance = 1.0 - distances
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = embeddings / np.where(norms == 0, 1.0, norms)
+    similarity = unit @ unit.T
+
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    while len(selected) < min(k, len(distances)):
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity
+        scores[selected] = -np.inf
+        scores[max_similarity >= DUPLICATE_SIMILARITY] = -np.inf
+        best = int(np.argmax(scores))
+        if not np.isfinite(scores[best]):
+            break
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+    return selected
+
+
+class RetrievalPolicy:
+    """How many knowledge base articles a turn retrieves and how much of them it keeps."""
+
+    def __init__(
+        self,
+        name: str,
+        k: int,
+        chunk_chars: int = 750,
+        budget_chars: Optional[int] = None,
+        max_distance: Optional[float] = None,
+        early_stop_gap: Optional[float] = None,
+        diversify: bool = False,
+        fetch_factor: int = RETRIEVAL_FETCH_FACTOR
+    ):
+        self.name = name
+        self.k = k
+        self.chunk_chars = chunk_chars
+        self.budget_chars = budget_chars if budget_chars is not None else k * chunk_chars
+        self.max_distance = max_distance
+        self.early_stop_gap = early_stop_gap
+        # A single result has nothing to be diverse from.
+        self.diversify = diversify and k > 1
+        self.fetch_factor = fetch_factor
+
+    @property
+    def fetch_k(self) -> int:
+        """The number of candidates to fetch from the search."""
+        return self.k * self.fetch_factor if self.diversify else self.k
+
+    def select(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Keeps the articles worth sending to the LLM, truncated to the budget.
+
+        Args:
+            chunks (List[Dict[str, Any]]): Search results sorted by 'distance'
+                (as returned by `query_vector_db`, with 'embedding' when the
+                policy diversifies).
+
+        Returns:
+            List[Dict[str, Any]]: New dictionaries with 'title', 'url' and the
+            truncated 'content' (the distance is not sent to the LLM).
+        """
+        candidates = collapse_sections(chunks)
+        if self.max_distance is not None:
+            candidates = candidates[:1] + [c for c in candidates[1:] if c["distance"] <= self.max_distance]
+        early_stop = (
+            self.early_stop_gap is not None
+            and len(candidates) > 1
+            and candidates[1]["distance"] - candidates[0]["distance"] >= self.early_stop_gap
+        )
+        if early_stop:
+            candidates = candidates[:1]
+        elif self.diversify and len(candidates) > 1 and all("embedding" in c for c in candidates):
+            order = mmr_order(
+                np.array([c["distance"] for c in candidates], dtype=np.float32),
+                np.array([c["embedding"] for c in candidates], dtype=np.float32),
+                self.k
+            )
+            candidates = [candidates[i] for i in order]
+        candidates = candidates[:self.k]
+
+        selected = []
+        remaining = self.budget_chars
+        for chunk in candidates:
+            limit = min(self.chunk_chars, remaining)
+            if limit < MIN_CHUNK_CHARS:
+                break
+            content = chunk["content"]
+            if len(content) > limit:
+                content = content[:limit] + "..."
+            selected.append({"content": content, "title": chunk["title"], "url": chunk["url"]})
+            remaining -= len(content)
+
+        tracing.set_attributes(
+            policy=self.name,
+            fetched=len(chunks),
+            kept=len(selected),
+            diversified=self.diversify,
+            early_stop=early_stop,
+            top_distance=round(chunks[0]["distance"], 4) if chunks else None,
+        )
+        return selected
+
+
+def _default_policies() -> Dict[str, RetrievalPolicy]:
+    return {
+        # Broad recall: the cause of a new problem is not known yet.
+        "new_issue": RetrievalPolicy("new_issue", k=5, budget_chars=3000, max_distance=0.6, early_stop_gap=0.15, diversify=True),
+        "general_question": RetrievalPolicy("general_question", k=3, max_distance=0.6, early_stop_gap=0.15, diversify=True),
+        # A ticket follow-up needs one precise article, so more of it fits.
+        "ticket_inquiry": RetrievalPolicy("ticket_inquiry", k=1, chunk_chars=1200),
+        # A ticket listing is mostly answered from the ticket context.
+        "ticket_history_inquiry": RetrievalPolicy("ticket_history_inquiry", k=1, chunk_chars=600),
+        # Questions about the conversation itself need no documentation.
+        "conversation_history_inquiry": RetrievalPolicy("conversation_history_inquiry", k=0),
+    }
+
+
+DEFAULT_POLICY = RetrievalPolicy("default", k=3, diversify=True)
+
+
+def _load_policies() -> Dict[str, RetrievalPolicy]:
+    """Builds the policies, applying `RETRIEVAL_POLICY_OVERRIDES`."""
+    policies = _default_policies()
+    if not RETRIEVAL_POLICY_OVERRIDES:
+        return policies
+    try:
+        overrides = json.loads(RETRIEVAL_POLICY_OVERRIDES)
+        for intent, values in overrides.items():
+            base = policies.get(intent, DEFAULT_POLICY)
+            settings = {key: getattr(base, key) for key in ("k", "chunk_chars", "budget_chars", "max_distance", "early_stop_gap", "diversify", "fetch_factor")}
+            settings.update(values)
+            policies[intent] = RetrievalPolicy(intent, **settings)
+    except (ValueError, TypeError, AttributeError) as e:
+        print(f"Warning: Ignoring invalid RETRIEVAL_POLICY_OVERRIDES: {e}")
+        return _default_policies()
+    return policies
+
+
+POLICIES = _load_policies()
+
+
+def for_intent(intent: str) -> RetrievalPolicy:
+    """Returns the retrieval policy of an intent (the default policy for unknown intents)."""
+    return POLICIES.get(intent, DEFAULT_POLICY)
@@ -9,19 +9,87 @@ CREATE EXTENSION IF NOT EXISTS age;
 -- Drop existing tables in reverse order of dependency to ensure a clean setup.
 -- The 'CASCADE' option will automatically remove any dependent objects.
 DROP TABLE IF EXISTS pg_docs CASCADE;
+DROP TABLE IF EXISTS ticket_events CASCADE;
 DROP TABLE IF EXISTS tickets CASCADE;
+DROP SEQUENCE IF EXISTS ticket_number_seq;
+DROP TABLE IF EXISTS customers CASCADE;
+DROP TABLE IF EXISTS conversation_sessions CASCADE;
+DROP TABLE IF EXISTS message_archive CASCADE;
 
 -- Table for storing support tickets (System of Record)
+-- Ticket IDs are generated by the database (TICKET-000001, ...), so concurrent
+-- creations never collide.
+CREATE SEQUENCE ticket_number_seq;
 CREATE TABLE tickets (
     id SERIAL PRIMARY KEY,
-    ticket_id VARCHAR(50) UNIQUE NOT NULL,
+    ticket_id VARCHAR(50) UNIQUE NOT NULL DEFAULT 'TICKET-' || lpad(nextval('ticket_number_seq')::text, 6, '0'),
     user_id INTEGER NOT NULL,
     status VARCHAR(50) DEFAULT 'Open',
     description TEXT,
-    log TEXT,
+    -- Embedding of the description, computed once at creation (see database.create_ticket).
+    embedding VECTOR(384),
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Composite index backing the per-user ticket listing. It matches the
+-- `ORDER BY created_at DESC, id DESC` keyset pagination in database.py, so
+-- fetching a page (or the most recent N tickets) is an index range scan
+-- instead of a sequential scan plus sort, even for users with thousands of tickets.
+-- INCLUDE (status) lets the per-status counts run as an index-only scan.
+CREATE INDEX tickets_user_created_idx ON tickets (user_id, created_at DESC, id DESC) INCLUDE (status);
+-- Similar-ticket search over resolved tickets only; the predicate must match
+-- database.RESOLVED_TICKET_STATUSES.
+CREATE INDEX tickets_resolved_embedding_idx ON tickets
+    USING hnsw (embedding vector_cosine_ops) WHERE status IN ('Resolved', 'Closed');
+
+-- Append-only ticket log: one row per entry, so appending never rewrites the
+-- ticket row and the latest N entries are a backward range scan of the index.
+CREATE TABLE ticket_events (
+    id BIGSERIAL PRIMARY KEY,
+    ticket_id VARCHAR(50) NOT NULL REFERENCES tickets (ticket_id) ON DELETE CASCADE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    entry TEXT NOT NULL
+);
+CREATE INDEX ticket_events_ticket_idx ON ticket_events (ticket_id, id);
+
+-- Customers and the PostgreSQL major version they run. Knowledge base searches
+-- are filtered to documents of that version.
+CREATE TABLE customers (
+    user_id INTEGER PRIMARY KEY,
+    name TEXT,
+    pg_version SMALLINT
+);
+
+-- One row per conversation. The session ID is also the ID of the conversation's
+-- Session node in the graph; per-session state (the active ticket) lives here so
+-- any app or API worker can serve the next turn.
+CREATE TABLE conversation_sessions (
+    session_id VARCHAR(64) PRIMARY KEY,
+    user_id INTEGER NOT NULL,
+    active_ticket_id VARCHAR(50),
+    -- Lease of the running turn, so only one worker serves a session at a time
+    -- (see database.begin_session_turn).
+    turn_token VARCHAR(32),
+    turn_lease_until TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX conversation_sessions_user_idx ON conversation_sessions (user_id, updated_at DESC);
+
+-- Cold storage for conversation messages removed from the graph by the retention
+-- job (graph_retention.py). Not read by the agent.
+CREATE TABLE message_archive (
+    id BIGSERIAL PRIMARY KEY,
+    session_id VARCHAR(64) NOT NULL,
+    author TEXT,
+    text TEXT,
+    sent_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    -- Orders messages with the same sent_at (see migrations/010_message_archive_message_id.sql).
+    message_id VARCHAR(32),
+    archived_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX message_archive_session_idx ON message_archive (session_id, sent_at);
+
 -- Table for the knowledge base documents and their vector embeddings (RAG)
 -- The vector dimension (384) must match the embedding model used (e.g., 'all-MiniLM-L6-v2').
 CREATE TABLE pg_docs (
@@ -29,24 +97,53 @@ CREATE TABLE pg_docs (
     title TEXT,
     url TEXT UNIQUE, -- Added UNIQUE constraint to prevent duplicate document URLs
     content TEXT,
-    embedding VECTOR(384)
+    pg_version SMALLINT NOT NULL, -- PostgreSQL major version the document describes
+    embedding VECTOR(384),
+    -- Half-precision copy used by VECTOR_SEARCH_MODE=half/binary (see migrations/001_quantized_embeddings.sql).
+    embedding_half HALFVEC(384)
 );
 
 -- Optional but highly recommended: Create an index on the embedding column for faster similarity searches.
 -- HNSW (Hierarchical Navigable Small World) is a modern, fast index type for vector data.
--- This uses L2 distance, which is appropriate for the sentence-transformer models.
-CREATE INDEX ON pg_docs USING HNSW (embedding vector_l2_ops);
+-- The search orders by cosine distance (<=>), so the index uses cosine ops.
+CREATE INDEX pg_docs_embedding_cosine_idx ON pg_docs USING HNSW (embedding vector_cosine_ops);
+CREATE INDEX pg_docs_embedding_half_idx ON pg_docs USING HNSW (embedding_half halfvec_cosine_ops);
+-- Binary-quantized first pass (1 bit per dimension), re-scored with embedding_half.
+CREATE INDEX pg_docs_embedding_bit_idx ON pg_docs USING HNSW ((binary_quantize(embedding_half)::bit(384)) bit_hamming_ops);
+-- Version filters. ingest_data.py also adds a partial HNSW index per loaded version.
+CREATE INDEX pg_docs_pg_version_idx ON pg_docs (pg_version);
 
 -- Idempotently create the graph for Apache AGE conversation history.
 -- We check for its existence before creating it.
+-- The labels are created up front as well: the agent runs its Cypher as
+-- prepared statements, which must not be planned against a missing label.
 DO $$
+DECLARE
+    vlabel TEXT;
+    elabel TEXT;
 BEGIN
     IF NOT EXISTS (SELECT 1 FROM ag_catalog.ag_graph WHERE name = 'customer_support_graph') THEN
         PERFORM create_graph('customer_support_graph');
     END IF;
+    FOREACH vlabel IN ARRAY ARRAY['User', 'Session', 'Message'] LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM ag_catalog.ag_label l JOIN ag_catalog.ag_graph g ON g.graphid = l.graph
+            WHERE g.name = 'customer_support_graph' AND l.name = vlabel
+        ) THEN
+            PERFORM create_vlabel('customer_support_graph', vlabel);
+        END IF;
+    END LOOP;
+    FOREACH elabel IN ARRAY ARRAY['HAS_SESSION', 'CONTAINS'] LOOP
+        IF NOT EXISTS (
+            SELECT 1 FROM ag_catalog.ag_label l JOIN ag_catalog.ag_graph g ON g.graphid = l.graph
+            WHERE g.name = 'customer_support_graph' AND l.name = elabel
+        ) THEN
+            PERFORM create_elabel('customer_support_graph', elabel);
+        END IF;
+    END LOOP;
 END
 $$;
 
 -- Inform the user that the schema setup is complete.
 -- In psql, this will print a notice. When run from the Python script, it will be ignored.
-\echo 'Schema setup complete: tables (tickets, pg_docs) and graph (customer_support_graph) are ready.'
\ No newline at end of file
+\echo 'Schema setup complete: tables (tickets, ticket_events, customers, conversation_sessions, message_archive, pg_docs) and graph (customer_support_graph) are ready.'
\ No newline at end of file
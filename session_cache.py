@@ -0,0 +1,260 @@
+# session_cache.py
+
+"""
+Write-through, in-process cache of recent conversation history per session.
+
+`database.add_message_to_graph` appends every message it commits to the
+cache, and `database.get_conversation_history` reads from the cache first, so
+a session's history is only fetched from the Apache AGE graph on a miss (cold
+start, eviction or invalidation). The cache is bounded by an LRU over
+sessions and keeps the last `HISTORY_CACHE_DEPTH` messages of each session,
+plus the session's rolling summary (see `summarizer.py`).
+
+**Coherence across processes:** every graph write also sends a
+`NOTIFY session_history, '<process token>:<session_id>'` in the same
+transaction. Each process runs a listener thread on a dedicated connection
+and drops the cached entry of any session written by *another* process. If
+the listener is down, the cache is bypassed entirely (and cleared), so a
+stale read is never served.
+
+Modes (`HISTORY_CACHE_MODE`):
+- "notify" (default): cache with cross-process invalidation.
+- "local": cache without a listener. Only safe with a single app process.
+- "off": always read from the graph.
+"""
+
+# Standard library imports
+import os
+import select
+import threading
+import uuid
+from collections import OrderedDict, deque
+from typing import Any, Callable, Deque, Dict, List, Optional
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+HISTORY_CACHE_MODE = os.getenv("HISTORY_CACHE_MODE", "notify").lower()
+HISTORY_CACHE_SESSIONS = int(os.getenv("HISTORY_CACHE_SESSIONS", "1000"))
+HISTORY_CACHE_DEPTH = int(os.getenv("HISTORY_CACHE_DEPTH", "20"))
+NOTIFY_CHANNEL = "session_history"
+
+# Identifies this process in NOTIFY payloads so it can ignore its own writes.
+PROCESS_TOKEN = uuid.uuid4().hex
+
+
+class SessionHistoryCache:
+    """An LRU of sessions, each holding a bounded deque of its latest messages.
+
+    A cached deque holding fewer than `depth` messages is the *complete*
+    history of the session, so it can answer a request for any `n`. A full
+    deque can only answer requests for `n <= depth`.
+
+    To avoid caching a snapshot that raced with a concurrent write, every
+    write or invalidation stamps the session with a new generation number,
+    and a graph snapshot is only stored if it was read after the session's
+    last stamp (see `begin_load` / `put`).
+    """
+
+    def __init__(self, max_sessions: int = HISTORY_CACHE_SESSIONS, depth: int = HISTORY_CACHE_DEPTH):
+        self.max_sessions = max_sessions
+        self.depth = depth
+        self._sessions: "OrderedDict[str, Deque[Dict[str, Any]]]" = OrderedDict()
+        self._summaries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._write_generations: "OrderedDict[str, int]" = OrderedDict()
+        self._evicted_generation = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, session_id: str, n: int) -> Optional[List[Dict[str, Any]]]:
+        """Returns the last `n` cached messages of a session, or None on a miss."""
+        with self._lock:
+            messages = self._sessions.get(session_id)
+            if messages is None or (n > self.depth and len(messages) >= self.depth):
+                self.misses += 1
+                return None
+            self._sessions.move_to_end(session_id)
+            self.hits += 1
+            return list(messages)[-n:] if n > 0 else []
+
+    def begin_load(self) -> int:
+        """Returns the generation to pass to `put` after reading from the graph."""
+        with self._lock:
+            return self._generation
+
+    def put(self, session_id: str, messages: List[Dict[str, Any]], loaded_at: int) -> None:
+        """Caches a history snapshot read from the graph (oldest first).
+
+        The snapshot is discarded if the session was written or invalidated
+        after `loaded_at`, because it may be missing that write.
+        """
+        with self._lock:
+            last_write = self._write_generations.get(session_id, self._evicted_generation)
+            if last_write > loaded_at:
+                return
+            self._sessions[session_id] = deque(messages[-self.depth:], maxlen=self.depth)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+
+    def append(self, session_id: str, message: Dict[str, Any]) -> None:
+        """Records a message that was just written to the graph."""
+        with self._lock:
+            self._stamp(session_id)
+            messages = self._sessions.get(session_id)
+            if messages is not None:
+                messages.append(message)
+                self._sessions.move_to_end(session_id)
+
+    def get_summary(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Returns the cached summary record of a session, or None on a miss."""
+        with self._lock:
+            summary = self._summaries.get(session_id)
+            if summary is None:
+                self.misses += 1
+                return None
+            self._summaries.move_to_end(session_id)
+            self.hits += 1
+            return dict(summary)
+
+    def put_summary(self, session_id: str, summary: Dict[str, Any], loaded_at: Optional[int] = None) -> None:
+        """Caches a session's summary record.
+
+        Pass `loaded_at` (from `begin_load`) when the record was read from the
+        graph; omit it when this process has just written the record.
+        """
+        with self._lock:
+            if loaded_at is None:
+                self._stamp(session_id)
+            elif self._write_generations.get(session_id, self._evicted_generation) > loaded_at:
+                return
+            self._summaries[session_id] = dict(summary)
+            self._summaries.move_to_end(session_id)
+            while len(self._summaries) > self.max_sessions:
+                self._summaries.popitem(last=False)
+
+    def invalidate(self, session_id: str) -> None:
+        """Drops a session, e.g. because another process wrote to it."""
+        with self._lock:
+            self._stamp(session_id)
+            self._summaries.pop(session_id, None)
+            if self._sessions.pop(session_id, None) is not None:
+                self.invalidations += 1
+
+    def clear(self) -> None:
+        """Drops every cached session."""
+        with self._lock:
+            self._generation += 1
+            self._evicted_generation = self._generation
+            self._write_generations.clear()
+            self._sessions.clear()
+            self._summaries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        """Returns the cache size and hit/miss/invalidation counters."""
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+    def _stamp(self, session_id: str) -> None:
+        # Caller holds the lock. The stamp map is bounded like the cache; the
+        # highest evicted stamp is kept as a conservative floor.
+        self._generation += 1
+        self._write_generations[session_id] = self._generation
+        self._write_generations.move_to_end(session_id)
+        while len(self._write_generations) > 2 * self.max_sessions:
+            _, evicted = self._write_generations.popitem(last=False)
+            self._evicted_generation = max(self._evicted_generation, evicted)
+
+
+class InvalidationListener:
+    """Background thread that applies other processes' NOTIFY messages to the cache."""
+
+    def __init__(self, cache: SessionHistoryCache, connect: Callable[[], Any], retry_interval_s: float = 5.0):
+        self.cache = cache
+        self.connect = connect
+        self.retry_interval_s = retry_interval_s
+        self.connected = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="history-cache-listener", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            conn = None
+            try:
+                conn = self.connect()
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NOTIFY_CHANNEL};")
+                # Anything cached before LISTEN took effect may have missed a notification.
+                self.cache.clear()
+                self.connected.set()
+                while True:
+                    if select.select([conn], [], [], self.retry_interval_s) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        self._apply(conn.notifies.pop(0).payload)
+            except Exception as e:
+                print(f"Warning: History cache listener disconnected: {e}")
+            finally:
+                self.connected.clear()
+                self.cache.clear()
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+            threading.Event().wait(self.retry_interval_s)
+
+    def _apply(self, payload: str) -> None:
+        token, _, session_id = payload.partition(":")
+        if token != PROCESS_TOKEN:
+            self.cache.invalidate(session_id)
+
+
+history_cache = SessionHistoryCache()
+_listener: Optional[InvalidationListener] = None
+_listener_lock = threading.Lock()
+
+
+def is_enabled(connect: Callable[[], Any]) -> bool:
+    """Reports whether the cache may be used right now, starting the listener if needed.
+
+    Args:
+        connect (Callable[[], Any]): Opens a dedicated (non-pooled) database
+            connection for the NOTIFY listener.
+
+    Returns:
+        bool: True if cached history can be trusted. In "notify" mode this is
+        only the case while the listener is connected.
+    """
+    global _listener
+    if HISTORY_CACHE_MODE == "off":
+        return False
+    if HISTORY_CACHE_MODE == "local":
+        return True
+    if _listener is None:
+        with _listener_lock:
+            if _listener is None:
+                _listener = InvalidationListener(history_cache, connect)
+                _listener.start()
+    return _listener.connected.is_set()
+
+
+def notify_payload(session_id: str) -> str:
+    """Builds the NOTIFY payload announcing a write to `session_id`."""
+    return f"{PROCESS_TOKEN}:{session_id}"
@@ -0,0 +1,152 @@
+# startup.py
+
+"""
+Startup warm-up and readiness state.
+
+A cold process would make its first turn pay for several one-time costs at
+once. `warm_up` runs them in parallel before traffic arrives:
+
+- "embedding_model": loading the SentenceTransformer and encoding a probe query.
+- "db_pool": opening `DB_POOL_MINCONN` pooled connections with their AGE
+  setup (creating the graph on a fresh database).
+- "llm": the DNS, TCP and TLS handshake with the Groq API.
+- "pg_prewarm" (only with `STARTUP_PG_PREWARM=true`): loading `pg_docs` and
+  its HNSW index into shared buffers (needs migrations/006_pg_prewarm.sql).
+
+The process is ready once the embedding model and the database pool are
+warm. The other steps are reported but do not block readiness: an LLM call
+retries on its own, and prewarming only saves disk reads. `api.py` runs the
+warm-up in the background and exposes the state at `GET /readyz`.
+"""
+
+# Standard library imports
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Local application/library specific imports
+import agent
+import database as db
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+STARTUP_PG_PREWARM = os.getenv("STARTUP_PG_PREWARM", "false").lower() == "true"
+# Encoded once so the first real query does not pay for the first forward pass.
+WARM_UP_QUERY = "How do I tune PostgreSQL for better performance?"
+REQUIRED_STEPS = ("embedding_model", "db_pool")
+
+
+class StartupState:
+    """The outcome of each warm-up step, shared with the readiness probe."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.duration_ms: Optional[float] = None
+
+    def record(self, name: str, ok: bool, duration_ms: float, detail: Optional[Dict[str, Any]] = None) -> None:
+        with self._lock:
+            self.steps[name] = {"ok": ok, "duration_ms": round(duration_ms, 1), **(detail or {})}
+
+    def finish(self, duration_ms: float) -> None:
+        self.duration_ms = round(duration_ms, 1)
+        self._finished.set()
+
+    @property
+    def ready(self) -> bool:
+        with self._lock:
+            return self._finished.is_set() and all(self.steps.get(name, {}).get("ok") for name in REQUIRED_STEPS)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Returns the readiness, the total warm-up time and the outcome of each step."""
+        ready = self.ready
+        with self._lock:
+            return {
+                "ready": ready,
+                "finished": self._finished.is_set(),
+                "duration_ms": self.duration_ms,
+                "steps": {name: dict(step) for name, step in self.steps.items()},
+            }
+
+
+state = StartupState()
+
+
+def _warm_embedding_model() -> None:
+    db.get_embedding_model().encode(WARM_UP_QUERY)
+
+
+def _warm_db_pool() -> Dict[str, Any]:
+    connections = db.warm_connection_pool()
+    if not connections:
+        raise RuntimeError("no database connection could be opened")
+    return {"connections": connections}
+
+
+def _warm_llm() -> None:
+    if not agent.llm.warm_up():
+        raise RuntimeError("the LLM provider did not answer")
+
+
+def _prewarm_knowledge_base() -> Dict[str, Any]:
+    blocks = db.prewarm_knowledge_base()
+    if blocks is None:
+        raise RuntimeError("pg_prewarm failed (is migrations/006_pg_prewarm.sql applied? see the warning above)")
+    return {"blocks": blocks}
+
+
+def _run_step(name: str, func: Callable[[], Optional[Dict[str, Any]]]) -> None:
+    start = time.perf_counter()
+    try:
+        detail = func()
+        ok = True
+    except Exception as e:
+        print(f"Warning: Warm-up step '{name}' failed: {e}")
+        detail = {"error": str(e)}
+        ok = False
+    state.record(name, ok, (time.perf_counter() - start) * 1000, detail)
+
+
+def warm_up(pg_prewarm: bool = STARTUP_PG_PREWARM) -> Dict[str, Any]:
+    """Runs every warm-up step in parallel and waits for all of them.
+
+    Returns:
+        Dict[str, Any]: The startup state (see `StartupState.snapshot`).
+    """
+    steps = {
+        "embedding_model": _warm_embedding_model,
+        "db_pool": _warm_db_pool,
+        "llm": _warm_llm,
+    }
+    if pg_prewarm:
+        steps["pg_prewarm"] = _prewarm_knowledge_base
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(steps), thread_name_prefix="warm-up") as executor:
+        for name, func in steps.items():
+            executor.submit(_run_step, name, func)
+    state.finish((time.perf_counter() - start) * 1000)
+
+    snapshot = state.snapshot()
+    timings = ", ".join(f"{name} {step['duration_ms']:.0f}ms" for name, step in snapshot["steps"].items())
+    print(f"INFO: Warm-up finished in {snapshot['duration_ms']:.0f}ms ({timings}); ready={snapshot['ready']}.")
+    return snapshot
+
+
+def start_in_background(pg_prewarm: bool = STARTUP_PG_PREWARM) -> threading.Thread:
+    """Runs `warm_up` on a daemon thread, so the server can answer probes meanwhile."""
+    thread = threading.Thread(target=warm_up, args=(pg_prewarm,), daemon=True, name="warm-up")
+    thread.start()
+    return thread
+
+
+def is_ready() -> bool:
+    return state.ready
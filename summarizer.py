@@ -0,0 +1,144 @@
+# summarizer.py
+
+"""
+Background rolling summarization of conversation sessions.
+
+The agent only sends the last `HISTORY_TAIL_MESSAGES` messages of a session
+verbatim. Everything older is folded into a compact running summary stored on
+the session's `Session` node (`summary` and `summarized_until` properties),
+so the prompt size stays flat no matter how long the conversation runs and
+nothing that falls out of the window is lost. The watermark of folded
+messages is the (timestamp, message ID) of the newest one, so messages that
+share its millisecond (written by another process) are not skipped.
+
+Summaries are updated by a single background worker thread after each turn,
+off the critical path of the response: `schedule(session_id)` only enqueues
+the session. Repeated requests for a session that is already queued are
+collapsed into one update.
+"""
+
+# Standard library imports
+import os
+import queue
+import threading
+from typing import Optional
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Local application/library specific imports
+import database as db
+import prompts
+import tracing
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+# Number of most recent messages the agent sends verbatim alongside the summary.
+HISTORY_TAIL_MESSAGES = int(os.getenv("HISTORY_TAIL_MESSAGES", "5"))
+# Minimum number of messages outside the tail before a summary update is worth an LLM call.
+SUMMARY_MIN_MESSAGES = int(os.getenv("SUMMARY_MIN_MESSAGES", "2"))
+# Messages per summary update when the retention job folds a long backlog.
+FOLD_SLICE_MESSAGES = int(os.getenv("FOLD_SLICE_MESSAGES", "40"))
+
+class ConversationSummarizer:
+    """Folds messages that left the recent-history window into the session summary."""
+
+    def __init__(self, llm, keep_last: int = HISTORY_TAIL_MESSAGES, min_messages: int = SUMMARY_MIN_MESSAGES):
+        """Initializes the summarizer.
+
+        Args:
+            llm: An `LlmClient` (or compatible object) providing `generate_summary`.
+            keep_last (int, optional): Messages the agent keeps verbatim.
+            min_messages (int, optional): Messages outside the tail required
+                before an update is made.
+        """
+        self.llm = llm
+        self.keep_last = keep_last
+        self.min_messages = min_messages
+        self._queue: "queue.Queue[str]" = queue.Queue()
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    def schedule(self, session_id: str) -> None:
+        """Queues a summary update for a session without blocking the caller."""
+        with self._pending_lock:
+            if session_id in self._pending:
+                return
+            self._pending.add(session_id)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="conversation-summarizer", daemon=True)
+                self._thread.start()
+        self._queue.put(session_id)
+
+    def wait_idle(self) -> None:
+        """Blocks until every queued update has been processed (used by scripts and benchmarks)."""
+        self._queue.join()
+
+    def _run(self) -> None:
+        while True:
+            session_id = self._queue.get()
+            with self._pending_lock:
+                self._pending.discard(session_id)
+            try:
+                self.update_summary(session_id)
+            except Exception as e:
+                print(f"Warning: Failed to update summary for session {session_id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    def update_summary(self, session_id: str) -> bool:
+        """Synchronously folds any messages that left the tail into the summary.
+
+        Args:
+            session_id (str): The session to update.
+
+        Returns:
+            bool: True if a new summary was written, False if there was
+            nothing (or not enough) to fold in or the update failed.
+        """
+        current = db.get_session_summary(session_id)
+        messages = db.get_messages_to_summarize(
+            session_id, self.keep_last, current["summarized_until"], current.get("summarized_until_id", "")
+        )
+        if len(messages) < self.min_messages:
+            return False
+        return self._fold(session_id, current, messages)
+
+    def fold_expired(self, session_id: str, cutoff: int) -> bool:
+        """Folds every message older than `cutoff` into the summary, even inside the tail.
+
+        Used by the graph retention job (`graph_retention.py`) before it
+        deletes expired messages, so an idle session keeps their gist.
+
+        Returns:
+            bool: True if the summary now covers every message older than `cutoff`.
+        """
+        current = db.get_session_summary(session_id)
+        messages = db.get_messages_to_summarize(
+            session_id, 0, current["summarized_until"], current.get("summarized_until_id", "")
+        )
+        messages = [m for m in messages if m["timestamp"] < cutoff]
+        # Long idle sessions are folded a slice at a time to keep each prompt small.
+        for start in range(0, len(messages), FOLD_SLICE_MESSAGES):
+            if not self._fold(session_id, current, messages[start:start + FOLD_SLICE_MESSAGES]):
+                return False
+            current = db.get_session_summary(session_id)
+        return True
+
+    def _fold(self, session_id: str, current: dict, messages: list) -> bool:
+        """Writes a new summary combining `current` with `messages`."""
+        transcript = "\n".join(f"{m['author']}: {m['text']}" for m in messages)
+        with tracing.span("summary_llm"):
+            system_prompt, user_prompt = prompts.SUMMARY.render(
+                summary=current["summary"] or "(none yet)", transcript=transcript
+            )
+            summary = self.llm.generate_summary(system_prompt=system_prompt, user_prompt=user_prompt)
+        if not summary:
+            return False
+
+        print(f"INFO: Folded {len(messages)} messages into the summary of session {session_id}.")
+        newest = messages[-1]
+        return db.set_session_summary(session_id, summary, newest["timestamp"], newest.get("message_id") or "")
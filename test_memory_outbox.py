@@ -0,0 +1,143 @@
+# test_memory_outbox.py
+
+"""
+Tests of the memory outbox that run without a database.
+
+The graph writer is replaced by a function that records the batches it gets
+and can be held back per session, to stand in for a slow graph.
+
+Usage:
+    python3 -m unittest test_memory_outbox.py
+"""
+
+# Standard library imports
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+# Local application/library specific imports
+import memory_outbox
+
+
+class BlockingWriter:
+    """A `write_batch` that holds batches with messages of blocked sessions."""
+
+    def __init__(self, blocked_sessions):
+        self.blocked_sessions = set(blocked_sessions)
+        self.release = threading.Event()
+        self.written = []
+
+    def __call__(self, batch):
+        if any(m["session_id"] in self.blocked_sessions for m in batch):
+            self.release.wait(10)
+        self.written.extend(batch)
+        return True
+
+
+class SessionFlushTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.writer = BlockingWriter({"session-a"})
+        self.outbox = memory_outbox.MemoryOutbox(
+            os.path.join(self.directory.name, "outbox.sqlite3"),
+            self.writer,
+            batch_size=1,
+            flush_interval_s=0.01,
+        )
+        self.outbox.start()
+
+    def tearDown(self):
+        self.writer.release.set()
+        self.outbox.flush(timeout_s=5)
+        self.outbox._lock_file.close()
+        self.directory.cleanup()
+
+    def test_flush_does_not_wait_for_other_sessions(self):
+        self.outbox.enqueue(1, "session-b", "hello", "user")
+        for i in range(20):
+            self.outbox.enqueue(2, "session-a", f"backlog {i}", "user")
+
+        started = time.monotonic()
+        self.assertTrue(self.outbox.flush("session-b", timeout_s=2))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(self.outbox.pending("session-b"), [])
+        self.assertTrue(self.outbox.pending("session-a"))
+
+        # A session with nothing queued returns at once.
+        self.assertTrue(self.outbox.flush("session-c", timeout_s=0))
+        # The whole queue is still held back by session A.
+        self.assertFalse(self.outbox.flush(timeout_s=0.2))
+
+    def test_flush_waits_for_own_session(self):
+        self.outbox.enqueue(2, "session-a", "slow", "user")
+        self.assertFalse(self.outbox.flush("session-a", timeout_s=0.2))
+        self.writer.release.set()
+        self.assertTrue(self.outbox.flush("session-a", timeout_s=5))
+        self.assertEqual([m["text"] for m in self.writer.written], ["slow"])
+
+
+class PermanentError(Exception):
+    pass
+
+
+class DeadLetterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.failing = {}
+        self.dead = []
+        self.outbox = memory_outbox.MemoryOutbox(
+            os.path.join(self.directory.name, "outbox.sqlite3"),
+            self.write,
+            is_permanent=lambda e: isinstance(e, PermanentError),
+            on_dead_letter=self.dead.append,
+            flush_interval_s=0.01,
+        )
+        # Switch to message-by-message writes after the first failure.
+        patcher = mock.patch.object(memory_outbox, "MEMORY_OUTBOX_MAX_ATTEMPTS", 1)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.outbox.start()
+
+    def tearDown(self):
+        self.failing.clear()
+        self.outbox.flush(timeout_s=5)
+        self.outbox._lock_file.close()
+        self.directory.cleanup()
+
+    def write(self, batch):
+        for message in batch:
+            if message["text"] in self.failing:
+                raise self.failing[message["text"]]
+        return True
+
+    def test_permanent_error_is_dead_lettered(self):
+        self.failing["poison"] = PermanentError("bad agtype")
+        poison = self.outbox.enqueue(1, "session-a", "poison", "user")
+        self.outbox.enqueue(2, "session-b", "fine", "user")
+
+        self.assertTrue(self.outbox.flush(timeout_s=5))
+        self.assertEqual(self.outbox.stats()["dead_lettered"], 1)
+        self.assertEqual([m["message_id"] for m in self.dead], [poison["message_id"]])
+        row = self.outbox._db.execute("SELECT message_id, error FROM dead_letter;").fetchone()
+        self.assertEqual(row[0], poison["message_id"])
+        self.assertIn("PermanentError", row[1])
+
+    def test_transient_error_is_retried(self):
+        self.failing["stuck"] = ConnectionError("server closed the connection")
+        self.outbox.enqueue(1, "session-a", "stuck", "user")
+
+        self.assertFalse(self.outbox.flush(timeout_s=0.5))
+        self.assertEqual(self.outbox.stats()["dead_lettered"], 0)
+        self.assertEqual(len(self.outbox.pending("session-a")), 1)
+        del self.failing["stuck"]
+        self.assertTrue(self.outbox.flush(timeout_s=10))
+        self.assertEqual(self.dead, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+# trace_report.py
+
+"""
+Aggregates the per-turn traces written by `tracing.py` into a latency report.
+
+For every stage (span name) it prints the number of samples, the mean, p50 and
+p95 latency in milliseconds, the mean self time, the share of total turn time
+spent in the stage, and the prompt/completion tokens recorded by the LLM
+stages, including the prompt tokens the provider served from its prompt cache
+("tok cached").
+
+Latencies are inclusive: a stage's span contains its nested spans (e.g. the
+graph writes inside `memory_write`). Self time excludes them, and the share is
+computed from self time, so nested time is counted once and the shares of a
+turn add up to 100% ("turn_total" holds the time outside of any stage).
+
+Usage:
+    python3 trace_report.py                      # reads TRACE_FILE (traces/turns.jsonl)
+    python3 trace_report.py path/to/turns.jsonl --intent new_issue
+"""
+
+# Standard library imports
+import argparse
+import json
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# Local application/library specific imports
+from tracing import TRACE_FILE, percentile
+
+
+def load_turns(path: str, intent: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Reads the exported turns from a JSONL file, optionally filtered by intent."""
+    turns = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if intent and record.get("attributes", {}).get("intent") != intent:
+                continue
+            turns.append(record)
+    return turns
+
+
+def aggregate(turns: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """Groups span durations and token counts by stage name.
+
+    A stage that runs several times within one turn (e.g. two graph writes)
+    is summed per turn first, so the percentiles describe the cost a turn
+    pays for that stage. The self time of a stage is its time minus the time
+    of the spans nested in it (spans record their parent's name); spans
+    without a parent are nested in "turn_total".
+    """
+    durations: Dict[str, List[float]] = defaultdict(list)
+    self_times: Dict[str, List[float]] = defaultdict(list)
+    tokens: Dict[str, Dict[str, int]] = defaultdict(lambda: {"prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+
+    for record in turns:
+        per_turn: Dict[str, float] = defaultdict(float)
+        nested: Dict[str, float] = defaultdict(float)
+        per_turn["turn_total"] = record["duration_ms"]
+        for span in record["spans"]:
+            per_turn[span["name"]] += span["duration_ms"]
+            nested[span.get("parent") or "turn_total"] += span["duration_ms"]
+            attributes = span.get("attributes", {})
+            for key in ("prompt_tokens", "completion_tokens", "cached_tokens"):
+                tokens[span["name"]][key] += attributes.get(key) or 0
+        for name, total in per_turn.items():
+            durations[name].append(total)
+            # Spans running in parallel inside one parent can add up to more than it.
+            self_times[name].append(max(0.0, total - nested[name]))
+
+    total_time = sum(durations["turn_total"]) or 1.0
+    stats = {}
+    for name, values in durations.items():
+        stats[name] = {
+            "count": len(values),
+            "mean_ms": sum(values) / len(values),
+            "p50_ms": percentile(values, 50),
+            "p95_ms": percentile(values, 95),
+            "self_ms": sum(self_times[name]) / len(values),
+            "share": sum(self_times[name]) / total_time,
+            "prompt_tokens": tokens[name]["prompt_tokens"],
+            "completion_tokens": tokens[name]["completion_tokens"],
+            "cached_tokens": tokens[name]["cached_tokens"],
+        }
+    return stats
+
+
+def print_report(stats: Dict[str, Dict[str, Any]]) -> None:
+    """Prints the aggregated stats as a table, slowest stages (by p95) first."""
+    header = (
+        f"{'stage':<34}{'n':>6}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}{'self ms':>10}"
+        f"{'share':>8}{'tok in':>9}{'tok cached':>11}{'tok out':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+    for name, s in sorted(stats.items(), key=lambda item: item[1]["p95_ms"], reverse=True):
+        print(
+            f"{name:<34}{s['count']:>6}{s['mean_ms']:>10.1f}{s['p50_ms']:>10.1f}{s['p95_ms']:>10.1f}"
+            f"{s['self_ms']:>10.1f}{s['share']:>8.0%}{s['prompt_tokens']:>9}{s['cached_tokens']:>11}{s['completion_tokens']:>9}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Per-stage latency report for agent turn traces.")
+    parser.add_argument("path", nargs="?", default=TRACE_FILE, help="JSONL trace file to read.")
+    parser.add_argument("--intent", help="Only include turns classified with this intent.")
+    parser.add_argument("--json", action="store_true", help="Print the aggregated stats as JSON.")
+    args = parser.parse_args()
+
+    turns = load_turns(args.path, args.intent)
+    if not turns:
+        print(f"No turns found in {args.path}.")
+        return
+
+    stats = aggregate(turns)
+    if args.json:
+        print(json.dumps(stats, indent=2))
+    else:
+        print(f"Aggregated {len(turns)} turns from {args.path}\n")
+        print_report(stats)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,269 @@
+# tracing.py
+
+"""
+Lightweight per-turn latency tracing for the support agent.
+
+Every call to `agent.get_agent_response` opens a *turn*. Inside a turn, code
+wraps each stage of the pipeline (LLM calls, database calls, embedding, vector
+search, context building, memory writes) in a `span`. When the turn finishes,
+the turn and all of its spans are handed to the configured exporter:
+
+- "jsonl" (default): one JSON object per turn appended to `TRACE_FILE`.
+- "otel": the spans are replayed into OpenTelemetry (requires the optional
+  `opentelemetry-sdk` package and a configured tracer provider).
+- "none": tracing is disabled and all spans become no-ops.
+
+Spans opened outside of a turn (e.g. from the ingestion scripts) are ignored,
+so instrumented helpers can be reused anywhere at no cost.
+
+Use `trace_report.py` to aggregate the exported JSONL into per-stage
+p50/p95 latencies.
+"""
+
+# Standard library imports
+import contextvars
+import functools
+import json
+import math
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# Third-party imports
+from dotenv import load_dotenv
+
+# Load environment variables from .env file
+load_dotenv()
+
+# --- CONFIGURATION ---
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jsonl").lower()
+TRACE_FILE = os.getenv("TRACE_FILE", "traces/turns.jsonl")
+
+# The turn currently being recorded and the innermost open span. Context
+# variables keep concurrent turns (threads or asyncio tasks) isolated.
+_current_turn: contextvars.ContextVar[Optional["Turn"]] = contextvars.ContextVar("current_turn", default=None)
+_current_span: contextvars.ContextVar[Optional[Dict[str, Any]]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Turn:
+    """Collects the spans recorded while a single agent turn is processed."""
+
+    def __init__(self, attributes: Dict[str, Any]):
+        self.turn_id = uuid.uuid4().hex
+        self.attributes = dict(attributes)
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+
+    def elapsed_ms(self) -> float:
+        """Returns the milliseconds elapsed since the turn started."""
+        return (time.perf_counter() - self._start) * 1000
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Serializes the turn and its spans into a JSON-compatible dictionary."""
+        return {
+            "turn_id": self.turn_id,
+            "started_at": self.started_at,
+            "duration_ms": self.duration_ms,
+            "attributes": self.attributes,
+            "spans": self.spans,
+        }
+
+
+# --- EXPORTERS ---
+
+class JsonlExporter:
+    """Appends each finished turn as a single JSON line to a local file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, turn: Turn) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        line = json.dumps(turn.to_dict(), default=str)
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+
+class OtelExporter:
+    """Replays finished turns into an OpenTelemetry tracer.
+
+    The turn becomes the root span and every recorded stage becomes a child
+    span with its original start and end timestamps, so the usual OTel
+    backends (Jaeger, Tempo, Honeycomb, ...) can display the waterfall.
+    """
+
+    def __init__(self):
+        from opentelemetry import trace
+        self._trace = trace
+        self._tracer = trace.get_tracer("customer-support-agent")
+
+    def export(self, turn: Turn) -> None:
+        start_ns = int(turn.started_at * 1e9)
+        end_ns = start_ns + int((turn.duration_ms or 0) * 1e6)
+        root = self._tracer.start_span("agent_turn", start_time=start_ns)
+        for key, value in turn.attributes.items():
+            root.set_attribute(key, _otel_value(value))
+
+        parent_context = self._trace.set_span_in_context(root)
+        for span in turn.spans:
+            span_start = start_ns + int(span["start_ms"] * 1e6)
+            child = self._tracer.start_span(span["name"], context=parent_context, start_time=span_start)
+            for key, value in span["attributes"].items():
+                child.set_attribute(key, _otel_value(value))
+            child.end(end_time=span_start + int(span["duration_ms"] * 1e6))
+        root.end(end_time=end_ns)
+
+
+def _otel_value(value: Any) -> Any:
+    """Coerces an attribute value into a type OpenTelemetry accepts."""
+    if isinstance(value, (str, bool, int, float)):
+        return value
+    return json.dumps(value, default=str)
+
+
+def _build_exporter():
+    """Creates the exporter selected by `TRACE_EXPORTER`, or None if disabled."""
+    if TRACE_EXPORTER == "none":
+        return None
+    if TRACE_EXPORTER == "otel":
+        try:
+            return OtelExporter()
+        except ImportError:
+            print("Warning: TRACE_EXPORTER=otel but opentelemetry is not installed. Falling back to JSONL.")
+    return JsonlExporter(TRACE_FILE)
+
+
+_exporter = _build_exporter()
+
+
+def set_exporter(exporter) -> None:
+    """Replaces the active exporter (any object with an `export(turn)` method, or None)."""
+    global _exporter
+    _exporter = exporter
+
+
+# --- RECORDING API ---
+
+@contextmanager
+def turn(**attributes: Any) -> Iterator[Optional[Turn]]:
+    """Records a single agent turn and exports it when the block exits.
+
+    Args:
+        **attributes: Static attributes describing the turn (e.g. `session_id`).
+
+    Yields:
+        Optional[Turn]: The active turn, or None when tracing is disabled.
+    """
+    if _exporter is None:
+        yield None
+        return
+
+    current = Turn(attributes)
+    turn_token = _current_turn.set(current)
+    span_token = _current_span.set(None)
+    try:
+        yield current
+    except Exception as e:
+        current.attributes["error"] = repr(e)
+        raise
+    finally:
+        current.duration_ms = current.elapsed_ms()
+        _current_span.reset(span_token)
+        _current_turn.reset(turn_token)
+        try:
+            _exporter.export(current)
+        except Exception as e:
+            print(f"Warning: Failed to export turn trace: {e}")
+
+
+@contextmanager
+def span(name: str, **attributes: Any) -> Iterator[Optional[Dict[str, Any]]]:
+    """Times a stage of the current turn.
+
+    Spans nest: the name of the enclosing span is stored as `parent`, which
+    lets the report separate e.g. the graph writes inside `memory_write`.
+
+    Args:
+        name (str): The stage name (e.g. "intent_llm", "vector_search").
+        **attributes: Extra attributes to attach to the span.
+
+    Yields:
+        Optional[Dict[str, Any]]: The span record, or None outside of a turn.
+    """
+    current = _current_turn.get()
+    if current is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    record = {
+        "name": name,
+        "parent": parent["name"] if parent else None,
+        "start_ms": current.elapsed_ms(),
+        "duration_ms": 0.0,
+        "attributes": dict(attributes),
+    }
+    token = _current_span.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record["attributes"]["error"] = repr(e)
+        raise
+    finally:
+        record["duration_ms"] = (time.perf_counter() - start) * 1000
+        _current_span.reset(token)
+        current.spans.append(record)
+
+
+def set_attributes(**attributes: Any) -> None:
+    """Attaches attributes (e.g. token counts) to the innermost open span."""
+    record = _current_span.get()
+    if record is not None:
+        record["attributes"].update(attributes)
+
+
+def set_turn_attributes(**attributes: Any) -> None:
+    """Attaches attributes (e.g. the classified intent) to the current turn."""
+    current = _current_turn.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def traced(name: str) -> Callable:
+    """Decorator that wraps every call of a function in a span called `name`."""
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+# --- AGGREGATION HELPERS ---
+
+def percentile(values: List[float], pct: float) -> float:
+    """Returns the `pct` percentile of `values` using the nearest-rank method.
+
+    Args:
+        values (List[float]): The samples. Does not need to be sorted.
+        pct (float): The percentile to compute, between 0 and 100.
+
+    Returns:
+        float: The percentile value, or 0.0 for an empty sample.
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[min(rank, len(ordered)) - 1]
@@ -21,6 +21,7 @@ if __name__ == "__main__":
     print("\nStep 2: Seeding conversation history...")
     user_id = 1
     session_id = "session_user_1"
+    db.create_session(user_id, session_id)
     messages = [
         {"author": "user", "text": "Hi, I'm having trouble connecting to my database."},
         {"author": "agent", "text": "I can help with that. What is the exact error message you are seeing?"},